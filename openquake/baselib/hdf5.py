@@ -92,6 +92,26 @@ def extend(dset, array, **attrs):
     return newlength
 
 
+def write_blocks(dset, start, stride, array, count):
+    """
+    Write an array as `count` blocks of consecutive elements of a
+    one-dimensional dataset, with a single hyperslab selection: the first
+    block starts at `start` and the others are spaced by `stride`.
+
+    :param dset: a one-dimensional h5py dataset
+    :param start: index of the first element of the first block
+    :param stride: distance between the starts of two consecutive blocks
+    :param array: an array of length `count` times the size of a block
+    :param count: the number of blocks
+    """
+    array = numpy.ascontiguousarray(array)
+    fspace = dset.id.get_space()
+    fspace.select_hyperslab((start,), (count,), (stride,),
+                            (len(array) // count,))
+    mspace = h5py.h5s.create_simple((len(array),))
+    dset.id.write(mspace, fspace, array)
+
+
 def extend3(hdf5path, key, array, **attrs):
     """
     Extend an HDF5 file dataset with the given array
@@ -86,11 +86,21 @@ available at the moment:
 `OQ_DISTRIBUTE` set tp "zmq"
    use the zmq concurrency mechanism (experimental)
 
-There is also an `OQ_DISTRIBUTE` = "threadpool"; however the
-performance of using threads instead of processes is normally bad for the
+There is also an `OQ_DISTRIBUTE` = "threadpool": in that case the tasks
+run in a pool of threads inside the current process and their arguments
+are not pickled, so that big read-only data structures are shared
+between the tasks and not copied. That is convenient only when the tasks
+spend most of their time in numpy/scipy code releasing the GIL, otherwise
+the performance of using threads instead of processes is bad for the
 kind of applications we are interested in (CPU-dominated, which large
 tasks such that the time to spawn a new process is negligible with
-respect to the time to perform the task), so it is not recommended.
+respect to the time to perform the task).
+
+Finally, there is an hybrid mode, enabled by setting the environment
+variable `OQ_NUM_THREADS` (or the parameter `num_threads` in the section
+`distribution` of openquake.cfg) to a number N larger than 1. Then the
+process pool contains `cpu_count // N` processes and each task can use
+:func:`thread_starmap` to run its numpy-heavy kernels in N threads.
 
 If you are using a pool, is always a good idea to cleanup resources at the end
 with
@@ -180,6 +190,10 @@ if OQ_DISTRIBUTE == 'futures':  # legacy name
 if OQ_DISTRIBUTE not in ('no', 'processpool', 'threadpool', 'celery', 'zmq',
                          'dask'):
     raise ValueError('Invalid oq_distribute=%s' % OQ_DISTRIBUTE)
+OQ_NUM_THREADS = int(os.environ.get(
+    'OQ_NUM_THREADS', config.distribution.get('num_threads', 1)))
+if OQ_NUM_THREADS < 1:
+    raise ValueError('Invalid num_threads=%d' % OQ_NUM_THREADS)
 
 # data type for storing the performance information
 task_info_dt = numpy.dtype(
@@ -524,6 +538,27 @@ def init_workers():
         prctl.set_pdeathsig(signal.SIGKILL)
 
 
+def thread_starmap(func, allargs):
+    """
+    Apply a function to a sequence of tuples of arguments by using a pool of
+    `OQ_NUM_THREADS` threads local to the current process. It is meant to be
+    used inside tasks, to parallelize kernels spending most of their time in
+    numpy/scipy code releasing the GIL. If `OQ_NUM_THREADS` is 1 or the task
+    is already running in a thread pool, the function is applied sequentially.
+
+    :param func: a thread-safe function
+    :param allargs: a sequence of tuples of arguments
+    :returns: the list of results, in the same order of the arguments
+    """
+    global _thread_pool
+    if OQ_NUM_THREADS == 1 or oq_distribute() == 'threadpool':
+        return list(itertools.starmap(func, allargs))
+    if _thread_pool is None:  # first time in the current process
+        _thread_pool = multiprocessing.dummy.Pool(OQ_NUM_THREADS)
+    return _thread_pool.starmap(func, allargs)
+
+
+_thread_pool = None  # used in thread_starmap
 running_tasks = []  # currently running tasks
 
 
@@ -535,6 +570,8 @@ class Starmap(object):
     @classmethod
     def init(cls, poolsize=None, distribute=OQ_DISTRIBUTE):
         if distribute == 'processpool' and not hasattr(cls, 'pool'):
+            # in hybrid mode each process has OQ_NUM_THREADS threads
+            poolsize = poolsize or max(cpu_count // OQ_NUM_THREADS, 1)
             orig_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
             # we use spawn here to avoid deadlocks with logging, see
             # https://github.com/gem/oq-engine/pull/3923 and
@@ -595,13 +632,13 @@ class Starmap(object):
 
     def __init__(self, task_func, task_args=(), monitor=None, distribute=None,
                  progress=logging.info):
-        self.__class__.init(distribute=distribute or OQ_DISTRIBUTE)
+        self.distribute = distribute or oq_distribute(task_func)
+        self.__class__.init(distribute=self.distribute)
         self.task_func = task_func
         self.monitor = monitor or Monitor(task_func.__name__)
         self.calc_id = getattr(self.monitor, 'calc_id', None)
         self.name = self.monitor.operation or task_func.__name__
         self.task_args = task_args
-        self.distribute = distribute or oq_distribute(task_func)
         self.progress = progress
         try:
             self.num_tasks = len(self.task_args)
@@ -657,7 +694,11 @@ class Starmap(object):
         # add incremental task number and task weight
         mon.task_no = len(self.tasks) + 1
         dist = 'no' if self.num_tasks == 1 else self.distribute
-        if dist != 'no':
+        if dist == 'threadpool':
+            # the arguments are shared between the threads, except the
+            # monitor which is changed by the task
+            args = args[:-1] + (mon.new(mon.operation),)
+        elif dist != 'no':
             args = pickle_sequence(args)
             self.sent += numpy.array([len(p) for p in args])
         res = getattr(self, dist + '_submit')(args)
@@ -43,5 +43,18 @@ class Hdf5TestCase(unittest.TestCase):
         with hdf5.File(self.tmp, 'r') as f:
             print(f['dset'].value)
 
+    def test_write_blocks(self):
+        dt = numpy.dtype([('eid', numpy.uint32), ('gmv', (numpy.float32, 2))])
+        with hdf5.File(self.tmp, 'w') as f:
+            dset = hdf5.create(f, 'dset', dt, (10,), fillvalue=None)
+            data = numpy.zeros(4, dt)
+            data['eid'] = [1, 2, 3, 4]
+            data['gmv'] = [[.1, .2], [.3, .4], [.5, .6], [.7, .8]]
+            # two blocks of two elements, starting at 1 and 6
+            hdf5.write_blocks(dset, 1, 5, data, 2)
+            numpy.testing.assert_equal(
+                dset['eid'], [0, 1, 2, 0, 0, 0, 3, 4, 0, 0])
+            numpy.testing.assert_equal(dset[6:8], data[2:])
+
     def tearDown(self):
         os.remove(self.tmp)
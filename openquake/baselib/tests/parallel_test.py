@@ -106,3 +106,30 @@ class ThreadPoolTestCase(unittest.TestCase):
                 self.assertEqual(res, {'n': 10})  # chunks [4, 4, 2]
             finally:
                 parallel.Starmap.shutdown()
+
+    def test_no_pickling(self):
+        # with a thread pool the arguments are shared and not pickled
+        monitor = parallel.Monitor()
+        with mock.patch.dict(os.environ, {'OQ_DISTRIBUTE': 'threadpool'}):
+            try:
+                smap = parallel.Starmap(
+                    get_length, [(numpy.arange(10), monitor),
+                                 (numpy.arange(5), monitor)])
+                res = smap.reduce()
+                self.assertEqual(res, {'n': 15})
+                self.assertEqual(smap.sent.sum(), 0)
+            finally:
+                parallel.Starmap.shutdown()
+
+
+class ThreadStarmapTestCase(unittest.TestCase):
+    def test(self):
+        allargs = [(numpy.arange(n), None) for n in range(10)]
+        expected = [{'n': n} for n in range(10)]
+        with mock.patch.object(parallel, 'OQ_NUM_THREADS', 1):
+            self.assertEqual(
+                parallel.thread_starmap(get_length, allargs), expected)
+        with mock.patch.object(parallel, 'OQ_NUM_THREADS', 4):
+            # the results are returned in order
+            self.assertEqual(
+                parallel.thread_starmap(get_length, allargs), expected)
@@ -21,7 +21,6 @@ import abc
 import pdb
 import logging
 import operator
-import itertools
 import traceback
 from datetime import datetime
 from shapely import wkt
@@ -34,7 +33,7 @@ from openquake.hazardlib.calc.filters import SourceFilter, RtreeFilter
 from openquake.risklib import riskinput, riskmodels
 from openquake.commonlib import readinput, source, calc, writers
 from openquake.baselib.parallel import Starmap
-from openquake.hazardlib.shakemap import get_sitecol_shakemap, to_gmfs
+from openquake.hazardlib.shakemap import get_sitecol_shakemap, gen_gmfs
 from openquake.calculators.export import export as exp
 from openquake.calculators.getters import GmfDataGetter, PmapGetter
 
@@ -49,6 +48,7 @@ U32 = numpy.uint32
 U64 = numpy.uint64
 F32 = numpy.float32
 TWO16 = 2 ** 16
+ASSETS_PER_BLOCK = 1000  # max number of assets per riskinput
 
 
 class InvalidCalculationID(Exception):
@@ -362,9 +362,7 @@ class HazardCalculator(BaseCalculator):
             the parent datastore if it is present and can be read from the
             workers, None otherwise
         """
-        read_access = (
-            config.distribution.oq_distribute in ('no', 'processpool') or
-            config.directory.shared_dir)
+        read_access = has_shared_fs()
         hdf5cache = getattr(self, 'hdf5cache', None)
         if hdf5cache and read_access:
             return hdf5cache
@@ -729,9 +727,33 @@ class RiskCalculator(HazardCalculator):
 
         logging.info('Building GMFs')
         with self.monitor('building/saving GMFs'):
-            gmfs = to_gmfs(shakemap, oq.cross_correlation, oq.site_effects,
-                           oq.truncation_level, E, oq.random_seed, oq.imtls)
-            save_gmf_data(self.datastore, sitecol, gmfs)
+            # the GMFs are computed tile by tile and saved block of events
+            # by block of events; the space for each site is reserved in
+            # advance, so that all the rows of a given site are contiguous
+            indices = numpy.zeros((len(sitecol.complete), 2), U32)
+            dset = None
+            offset = 0
+            for tile, slc, gmfs in gen_gmfs(
+                    shakemap, oq.cross_correlation, oq.site_effects,
+                    oq.truncation_level, E, oq.random_seed, oq.imtls):
+                sids = sitecol.sids[tile]
+                data = get_gmv_data(sids, gmfs[numpy.newaxis])
+                data['eid'] += slc.start
+                data = calc.encode_gmfs(data, oq.gmf_storage)
+                if dset is None:
+                    dset = self.datastore.create_dset(
+                        'gmf_data/data', data.dtype, (len(sitecol) * E,),
+                        oq.gmf_compression, fillvalue=None)
+                if slc.start == 0:  # first block of a new tile
+                    start = offset
+                    indices[sids, 0] = start + numpy.arange(len(sids)) * E
+                    indices[sids, 1] = indices[sids, 0] + E
+                    offset += len(sids) * E
+                # the rows of the block are the slices slc of the rows
+                # of the sites in the tile, written with a single selection
+                hdf5.write_blocks(dset, start + slc.start, E, data, len(sids))
+            self.datastore['gmf_data/indices'] = indices
+            self.datastore.set_attrs('gmf_data', num_gmfs=1)
             events = numpy.zeros(E, readinput.stored_event_dt)
             events['eid'] = numpy.arange(E, dtype=U64)
             self.datastore['events'] = events
@@ -742,7 +764,8 @@ class RiskCalculator(HazardCalculator):
         :param kind:
             kind of hazard getter, can be 'poe' or 'gmf'
         :param eps:
-            a matrix of epsilons (or None)
+            a matrix of epsilons, an epsilon matrix generating them on
+            demand, or None
         :param num_events:
             how many events there are
         :returns:
@@ -765,17 +788,24 @@ class RiskCalculator(HazardCalculator):
         return riskinputs
 
     def _gen_riskinputs(self, kind, eps, num_events):
-        assets_by_site = self.assetcol.assets_by_site()
+        # the riskinputs contain arrays of assets, not Asset objects
+        array = self.assetcol.get_risk_array()
+        array = array[numpy.argsort(array['site_id'], kind='mergesort')]
+        sids, starts = numpy.unique(array['site_id'], return_index=True)
+        assets_by_site = dict(zip(sids, numpy.split(array, starts[1:])))
         dstore = self.can_read_parent() or self.datastore
-        for sid, assets in enumerate(assets_by_site):
-            if len(assets) == 0:
-                continue
+        if kind == 'poe':  # one site per riskinput
+            tiles = [[sid] for sid in sids]
+        else:  # tiles of consecutive sites, read with a single slice
+            tiles = general.block_splitter(
+                sids, ASSETS_PER_BLOCK, lambda sid: len(assets_by_site[sid]))
+        for tile in tiles:
             # build the riskinputs
             if kind == 'poe':  # hcurves, shape (R, N)
-                getter = PmapGetter(dstore, self.rlzs_assoc, [sid])
+                getter = PmapGetter(dstore, self.rlzs_assoc, list(tile))
                 getter.num_rlzs = self.R
             else:  # gmf
-                getter = GmfDataGetter(dstore, [sid], self.R,
+                getter = GmfDataGetter(dstore, list(tile), self.R,
                                        self.oqparam.imtls)
             if dstore is self.datastore:
                 # read the hazard data in the controller node
@@ -783,12 +813,21 @@ class RiskCalculator(HazardCalculator):
             else:
                 # the datastore must be closed to avoid the HDF5 fork bug
                 assert dstore.hdf5 == (), '%s is not closed!' % dstore
-            for block in general.block_splitter(assets, 1000):
-                # dictionary of epsilons for the reduced assets
-                reduced_eps = {ass.ordinal: eps[ass.ordinal]
-                               for ass in block
-                               if eps is not None and len(eps)}
-                yield riskinput.RiskInput(getter, [block], reduced_eps)
+            if len(tile) > 1:
+                blocks = [[assets_by_site[sid] for sid in tile]]
+            else:  # split the assets of a single site in blocks
+                assets = assets_by_site[tile[0]]
+                blocks = [[assets[i: i + ASSETS_PER_BLOCK]]
+                          for i in range(0, len(assets), ASSETS_PER_BLOCK)]
+            for assets_by_sid in blocks:
+                if isinstance(eps, numpy.ndarray):
+                    # dictionary of epsilons for the reduced assets
+                    reduced_eps = {aid: eps[aid]
+                                   for assets in assets_by_sid
+                                   for aid in assets['ordinal']}
+                else:  # epsilons generated on demand, or None
+                    reduced_eps = eps
+                yield riskinput.RiskInput(getter, assets_by_sid, reduced_eps)
 
     def execute(self):
         """
@@ -810,6 +849,14 @@ class RiskCalculator(HazardCalculator):
         return acc + res
 
 
+def has_shared_fs():
+    """
+    :returns: True if the workers can access the files of the controller node
+    """
+    return bool(config.distribution.oq_distribute in (
+        'no', 'processpool', 'threadpool') or config.directory.shared_dir)
+
+
 def get_gmv_data(sids, gmfs):
     """
     Convert an array of shape (R, N, E, I) into an array of type gmv_data_dt
@@ -817,13 +864,14 @@ def get_gmv_data(sids, gmfs):
     R, N, E, I = gmfs.shape
     gmv_data_dt = numpy.dtype(
         [('rlzi', U16), ('sid', U32), ('eid', U64), ('gmv', (F32, (I,)))])
-    # NB: ordering of the loops: first site, then event, then realization
+    # NB: ordering of the rows: first site, then event, then realization
     # it is such that save_gmf_data saves the indices correctly for each sid
-    it = ((r, sids[s], eid, gmfa[s, eid])
-          for s, eid in itertools.product(
-                  numpy.arange(N, dtype=U32), numpy.arange(E, dtype=U64))
-          for r, gmfa in enumerate(gmfs))
-    return numpy.fromiter(it, gmv_data_dt)
+    gmv_data = numpy.zeros(N * E * R, gmv_data_dt)
+    gmv_data['rlzi'] = numpy.tile(numpy.arange(R), N * E)
+    gmv_data['sid'] = numpy.repeat(sids, E * R)
+    gmv_data['eid'] = numpy.tile(numpy.repeat(numpy.arange(E), R), N)
+    gmv_data['gmv'] = gmfs.transpose(1, 2, 0, 3).reshape(N * E * R, I)
+    return gmv_data
 
 
 def save_gmdata(calc, n_rlzs):
@@ -855,7 +903,8 @@ def save_gmfs(calculator):
     if oq.inputs['gmfs'].endswith('.csv'):
         # TODO: check if import_gmfs can be removed
         eids, num_rlzs, calculator.gmdata = import_gmfs(
-            dstore, oq.inputs['gmfs'], calculator.sitecol.complete.sids)
+            dstore, oq.inputs['gmfs'], calculator.sitecol.complete.sids,
+            oq.gmf_storage, oq.gmf_compression)
         save_gmdata(calculator, calculator.R)
     else:  # XML
         eids, gmfs = readinput.eids, readinput.gmfs
@@ -872,18 +921,24 @@ def save_gmfs(calculator):
     if oq.inputs['gmfs'].endswith('.xml'):
         haz_sitecol = readinput.get_site_collection(oq)
         R, N, E, I = gmfs.shape
-        save_gmf_data(dstore, haz_sitecol, gmfs[:, haz_sitecol.sids], eids)
+        save_gmf_data(dstore, haz_sitecol, gmfs[:, haz_sitecol.sids], eids,
+                      oq.gmf_storage, oq.gmf_compression)
 
 
-def save_gmf_data(dstore, sitecol, gmfs, eids=()):
+def save_gmf_data(dstore, sitecol, gmfs, eids=(), gmf_storage='float32',
+                  compression=None):
     """
     :param dstore: a :class:`openquake.baselib.datastore.DataStore` instance
     :param sitecol: a :class:`openquake.hazardlib.site.SiteCollection` instance
     :param gmfs: an array of shape (R, N, E, M)
     :param eids: E event IDs or the empty tuple
+    :param gmf_storage: 'float32', 'float16' or 'uint16'
+    :param compression: None, 'gzip' or 'lzf'
     """
     offset = 0
-    dstore['gmf_data/data'] = gmfa = get_gmv_data(sitecol.sids, gmfs)
+    gmfa = calc.encode_gmfs(get_gmv_data(sitecol.sids, gmfs), gmf_storage)
+    dstore.create_dset('gmf_data/data', gmfa.dtype, compression=compression)
+    dstore.extend('gmf_data/data', gmfa)
     dic = general.group_array(gmfa, 'sid')
     lst = []
     all_sids = sitecol.complete.sids
@@ -900,13 +955,16 @@ def save_gmf_data(dstore, sitecol, gmfs, eids=()):
         dstore['events'] = events
 
 
-def import_gmfs(dstore, fname, sids):
+def import_gmfs(dstore, fname, sids, gmf_storage='float32',
+                compression=None):
     """
     Import in the datastore a ground motion field CSV file.
 
     :param dstore: the datastore
     :param fname: the CSV file
     :param sids: the site IDs (complete)
+    :param gmf_storage: 'float32', 'float16' or 'uint16'
+    :param compression: None, 'gzip' or 'lzf'
     :returns: event_ids, num_rlzs
     """
     array = writers.read_composite_array(fname).array
@@ -921,6 +979,8 @@ def import_gmfs(dstore, fname, sids):
     dstore['events'] = events
     # store the GMFs
     dic = general.group_array(array.view(gmf_data_dt), 'sid')
+    dstore.create_dset('gmf_data/data', calc.gmf_storage_dt(
+        gmf_data_dt, gmf_storage), compression=compression)
     lst = []
     offset = 0
     for sid in sids:
@@ -928,7 +988,8 @@ def import_gmfs(dstore, fname, sids):
         lst.append((offset, offset + n))
         if n:
             offset += n
-            dstore.extend('gmf_data/data', dic[sid])
+            dstore.extend('gmf_data/data',
+                          calc.encode_gmfs(dic[sid], gmf_storage))
     dstore['gmf_data/indices'] = numpy.array(lst, U32)
 
     # FIXME: if there is no data for the maximum realization
@@ -46,10 +46,11 @@ def classical_bcr(riskinputs, riskmodel, param, monitor):
     for ri in riskinputs:
         for outputs in riskmodel.gen_outputs(ri, monitor):
             assets = outputs.assets
+            avals = assets['value-structural']
             for out in outputs:
-                for asset, (eal_orig, eal_retro, bcr) in zip(assets, out):
-                    aval = asset.value('structural')
-                    result[asset.ordinal][outputs.rlzi] = numpy.array([
+                for aid, aval, (eal_orig, eal_retro, bcr) in zip(
+                        assets['ordinal'], avals, out):
+                    result[aid][outputs.rlzi] = numpy.array([
                         eal_orig * aval, eal_retro * aval, bcr])
     return result
 
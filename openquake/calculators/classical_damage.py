@@ -42,7 +42,7 @@ def classical_damage(riskinputs, riskmodel, param, monitor):
     for ri in riskinputs:
         for outputs in riskmodel.gen_outputs(ri, monitor):
             for l, out in enumerate(outputs):
-                ordinals = [a.ordinal for a in outputs.assets]
+                ordinals = outputs.assets['ordinal']
                 result[l, outputs.rlzi] += dict(zip(ordinals, out))
     return result
 
@@ -47,8 +47,7 @@ def classical_risk(riskinputs, riskmodel, param, monitor):
             outputs.average_losses = AccumDict(accum=[])  # l -> array
             for l, loss_curves in enumerate(outputs):
                 # loss_curves has shape (C, N, 2)
-                for i, asset in enumerate(outputs.assets):
-                    aid = asset.ordinal
+                for i, aid in enumerate(outputs.assets['ordinal']):
                     avg = scientific.average_loss(loss_curves[:, i].T)
                     outputs.average_losses[l].append(avg)
                     lcurve = (loss_curves[:, i, 0], loss_curves[:, i, 1], avg)
@@ -59,12 +58,12 @@ def classical_risk(riskinputs, riskmodel, param, monitor):
         w = param['weights']
         statnames, stats = zip(*param['stats'])
         l_idxs = range(len(riskmodel.lti))
-        for assets, outs in groupby(
-                all_outputs, lambda o: tuple(o.assets)).items():
+        for aids, outs in groupby(
+                all_outputs, lambda o: tuple(o.assets['ordinal'])).items():
             weights = [w[out.rlzi] for out in outs]
             out = outs[0]
             for l in l_idxs:
-                for i, asset in enumerate(assets):
+                for i, aid in enumerate(aids):
                     avgs = numpy.array([r.average_losses[l][i] for r in outs])
                     avg_stats = compute_stats(avgs, stats, weights)
                     # is a pair loss_curves, insured_loss_curves
@@ -75,7 +74,7 @@ def classical_risk(riskinputs, riskmodel, param, monitor):
                         numpy.array([out[l][:, i, 1] for out in outs]),
                         stats, weights)
                     result['stat_curves'].append(
-                        (l, asset.ordinal, losses, poes_stats, avg_stats))
+                        (l, aid, losses, poes_stats, avg_stats))
     if R == 1:  # the realization is the same as the mean
         del result['loss_curves']
     return result
@@ -22,7 +22,7 @@ import operator
 import collections
 import numpy
 
-from openquake.baselib import hdf5, datastore
+from openquake.baselib import datastore, hdf5
 from openquake.baselib.python3compat import zip
 from openquake.baselib.general import (
     AccumDict, block_splitter, split_in_slices, humansize, get_array,
@@ -46,6 +46,7 @@ F64 = numpy.float64
 TWO32 = 2 ** 32
 RUPTURES_PER_BLOCK = 1000  # decided by MS
 BLOCKSIZE = 30000  # decided by MS
+GMF_ROWS_PER_TILE = 10 ** 6  # max number of GMF rows sorted in memory
 
 
 def build_ruptures(srcs, srcfilter, param, monitor):
@@ -138,8 +139,8 @@ def set_random_years(dstore, name, ses_seed, investigation_time):
     :param investigation_time: investigation time
     """
     events = dstore[name].value
-    numpy.random.seed(ses_seed)
-    years = numpy.random.choice(investigation_time, len(events)) + 1
+    rng = numpy.random.RandomState(ses_seed)
+    years = rng.choice(investigation_time, len(events)) + 1
     year_of = dict(zip(numpy.sort(events['eid']), years))  # eid -> year
     for event in events:
         event['year'] = year_of[event['eid']]
@@ -148,9 +149,56 @@ def set_random_years(dstore, name, ses_seed, investigation_time):
 
 # ######################## GMF calculator ############################ #
 
-def update_nbytes(dstore, key, array):
-    nbytes = dstore.get_attr(key, 'nbytes', 0)
-    dstore.set_attrs(key, nbytes=nbytes + array.nbytes)
+def update_nbytes(dset, array):
+    dset.attrs['nbytes'] = dset.attrs.get('nbytes', 0) + array.nbytes
+
+
+def _merge_ranges(ranges):
+    # merge adjacent (start, stop) ranges, assuming they are sorted
+    merged = []
+    for start, stop in ranges:
+        if merged and merged[-1][1] == start:
+            merged[-1][1] = stop
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def sort_gmf_data(dstore, unsorted, indices, num_sites,
+                  max_rows=GMF_ROWS_PER_TILE):
+    """
+    Save the GMFs in the dataset `gmf_data/data` ordered by site,
+    realization and event, so that the rows of each site are contiguous,
+    and save the dataset `gmf_data/indices` as an array of shape (N, 2) of
+    uint32. The sorting is performed by tiles of consecutive sites
+    containing at most `max_rows` rows (unless a single site has more rows
+    than that).
+
+    :param dstore: a DataStore instance
+    :param unsorted: the dataset of GMFs in order of arrival, stored
+                     outside of the datastore
+    :param indices: a dictionary (sid, 0|1) -> list of start|stop indices
+    :param num_sites: the total number of sites N
+    :param max_rows: the maximum number of rows per tile
+    """
+    ranges = [sorted(zip(indices.get((sid, 0), []),
+                         indices.get((sid, 1), [])))
+              for sid in range(num_sites)]
+    nrows = numpy.array([sum(stop - start for start, stop in rngs)
+                         for rngs in ranges], U64)
+    dstore.create_dset('gmf_data/data', unsorted.dtype,
+                       compression=unsorted.compression,
+                       attrs=dict(unsorted.attrs))
+    for tile in block_splitter(range(num_sites), max_rows, nrows.__getitem__):
+        rngs = sorted(rng for sid in tile for rng in ranges[sid])
+        data = numpy.concatenate([unsorted[start:stop]
+                                  for start, stop in _merge_ranges(rngs)])
+        data = data[numpy.lexsort((data['eid'], data['rlzi'], data['sid']))]
+        dstore.extend('gmf_data/data', data)
+    idx = numpy.zeros((num_sites, 2), U32)
+    idx[:, 1] = stops = nrows.cumsum()
+    idx[:, 0] = stops - nrows
+    dstore['gmf_data/indices'] = idx
 
 
 def get_mean_curves(dstore):
@@ -169,18 +217,20 @@ def compute_gmfs(ruptures, src_filter, rlzs_by_gsim, param, monitor):
     """
     res = AccumDict(ruptures={})
     if isinstance(ruptures, RuptureGetter):
-        # the ruptures are read from the datastore
-        grp_id = ruptures.grp_id
+        # the ruptures are read from the datastore; the geometries are
+        # read in bulk, while the surfaces are built only when needed
+        with monitor('reading ruptures', measuremem=False):
+            ruptures = list(ruptures)
+        res.events = get_events(ruptures)
         sitecol = src_filter  # this is actually a site collection
     else:
         # use the ruptures sampled in prefiltering
         grp_id = ruptures[0].grp_id
         sitecol = src_filter.sitecol
-    if not param['oqparam'].save_ruptures or isinstance(
-            ruptures, RuptureGetter):  # ruptures already saved
-        res.events = get_events(ruptures)
-    else:
-        res['ruptures'] = {grp_id: ruptures}
+        if not param['oqparam'].save_ruptures:
+            res.events = get_events(ruptures)
+        else:
+            res['ruptures'] = {grp_id: ruptures}
     getter = GmfGetter(
         rlzs_by_gsim, ruptures, sitecol,
         param['oqparam'], param['min_iml'], param['samples'])
@@ -211,7 +261,8 @@ class EventBasedCalculator(base.HazardCalculator):
     def init(self):
         if hasattr(self, 'csm'):
             self.check_floating_spinning()
-        self.rupser = calc.RuptureSerializer(self.datastore)
+        self.rupser = calc.RuptureSerializer(
+            self.datastore, self.oqparam.ruptures_compression)
         self.rlzs_by_gsim_grp = self.csm_info.get_rlzs_by_gsim_grp()
         self.samples_by_grp = self.csm_info.get_samples_by_grp()
 
@@ -308,6 +359,8 @@ class EventBasedCalculator(base.HazardCalculator):
         self.setting_events()
         if self.oqparam.ground_motion_fields:
             logging.info('Building GMFs')
+        elif self.oqparam.hazard_curves_from_gmfs:
+            logging.info('Building hazard curves without storing the GMFs')
 
     def agg_dicts(self, acc, result):
         """
@@ -326,12 +379,17 @@ class EventBasedCalculator(base.HazardCalculator):
         agg_mon = self.monitor('aggregating hcurves')
         if 'gmdata' in result:
             self.gmdata += result['gmdata']
+        if 'gmfdata' in result:
             data = result.pop('gmfdata')
             with sav_mon:
-                self.datastore.extend('gmf_data/data', data)
+                if 'data' not in self.gmf_h5:
+                    hdf5.create(self.gmf_h5, 'data', data.dtype,
+                                compression=self.oqparam.gmf_compression)
+                dset = self.gmf_h5['data']
+                hdf5.extend(dset, data)
                 # it is important to save the number of bytes while the
                 # computation is going, to see the progress
-                update_nbytes(self.datastore, 'gmf_data/data', data)
+                update_nbytes(dset, data)
                 for sid, start, stop in result['indices']:
                     self.indices[sid, 0].append(start + self.offset)
                     self.indices[sid, 1].append(stop + self.offset)
@@ -396,15 +454,21 @@ class EventBasedCalculator(base.HazardCalculator):
             imtls=oq.imtls, filter_distance=oq.filter_distance,
             ses_per_logic_tree_path=oq.ses_per_logic_tree_path)
         if oq.hazard_calculation_id:  # from ruptures
-            assert oq.ground_motion_fields, 'must be True!'
+            assert oq.ground_motion_fields or oq.hazard_curves_from_gmfs, (
+                'ground_motion_fields or hazard_curves_from_gmfs must be True')
             self.datastore.parent = datastore.read(oq.hazard_calculation_id)
             iterargs = self.from_ruptures(param, self.monitor())
         else:  # from sources
             iterargs = self.from_sources(param, self.monitor())
-            if oq.ground_motion_fields is False:
+            if not (oq.ground_motion_fields or oq.hazard_curves_from_gmfs):
                 for args in iterargs:  # store the ruptures/events
                     pass
                 return {}
+        # the GMFs are stored in a temporary file and copied sorted by site
+        # in the datastore, since HDF5 does not reclaim the space of the
+        # deleted datasets and the unsorted GMFs would remain as dead space
+        gmf_path = self.datastore.hdf5path[:-5] + '_gmf.hdf5'
+        self.gmf_h5 = hdf5.File(gmf_path, 'w')
         acc = parallel.Starmap(
             self.core_task.__func__, iterargs, self.monitor()
         ).reduce(self.agg_dicts, self.zerodict())
@@ -412,17 +476,15 @@ class EventBasedCalculator(base.HazardCalculator):
         base.save_gmdata(self, self.R)
         if self.indices:
             N = len(self.sitecol.complete)
-            logging.info('Saving gmf_data/indices')
-            with self.monitor('saving gmf_data/indices', measuremem=True,
+            logging.info('Sorting gmf_data by site')
+            with self.monitor('sorting gmf_data', measuremem=True,
                               autoflush=True):
-                dset = self.datastore.create_dset(
-                    'gmf_data/indices', hdf5.vuint32,
-                    shape=(N, 2), fillvalue=None)
-                for sid in self.sitecol.complete.sids:
-                    dset[sid, 0] = self.indices[sid, 0]
-                    dset[sid, 1] = self.indices[sid, 1]
-        elif (oq.ground_motion_fields and
-              'ucerf' not in oq.calculation_mode):
+                sort_gmf_data(self.datastore, self.gmf_h5['data'],
+                              self.indices, N)
+        self.gmf_h5.close()
+        os.remove(gmf_path)
+        if (not self.indices and oq.ground_motion_fields and
+                'ucerf' not in oq.calculation_mode):
             raise RuntimeError('No GMFs were generated, perhaps they were '
                                'all below the minimum_intensity threshold')
         return acc
@@ -15,14 +15,17 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import os
+import glob
+import shutil
 import logging
 import operator
 import numpy
 
+from openquake.baselib import hdf5, parallel
 from openquake.baselib.python3compat import zip, encode
-from openquake.baselib.general import AccumDict
 from openquake.hazardlib.stats import set_rlzs_stats
-from openquake.risklib import riskinput
+from openquake.risklib import riskinput, riskmodels
 from openquake.calculators import base
 from openquake.calculators.export.loss_curves import get_loss_builder
 
@@ -33,6 +36,16 @@ F32 = numpy.float32
 F64 = numpy.float64
 U64 = numpy.uint64
 getweight = operator.attrgetter('weight')
+ROWS_PER_BLOCK = 1000000  # rows of the event loss table read at once
+
+
+def gen_elt_blocks(dset):
+    """
+    :param dset: the dataset losses_by_event
+    :yields: blocks of ROWS_PER_BLOCK records of the event loss table
+    """
+    for start in range(0, len(dset), ROWS_PER_BLOCK):
+        yield dset[start:start + ROWS_PER_BLOCK]
 
 
 def build_loss_tables(dstore):
@@ -42,19 +55,147 @@ def build_loss_tables(dstore):
     oq = dstore['oqparam']
     L = len(oq.loss_dt().names)
     R = dstore['csm_info'].get_num_rlzs()
-    events = dstore['events']
+    events = dstore['events'].value
     serials = dstore['ruptures']['serial']
-    rup_by_eid = dict(zip(events['eid'], events['rup_id']))
-    idx_by_ser = dict(zip(serials, range(len(serials))))
+    events.sort(order='eid')
+    sorter = numpy.argsort(serials)
     tbl = numpy.zeros((len(serials), L), F32)
     lbr = numpy.zeros((R, L), F32)  # losses by rlz
-    for rec in dstore['losses_by_event'].value:  # call .value for speed
-        rupid = rup_by_eid[rec['eid']]
-        tbl[idx_by_ser[rupid]] += rec['loss']
-        lbr[rec['rlzi']] += rec['loss']
+    for elt in gen_elt_blocks(dstore['losses_by_event']):
+        # find the rupture index of each event with vectorized searches
+        rupids = events['rup_id'][
+            numpy.searchsorted(events['eid'], elt['eid'])]
+        ridxs = sorter[numpy.searchsorted(serials, rupids, sorter=sorter)]
+        numpy.add.at(tbl, ridxs, elt['loss'])
+        numpy.add.at(lbr, elt['rlzi'], elt['loss'])
     return tbl, lbr
 
 
+def copy_elt_by_rlzi(dset, h5, num_rlzs):
+    """
+    Copy the event loss table into the file `h5`, sorted by realization
+    but without changing the order of the events of each realization.
+    The (start, stop) offsets of each realization are stored in the
+    dataset `rlz_indices`. The table is read and written in blocks.
+
+    :param dset: the dataset losses_by_event
+    :param h5: a writable hdf5.File
+    :param num_rlzs: the number of realizations
+    """
+    counts = numpy.zeros(num_rlzs, U32)
+    for elt in gen_elt_blocks(dset):
+        counts += numpy.bincount(elt['rlzi'], minlength=num_rlzs).astype(U32)
+    stops = numpy.cumsum(counts, dtype=U32)
+    starts = stops - counts
+    h5['rlz_indices'] = numpy.array([starts, stops], U32).T
+    out = hdf5.create(h5, 'losses_by_event', dset.dtype, (len(dset),),
+                      fillvalue=None)
+    offsets = starts.copy()  # where to write the next rows of each rlzi
+    for elt in gen_elt_blocks(dset):
+        elt = elt[numpy.argsort(elt['rlzi'], kind='mergesort')]  # stable
+        rlzis, idxs, ns = numpy.unique(
+            elt['rlzi'], return_index=True, return_counts=True)
+        for rlzi, idx, n in zip(rlzis, idxs, ns):
+            out[offsets[rlzi]:offsets[rlzi] + n] = elt[idx:idx + n]
+            offsets[rlzi] += n
+
+
+def build_agg_curves(rlzis, hdf5path, builder, monitor):
+    """
+    Build the aggregate loss curves for some realizations, by reading
+    their losses from the event loss table sorted by realization.
+
+    :param rlzis: a list of realization indices
+    :param hdf5path: the path to a file with losses_by_event and rlz_indices
+    :param builder: a LossesByPeriodBuilder instance
+    :param monitor: a Monitor instance
+    :returns: a dictionary (rlzi, lti) -> array of P losses by period
+    """
+    dic = {}
+    with hdf5.File(hdf5path, 'r') as h5:
+        indices = h5['rlz_indices'].value
+        for rlzi in rlzis:
+            start, stop = indices[rlzi]
+            if start == stop:  # no losses for this realization
+                continue
+            with monitor('reading event loss table'):
+                losses = h5['losses_by_event'][start:stop]['loss']
+            for lti in range(len(builder.loss_dt.names)):
+                dic[rlzi, lti] = builder.build_losses(losses[:, lti], rlzi)
+    return dic
+
+
+def elt_dt(LI):
+    """
+    :param LI: the number of loss types times the number of insurance types
+    :returns: the dtype of the event loss table
+    """
+    return numpy.dtype([('eid', U64), ('rlzi', U16), ('loss', (F32, (LI,)))])
+
+
+def alt_dt(LI):
+    """
+    :param LI: the number of loss types times the number of insurance types
+    :returns: the dtype of the asset loss table
+    """
+    return numpy.dtype([('aid', U32), ('eid', U64), ('rlzi', U16),
+                        ('loss', (F32, (LI,)))])
+
+
+def sum_elt(elt):
+    """
+    Sum the losses with the same event ID and realization index.
+
+    :param elt: an array with fields eid, rlzi and loss
+    :returns: the nonzero losses, ordered by event ID and realization
+    """
+    elt = elt[numpy.lexsort((elt['rlzi'], elt['eid']))]
+    new = numpy.ones(len(elt), bool)  # first record of each (eid, rlzi)
+    new[1:] = ((elt['eid'][1:] != elt['eid'][:-1]) |
+               (elt['rlzi'][1:] != elt['rlzi'][:-1]))
+    starts, = new.nonzero()
+    res = elt[starts]
+    if len(res):
+        res['loss'] = numpy.add.reduceat(elt['loss'], starts, axis=0)
+    return res[res['loss'].any(axis=1)]
+
+
+def write_elt(elt, eids, param, task_no):
+    """
+    Write the aggregate losses computed by a task in a temporary HDF5
+    file, split in blocks of events to be merged by `merge_elt`.
+    """
+    eidx = numpy.searchsorted(eids, elt['eid'])
+    blocks = eidx // param['events_per_block']
+    fname = os.path.join(param['elt_dir'], 'elt-%d.hdf5' % task_no)
+    with hdf5.File(fname, 'a') as h5:
+        for block in numpy.unique(blocks):
+            key = 'elt/%d' % block
+            if key not in h5:
+                hdf5.create(h5, key, elt.dtype)
+            hdf5.extend(h5[key], elt[blocks == block])
+
+
+def merge_elt(fnames, block, monitor):
+    """
+    Sum the partial event loss tables of a block of events.
+
+    :param fnames: the HDF5 files written by `write_elt`
+    :param block: the index of the block of events
+    :param monitor: a Monitor instance
+    :returns: a dictionary block -> array of dtype elt_dt
+    """
+    arrays = []
+    key = 'elt/%d' % block
+    for fname in fnames:
+        with hdf5.File(fname, 'r') as h5:
+            if key in h5:
+                arrays.append(h5[key].value)
+    if not arrays:
+        return {}
+    return {block: sum_elt(numpy.concatenate(arrays))}
+
+
 def event_based_risk(riskinputs, riskmodel, param, monitor):
     """
     :param riskinputs:
@@ -77,11 +218,10 @@ def event_based_risk(riskinputs, riskmodel, param, monitor):
             hazard = ri.hazard_getter.get_hazard()
         mon = monitor('build risk curves', measuremem=False)
         eids = ri.hazard_getter.eids
-        eid2idx = ri.hazard_getter.eid2idx
         A = len(ri.aids)
-        E = len(eids)
         R = ri.hazard_getter.num_rlzs
-        agg = numpy.zeros((E, R, L * I), F32)
+        elts = []  # sparse event losses, one block per output
+        alts = []  # sparse asset losses, one block per output
         avg = numpy.zeros((A, R, L * I), F32)
         result = dict(aids=ri.aids, avglosses=avg)
         aid2idx = {aid: idx for idx, aid in enumerate(ri.aids)}
@@ -89,44 +229,62 @@ def event_based_risk(riskinputs, riskmodel, param, monitor):
             builder = param['builder']
             P = len(builder.return_periods)
             all_curves = numpy.zeros((A, R, P), builder.loss_dt)
-        # update the result dictionary and the agg array with each output
+        # update the result dictionary and the sparse tables with each output
         for out in riskmodel.gen_outputs(ri, monitor, hazard):
             if len(out.eids) == 0:  # this happens for sites with no events
                 continue
             r = out.rlzi
+            idxs = numpy.array([aid2idx[aid]
+                                for aid in out.assets['ordinal']])
+            elt = numpy.zeros(len(out.eids), elt_dt(L * I))
+            elt['eid'] = out.eids
+            elt['rlzi'] = r
+            if param['asset_loss_table']:
+                alt = numpy.zeros((len(idxs), len(out.eids)), alt_dt(L * I))
+                alt['aid'] = ri.aids[idxs, None]
+                alt['eid'] = out.eids
+                alt['rlzi'] = r
             for l, loss_ratios in enumerate(out):
                 if loss_ratios is None:  # for GMFs below the minimum_intensity
                     continue
                 loss_type = riskmodel.loss_types[l]
-                indices = numpy.array([eid2idx[eid] for eid in out.eids])
-                for a, asset in enumerate(out.assets):
-                    ratios = loss_ratios[a]  # shape (E, I)
-                    aid = asset.ordinal
-                    idx = aid2idx[aid]
-                    aval = asset.value(loss_type)
-                    losses = aval * ratios
-                    if 'builder' in param:
-                        with mon:  # this is the heaviest part
-                            for i in range(I):
-                                lt = loss_type + '_ins' * i
-                                all_curves[idx, r][lt] = builder.build_curve(
-                                    aval, ratios[:, i], r)
-
-                    # average losses
-                    if param['avg_losses']:
-                        rat = ratios.sum(axis=0) * param['ses_ratio'] * aval
+                # loss_ratios is an array of shape (A, E, I)
+                avals = riskmodels.get_values(loss_type, out.assets)
+                if 'builder' in param:
+                    with mon:  # this is the heaviest part
                         for i in range(I):
-                            avg[idx, r, l + L * i] = rat[i]
+                            lt = loss_type + '_ins' * i
+                            all_curves[lt][idxs, r] = builder.build_curves(
+                                avals, loss_ratios[:, :, i], r)
 
-                    # agglosses
+                # average losses
+                if param['avg_losses']:
+                    rat = (loss_ratios.sum(axis=1) * param['ses_ratio'] *
+                           avals[:, None])  # shape (A, I)
                     for i in range(I):
-                        li = l + L * i
-                        # this is the critical loop: it is important to keep it
-                        # vectorized in terms of the event indices
-                        agg[indices, r, li] += losses[:, i]
+                        avg[idxs, r, l + L * i] = rat[:, i]
+
+                # event losses, summed on the assets
+                losses = numpy.einsum('a,aei->ei', avals, loss_ratios)
+                for i in range(I):
+                    elt['loss'][:, l + L * i] = losses[:, i]
+                    if param['asset_loss_table']:
+                        alt['loss'][:, :, l + L * i] = (
+                            avals[:, None] * loss_ratios[:, :, i])
+            elts.append(elt)
+            if param['asset_loss_table']:
+                alt = alt.flatten()
+                alts.append(alt[alt['loss'].any(axis=1)])
 
-        idx = agg.nonzero()  # return only the nonzero values
-        result['agglosses'] = (idx, agg[idx])
+        elt = sum_elt(numpy.concatenate(elts or [numpy.zeros(0, elt_dt(
+            L * I))]))
+        if 'elt_dir' in param:  # the losses are merged in post_execute
+            with monitor('writing event loss table', measuremem=False):
+                write_elt(elt, eids, param, monitor.task_no)
+        else:
+            result['elt'] = elt
+        if alts:
+            result['alt'] = numpy.concatenate(alts)
         if 'builder' in param:
             clp = param['conditional_loss_poes']
             result['curves-rlzs'], result['curves-stats'] = builder.pair(
@@ -194,7 +352,18 @@ class EbrCalculator(base.RiskCalculator):
         if avg_losses:
             self.dset = self.datastore.create_dset(
                 'avg_losses-rlzs', F32, (self.A, self.R, self.L * self.I))
-        self.agglosses = numpy.zeros((self.E, self.R, self.L * self.I), F32)
+        if base.has_shared_fs():
+            # the tasks write the event loss table in temporary files,
+            # which are merged in parallel in post_execute
+            self.elt_dir = self.datastore.hdf5path[:-5] + '_elt'
+            shutil.rmtree(self.elt_dir, ignore_errors=True)
+            os.makedirs(self.elt_dir)
+            self.param['elt_dir'] = self.elt_dir
+            self.param['events_per_block'] = -(-self.E // (
+                oq.concurrent_tasks or 1))
+        else:  # the event loss table is accumulated in the controller node
+            self.elts = []
+        self.param['asset_loss_table'] = oq.asset_loss_table
         if 'builder' in self.param:
             self.build_datasets(self.param['builder'])
         if parent:
@@ -249,8 +418,12 @@ class EbrCalculator(base.RiskCalculator):
             dictionary with agglosses, avglosses
         """
         aids = dic.pop('aids')
-        idx, agg = dic.pop('agglosses')
-        self.agglosses[idx] += agg
+        if 'elt' in dic:
+            self.elts.append(dic.pop('elt'))
+        if 'alt' in dic:  # save the asset loss table by columns
+            alt = dic.pop('alt')
+            for name in alt.dtype.names:
+                self.datastore.extend('asset_loss_table/' + name, alt[name])
         if self.oqparam.avg_losses:
             self.dset[aids, :, :] = dic.pop('avglosses')
         self._save_curves(dic, aids)
@@ -285,15 +458,24 @@ class EbrCalculator(base.RiskCalculator):
         """
         Save risk data and build the aggregate loss curves
         """
+        if hasattr(self, 'elt_dir'):
+            fnames = sorted(glob.glob(os.path.join(self.elt_dir, '*.hdf5')))
+            nblocks = -(-self.E // self.param['events_per_block'])
+            logging.info('Merging %d event loss table(s) in %d block(s)',
+                         len(fnames), nblocks)
+            mon = self.monitor('merging event loss table')
+            acc = parallel.Starmap(
+                merge_elt, ((fnames, block, mon) for block in range(nblocks))
+            ).reduce()
+            shutil.rmtree(self.elt_dir)
+            agglosses = numpy.concatenate(
+                [numpy.zeros(0, elt_dt(self.L * self.I))] +
+                [acc[block] for block in sorted(acc)])
+        else:
+            agglosses = sum_elt(numpy.concatenate(
+                [numpy.zeros(0, elt_dt(self.L * self.I))] + self.elts))
         logging.info('Saving event loss table')
-        elt_dt = numpy.dtype(
-            [('eid', U64), ('rlzi', U16), ('loss', (F32, (self.L * self.I,)))])
         with self.monitor('saving event loss table', measuremem=True):
-            # saving zeros is a lot faster than adding an `if loss.sum()`
-            agglosses = numpy.fromiter(
-                ((e, r, loss)
-                 for e, losses in zip(self.eids, self.agglosses)
-                 for r, loss in enumerate(losses) if loss.sum()), elt_dt)
             self.datastore['losses_by_event'] = agglosses
             loss_types = ' '.join(self.oqparam.loss_dt().names)
             self.datastore.set_attrs('losses_by_event', loss_types=loss_types)
@@ -325,8 +507,30 @@ class EbrCalculator(base.RiskCalculator):
                 ridx = [rlt[:, lti].argmax() for lti in range(self.L)]
                 dstore.set_attrs('rup_loss_table', ridx=ridx)
         logging.info('Building aggregate loss curves')
-        with self.monitor('building agg_curves', measuremem=True):
-            array, arr_stats = b.build(dstore['losses_by_event'].value, stats)
+        # the curves are computed in parallel by realization; the tasks
+        # read the event loss table from a copy in the hdf5cache, since
+        # they cannot open the datastore while the controller is writing;
+        # the copy is sorted by realization, so that each task reads only
+        # the rows of its own realizations
+        cache = dstore.hdf5cache()
+        with hdf5.File(cache) as h5:
+            for key in ('losses_by_event', 'rlz_indices'):
+                if key in h5:
+                    del h5[key]
+            copy_elt_by_rlzi(dstore['losses_by_event'], h5, len(b.weights))
+        ltypes = b.loss_dt.names
+        acc = parallel.Starmap.apply(
+            build_agg_curves,
+            (list(range(len(b.weights))), cache, b,
+             self.monitor('building agg_curves')),
+            concurrent_tasks=oq.concurrent_tasks,
+            weight=lambda rlzi: b.num_events[rlzi],
+            distribute=None if base.has_shared_fs() else 'no').reduce()
+        array = numpy.zeros((len(b.return_periods), len(b.weights)),
+                            b.loss_dt)
+        for (rlzi, lti), losses in acc.items():
+            array[:, rlzi][ltypes[lti]] = losses
+        array, arr_stats = b.pair(array, stats)
         units = self.assetcol.cost_calculator.get_units(
             loss_types=array.dtype.names)
         if oq.individual_curves:
@@ -571,7 +571,7 @@ def export_gmf(ekey, dstore):
         logging.warn(GMF_WARNING, dstore.hdf5path)
     fnames = []
     ruptures_by_rlz = collections.defaultdict(list)
-    data = gmf_data['data'].value
+    data = calc.decode_gmfs(gmf_data['data'].value)
     events = dstore['events'].value
     eventdict = dict(zip(events['eid'], events))
     for rlzi, gmf_arr in group_array(data, 'rlzi').items():
@@ -629,7 +629,7 @@ def export_gmf_data_csv(ekey, dstore):
     else:
         arr = sc[['lon', 'lat']]
     eid = int(ekey[0].split('/')[1]) if '/' in ekey[0] else None
-    gmfa = dstore['gmf_data']['data'].value
+    gmfa = calc.decode_gmfs(dstore['gmf_data']['data'].value)
     if eid is None:  # we cannot use extract here
         f = dstore.build_fname('sitemesh', '', 'csv')
         sids = numpy.arange(len(arr), dtype=U32)
@@ -31,9 +31,12 @@ from openquake.baselib.hdf5 import ArrayWrapper
 from openquake.baselib.general import group_array
 from openquake.baselib.python3compat import encode
 from openquake.calculators import getters
+from openquake.calculators.event_based_risk import sum_elt
 from openquake.calculators.export.loss_curves import get_loss_builder
 from openquake.commonlib import calc, util
 
+U16 = numpy.uint16
+U64 = numpy.uint64
 F32 = numpy.float32
 F64 = numpy.float64
 
@@ -285,37 +288,37 @@ def extract_uhs(dstore, what):
 
 def _agg(losses, idxs):
     shp = losses.shape[1:]
-    if not idxs:
+    if not len(idxs):
         # no intersection, return a 0-dim matrix
         return numpy.zeros((0,) + shp, losses.dtype)
-    # numpy.array wants lists, not sets, hence the sorted below
-    return losses[numpy.array(sorted(idxs))].sum(axis=0)
+    return losses[idxs].sum(axis=0)
 
 
 def _filter_agg(assetcol, losses, selected, stats=''):
     # losses is an array of shape (A, ..., R) with A=#assets, R=#realizations
-    aids_by_tag = assetcol.get_aids_by_tag()
-    idxs = set(range(len(assetcol)))
+    # the assets are selected by using the tag index of the assetcol
+    ok = numpy.ones(len(assetcol), bool)
     tagnames = []
     for tag in selected:
         tagname, tagvalue = tag.split('=', 1)
         if tagvalue == '*':
             tagnames.append(tagname)
         else:
-            idxs &= aids_by_tag[tag]
+            mask = numpy.zeros(len(assetcol), bool)
+            mask[assetcol.get_aids(tag)] = True
+            ok &= mask
     if len(tagnames) > 1:
         raise ValueError('Too many * as tag values in %s' % tagnames)
     elif not tagnames:  # return an array of shape (..., R)
         return ArrayWrapper(
-            _agg(losses, idxs), dict(selected=encode(selected), stats=stats))
+            _agg(losses, ok.nonzero()[0]),
+            dict(selected=encode(selected), stats=stats))
     else:  # return an array of shape (T, ..., R)
         [tagname] = tagnames
-        _tags = list(assetcol.tagcol.gen_tags(tagname))
-        all_idxs = [idxs & aids_by_tag[t] for t in _tags]
-        # NB: using a generator expression for all_idxs caused issues (?)
         data, tags = [], []
-        for idxs, tag in zip(all_idxs, _tags):
-            agglosses = _agg(losses, idxs)
+        for tag in assetcol.tagcol.gen_tags(tagname):
+            aids = assetcol.get_aids(tag)
+            agglosses = _agg(losses, aids[ok[aids]])
             if len(agglosses):
                 data.append(agglosses)
                 tags.append(tag)
@@ -443,6 +446,43 @@ def extract_losses_by_event(dstore, what):
         yield 'rlz-%03d' % rlzi, dic[rlzi]
 
 
+@extract.add('asset_loss_table')
+def extract_asset_loss_table(dstore, what):
+    """
+    Event losses of the given loss type, aggregated on the assets with the
+    given tags. Requires `asset_loss_table = true` in event based risk
+    calculations. Use it as
+    /extract/asset_loss_table/structural?taxonomy=RC&zipcode=20126
+
+    :returns:
+        an array with fields eid, rlzi, loss ordered by event ID and rlzi
+    """
+    loss_type, tags = get_loss_type_tags(what)
+    if not loss_type:
+        raise ValueError(
+            'loss_type not passed in asset_loss_table/<loss_type>')
+    if 'asset_loss_table' not in dstore:
+        raise KeyError('No asset loss table found in %s' % dstore)
+    l = dstore['oqparam'].lti[loss_type]
+    assetcol = dstore['assetcol']
+    alt = dstore['asset_loss_table']
+    aid = alt['aid'].value
+    ok = numpy.ones(len(aid), bool)
+    for tag in tags:
+        ok &= numpy.isin(aid, assetcol.get_aids(tag))
+    elt = numpy.zeros(ok.sum(), [('eid', U64), ('rlzi', U16),
+                                 ('loss', (F32, (1,)))])
+    elt['eid'] = alt['eid'].value[ok]
+    elt['rlzi'] = alt['rlzi'].value[ok]
+    elt['loss'][:, 0] = alt['loss'][:, l][ok]
+    res = sum_elt(elt)
+    arr = numpy.zeros(len(res), [('eid', U64), ('rlzi', U16), ('loss', F32)])
+    arr['eid'] = res['eid']
+    arr['rlzi'] = res['rlzi']
+    arr['loss'] = res['loss'][:, 0]
+    return ArrayWrapper(arr, dict(selected=encode(tags)))
+
+
 def _gmf_scenario(data, num_sites, imts):
     # convert data into the composite array expected by QGIS
     eids = sorted(numpy.unique(data['eid']))
@@ -462,7 +502,8 @@ def extract_gmf_scenario_npz(dstore, what):
     oq = dstore['oqparam']
     mesh = get_mesh(dstore['sitecol'])
     n = len(mesh)
-    data_by_rlzi = group_array(dstore['gmf_data/data'].value, 'rlzi')
+    data = calc.decode_gmfs(dstore['gmf_data/data'].value)
+    data_by_rlzi = group_array(data, 'rlzi')
     for rlzi in data_by_rlzi:
         gmfa, e = _gmf_scenario(data_by_rlzi[rlzi], n, oq.imtls)
         logging.info('Exporting array of shape %s for rlz %d',
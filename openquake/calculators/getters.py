@@ -20,15 +20,16 @@ import itertools
 import operator
 import logging
 import numpy
-from openquake.baselib import hdf5
+from openquake.baselib import hdf5, parallel
 from openquake.baselib.general import (
-    AccumDict, groupby, group_array, get_array, block_splitter)
+    AccumDict, groupby, group_array, get_array, block_splitter,
+    cached_property)
 from openquake.hazardlib.gsim.base import ContextMaker, FarAwayRupture
 from openquake.hazardlib import calc, geo, probability_map, stats
 from openquake.hazardlib.geo.mesh import Mesh, RectangularMesh
 from openquake.hazardlib.source.rupture import BaseRupture, EBRupture, classes
 from openquake.risklib.riskinput import rsi2str
-from openquake.commonlib.calc import _gmvs_to_haz_curve
+from openquake.commonlib.calc import encode_gmfs, decode_gmfs
 
 U16 = numpy.uint16
 U32 = numpy.uint32
@@ -223,10 +224,10 @@ class GmfDataGetter(collections.Mapping):
         self.eids = self.dstore['events']['eid']
         self.eids.sort()
         self.data = collections.OrderedDict()
-        for sid in self.sids:
-            self.data[sid] = data = self[sid]
+        for sid, data in self._read_tile():
             if not data:  # no GMVs, return 0, counted in no_damage
-                self.data[sid] = {rlzi: 0 for rlzi in range(self.num_rlzs)}
+                data = {rlzi: 0 for rlzi in range(self.num_rlzs)}
+            self.data[sid] = data
         # dictionary eid -> index
         if self.eids is not None:
             self.eid2idx = dict(zip(self.eids, range(len(self.eids))))
@@ -242,6 +243,28 @@ class GmfDataGetter(collections.Mapping):
         """
         return self.data
 
+    def _read_tile(self):
+        # yield pairs (sid, data by rlzi); when the GMFs are sorted by site,
+        # as in engine >= 3.3, all the sites are read with a single slice
+        idxs = self.dstore['gmf_data/indices']
+        if idxs.dtype.name != 'uint32' or not len(self.sids):
+            for sid in self.sids:
+                yield sid, self[sid]
+            return
+        sids = numpy.array(self.sids)
+        order = numpy.argsort(sids)
+        idx = numpy.zeros((len(sids), 2), U32)
+        idx[order] = idxs[list(sids[order])]
+        start, stop = idx[:, 0].min(), idx[:, 1].max()
+        if stop - start > 2 * (idx[:, 1] - idx[:, 0]).sum():
+            # the sites are too sparse, read them one by one
+            for sid in self.sids:
+                yield sid, self[sid]
+            return
+        array = decode_gmfs(self.dstore['gmf_data/data'][start:stop])
+        for sid, (a, b) in zip(self.sids, idx - start):
+            yield sid, group_array(array[a:b], 'rlzi') if b > a else {}
+
     def __getitem__(self, sid):
         dset = self.dstore['gmf_data/data']
         idxs = self.dstore['gmf_data/indices'][sid]
@@ -252,7 +275,7 @@ class GmfDataGetter(collections.Mapping):
         data = [dset[start:stop] for start, stop in idxs]
         if len(data) == 0:  # site ID with no data
             return {}
-        return group_array(numpy.concatenate(data), 'rlzi')
+        return group_array(decode_gmfs(numpy.concatenate(data)), 'rlzi')
 
     def __iter__(self):
         return iter(self.sids)
@@ -263,7 +286,7 @@ class GmfDataGetter(collections.Mapping):
 
 class GmfGetter(object):
     """
-    An hazard getter with methods .gen_gmv and .get_hazard returning
+    An hazard getter with methods .get_gmfdata and .get_hazard returning
     ground motion values.
     """
     def __init__(self, rlzs_by_gsim, ebruptures, sitecol, oqparam,
@@ -323,50 +346,111 @@ class GmfGetter(object):
         # dictionary eid -> index
         self.eid2idx = dict(zip(self.eids, range(len(self.eids))))
 
-    def gen_gmv(self):
+    def get_gmfdata(self, counts=None, store=True):
         """
-        Compute the GMFs for the given realization and populate the .gmdata
-        array. Yields tuples of the form (sid, eid, imti, gmv).
+        Compute the GMFs for all realizations and populate the .gmdata
+        array.
+
+        :param counts:
+            if given, a dictionary rlzi -> array of shape (N, L) with the
+            number of exceedances per site and level, updated in place
+            while the GMFs are generated
+        :param store:
+            if False, do not build the GMF records (curves-only mode)
+        :returns: an array of dtype gmf_data_dt
         """
+        blocks = []  # triples (gsim, computer, eids by realization)
+        size = 0  # maximum number of GMF records
         sample = 0  # in case of sampling the realizations have a corresponding
         # sample number from 0 to the number of samples of the given src model
         for gs in self.rlzs_by_gsim:  # OrderedDict
             rlzs = self.rlzs_by_gsim[gs]
             for computer in self.computers:
                 rup = computer.rupture
-                sids = computer.sids
                 if self.samples > 1:
                     # events of the current slice of realizations
                     all_eids = [get_array(rup.events, sample=s)['eid']
                                 for s in range(sample, sample + len(rlzs))]
                 else:
                     all_eids = [rup.events['eid']] * len(rlzs)
-                num_events = sum(len(eids) for eids in all_eids)
-                # NB: the trick for performance is to keep the call to
-                # compute.compute outside of the loop over the realizations
-                # it is better to have few calls producing big arrays
-                array = computer.compute(gs, num_events).transpose(1, 0, 2)
-                # shape (N, I, E)
-                for i, miniml in enumerate(self.min_iml):  # gmv < minimum
-                    arr = array[:, i, :]
-                    arr[arr < miniml] = 0
-                n = 0
-                for r, rlzi in enumerate(rlzs):
-                    e = len(all_eids[r])
-                    gmdata = self.gmdata[rlzi]
-                    gmdata[-1] += e  # increase number of events
-                    for ei, eid in enumerate(all_eids[r]):
-                        gmf = array[:, :, n + ei]  # shape (N, I)
-                        tot = gmf.sum(axis=0)  # shape (I,)
-                        if not tot.sum():
-                            continue
-                        for i, val in enumerate(tot):
-                            gmdata[i] += val
-                        for sid, gmv in zip(sids, gmf):
-                            if gmv.sum():
-                                yield rlzi, sid, eid, gmv
-                    n += e
+                blocks.append((gs, computer, all_eids))
+                size += len(computer.sids) * sum(
+                    len(eids) for eids in all_eids)
             sample += len(rlzs)
+        gmfdata = numpy.zeros(size if store else 0,
+                              self.oqparam.gmf_data_dt())
+        start = 0
+        # the GMFs of different ruptures are computed in parallel if
+        # OQ_NUM_THREADS > 1; the chunks limit the memory occupation
+        for chunk in block_splitter(blocks, parallel.OQ_NUM_THREADS):
+            arrays = parallel.thread_starmap(self._compute, chunk)
+            for (gs, computer, all_eids), array in zip(chunk, arrays):
+                if counts is not None:
+                    self._count(counts, gs, computer, all_eids, array)
+                start = self._fill(gmfdata if store else None, start,
+                                   gs, computer, all_eids, array)
+        return gmfdata[:start]
+
+    def _compute(self, gsim, computer, all_eids):
+        # returns an array of shape (N, I, E) with the GMVs below the
+        # minimum intensity set to zero
+        num_events = sum(len(eids) for eids in all_eids)
+        # NB: the trick for performance is to keep the call to
+        # compute.compute outside of the loop over the realizations
+        # it is better to have few calls producing big arrays
+        array = computer.compute(gsim, num_events).transpose(1, 0, 2)
+        for i, miniml in enumerate(self.min_iml):  # gmv < minimum
+            arr = array[:, i, :]
+            arr[arr < miniml] = 0
+        return array
+
+    def _fill(self, gmfdata, start, gs, computer, all_eids, array):
+        # fill the gmfdata array starting from the given index and
+        # update the .gmdata dictionary; returns the final index
+        rlzs = self.rlzs_by_gsim[gs]
+        sids = computer.sids
+        n = 0
+        for r, rlzi in enumerate(rlzs):
+            eids = all_eids[r]
+            e = len(eids)
+            gmfs = array[:, :, n:n + e]  # shape (N, I, e)
+            gmdata = self.gmdata[rlzi]
+            gmdata[-1] += e  # increase number of events
+            gmdata[:-1] += gmfs.sum(axis=(0, 2))
+            n += e
+            if gmfdata is None:  # curves-only mode, do not store the GMFs
+                continue
+            # the records are ordered by event and then by site;
+            # the ones with all GMVs equal to zero are discarded
+            gmvs = gmfs.transpose(2, 0, 1)  # shape (e, N, I)
+            eidx, sidx = gmvs.sum(axis=2).nonzero()
+            stop = start + len(eidx)
+            data = gmfdata[start:stop]
+            data['rlzi'] = rlzi
+            data['sid'] = sids[sidx]
+            data['eid'] = eids[eidx]
+            data['gmv'] = gmvs[eidx, sidx]
+            start = stop
+        return start
+
+    def _count(self, counts, gs, computer, all_eids, array):
+        # update the number of exceedances of the intensity measure levels
+        # for the sites affected by the rupture, for each realization
+        imtls = self.oqparam.imtls
+        sids = computer.sids
+        n = 0
+        for r, rlzi in enumerate(self.rlzs_by_gsim[gs]):
+            e = len(all_eids[r])
+            try:
+                cnt = counts[rlzi]
+            except KeyError:
+                cnt = counts[rlzi] = numpy.zeros(
+                    (self.N, len(imtls.array)), U32)
+            for imti, imt in enumerate(imtls):
+                gmvs = array[:, imti, n:n + e]  # shape (N, e)
+                cnt[sids, imtls(imt)] += (
+                    gmvs[:, :, None] >= imtls[imt]).sum(axis=1, dtype=U32)
+            n += e
 
     def get_hazard(self, data=None):
         """
@@ -374,7 +458,7 @@ class GmfGetter(object):
         :returns: an array (rlzi, sid, imti) -> array(gmv, eid)
         """
         if data is None:
-            data = self.gen_gmv()
+            data = self.get_gmfdata()
         hazard = numpy.array([collections.defaultdict(list)
                               for _ in range(self.N)])
         for rlzi, sid, eid, gmv in data:
@@ -389,30 +473,29 @@ class GmfGetter(object):
         :returns: a dict with keys gmdata, gmfdata, indices, hcurves
         """
         oq = self.oqparam
-        dt = oq.gmf_data_dt()
         with monitor('GmfGetter.init', measuremem=True):
             self.init()
         hcurves = {}  # key -> poes
         if oq.hazard_curves_from_gmfs:
-            hc_mon = monitor('building hazard curves', measuremem=False)
-            duration = oq.investigation_time * oq.ses_per_logic_tree_path
+            # the hazard curves are computed from the exceedance counts,
+            # which are updated while the GMFs are generated
+            counts = {}  # rlzi -> array (N, L)
             with monitor('building hazard', measuremem=True):
-                gmfdata = numpy.fromiter(self.gen_gmv(), dt)
-                hazard = self.get_hazard(data=gmfdata)
-            for sid, hazardr in zip(self.sids, hazard):
-                for rlzi, array in hazardr.items():
-                    if len(array) == 0:  # no data
-                        continue
-                    with hc_mon:
-                        gmvs = array['gmv']
-                        for imti, imt in enumerate(oq.imtls):
-                            poes = _gmvs_to_haz_curve(
-                                gmvs[:, imti], oq.imtls[imt],
-                                oq.investigation_time, duration)
-                            hcurves[rsi2str(rlzi, sid, imt)] = poes
+                gmfdata = self.get_gmfdata(counts, oq.ground_motion_fields)
+            with monitor('building hazard curves', measuremem=False):
+                duration = oq.investigation_time * oq.ses_per_logic_tree_path
+                for rlzi, cnt in counts.items():
+                    allpoes = 1. - numpy.exp(
+                        - oq.investigation_time / duration * cnt)
+                    for sid in cnt.any(axis=1).nonzero()[0]:
+                        for imt in oq.imtls:
+                            hcurves[rsi2str(rlzi, sid, imt)] = (
+                                allpoes[sid, oq.imtls(imt)])
+            if not oq.ground_motion_fields:  # curves-only mode
+                return dict(hcurves=hcurves, gmdata=self.gmdata)
         elif oq.ground_motion_fields:  # fast lane
             with monitor('building hazard', measuremem=True):
-                gmfdata = numpy.fromiter(self.gen_gmv(), dt)
+                gmfdata = self.get_gmfdata()
         else:
             return {}
         indices = []
@@ -423,6 +506,7 @@ class GmfGetter(object):
                 stop += 1
             indices.append((sid, start, stop))
             start = stop
+        gmfdata = encode_gmfs(gmfdata, oq.gmf_storage)
         res = dict(gmfdata=gmfdata, hcurves=hcurves, gmdata=self.gmdata,
                    indices=numpy.array(indices, (U32, 3)))
         return res
@@ -456,6 +540,98 @@ def get_maxloss_rupture(dstore, loss_type):
     return ebr
 
 
+class _Block(object):
+    # a block of records addressable with the original indices
+    def __init__(self, dset, start, stop):
+        self.array = dset[start:stop]
+        self.start = start
+
+    def __getitem__(self, slc):
+        return self.array[slc.start - self.start:slc.stop - self.start]
+
+
+def _read_block(dset, ruptures, idx):
+    # read the records in the range [min(idx1), max(idx2)) with a single
+    # read, unless the ruptures are sparse and the range is too large
+    start = ruptures[idx + '1'].min()
+    stop = ruptures[idx + '2'].max()
+    nrecords = (ruptures[idx + '2'] - ruptures[idx + '1']).sum()
+    if stop - start > 2 * nrecords:  # read the records when needed
+        return dset
+    return _Block(dset, start, stop)
+
+
+def _build_rupture(rec, geom, rupture_cls, surface_cls, trt, pmf):
+    # build a hazardlib rupture from a stored record and its geometry
+    mesh = numpy.zeros((3, rec['sy'], rec['sz']), F32)
+    geom = geom.reshape(rec['sy'], rec['sz'])
+    mesh[0] = geom['lon']
+    mesh[1] = geom['lat']
+    mesh[2] = geom['depth']
+    rupture = object.__new__(rupture_cls)
+    rupture.serial = rec['serial']
+    rupture.surface = object.__new__(surface_cls)
+    rupture.mag = rec['mag']
+    rupture.rake = rec['rake']
+    rupture.hypocenter = geo.Point(*rec['hypo'])
+    rupture.occurrence_rate = rec['occurrence_rate']
+    rupture.tectonic_region_type = trt
+    if pmf is not None:
+        rupture.pmf = pmf
+    if surface_cls is geo.PlanarSurface:
+        rupture.surface = geo.PlanarSurface.from_array(mesh[:, 0, :])
+    elif surface_cls is geo.MultiSurface:
+        # mesh has shape (3, n, 4)
+        rupture.surface.__init__([
+            geo.PlanarSurface.from_array(mesh[:, i, :])
+            for i in range(mesh.shape[1])])
+    elif surface_cls is geo.GriddedSurface:
+        # fault surface, strike and dip will be computed
+        rupture.surface.strike = rupture.surface.dip = None
+        rupture.surface.mesh = Mesh(*mesh)
+    else:
+        # fault surface, strike and dip will be computed
+        rupture.surface.strike = rupture.surface.dip = None
+        rupture.surface.__init__(RectangularMesh(*mesh))
+    # not implemented: rupture_slip_direction
+    return rupture
+
+
+class StoredEBRupture(EBRupture):
+    """
+    An EBRupture read from the datastore. The underlying rupture, and
+    in particular its surface, is built only when it is accessed, so that
+    the events can be extracted without building the geometries.
+    """
+    def __init__(self, rec, geom, events, classes, trt, pmf=None):
+        self.rec = rec
+        self.geom = geom
+        self.classes = classes  # rupture class, surface class
+        self.trt = trt
+        self.pmf = pmf
+        self.srcidx = rec['srcidx']
+        self.sids = ()
+        self.events = events
+        self.eidx1 = rec['eidx1']
+        self.eidx2 = rec['eidx2']
+
+    @cached_property
+    def rupture(self):
+        """
+        The underlying hazardlib rupture
+        """
+        rupture_cls, surface_cls = self.classes
+        return _build_rupture(self.rec, self.geom, rupture_cls, surface_cls,
+                              self.trt, self.pmf)
+
+    @property
+    def serial(self):
+        """
+        Serial number of the rupture
+        """
+        return self.rec['serial']
+
+
 class RuptureGetter(object):
     """
     Iterable over ruptures.
@@ -508,62 +684,47 @@ class RuptureGetter(object):
             getters.append(rgetter)
         return getters
 
-    def __iter__(self):
-        self.dstore.open('r')  # if needed
+    @property
+    def code2cls(self):
+        """
+        A dictionary rupture code -> (rupture class, surface class), decoded
+        from the attributes of the `ruptures` dataset only once
+        """
+        try:
+            return self._code2cls
+        except AttributeError:
+            self._code2cls = {}
         attrs = self.dstore.get_attrs('ruptures')
-        code2cls = {}  # code -> rupture_cls, surface_cls
         for key, val in attrs.items():
             if key.startswith('code_'):
-                code2cls[int(key[5:])] = [classes[v] for v in val.split()]
+                self._code2cls[int(key[5:])] = [
+                    classes[v] for v in val.split()]
+        return self._code2cls
+
+    def __iter__(self):
+        self.dstore.open('r')  # if needed
+        code2cls = self.code2cls
         grp_trt = self.dstore['csm_info'].grp_by("trt")
-        events = self.dstore['events']
         ruptures = self.dstore['ruptures'][self.mask]
+        if self.grp_id is not None:
+            ruptures = ruptures[ruptures['grp_id'] == self.grp_id]
+        if len(ruptures) == 0:
+            return
         # NB: ruptures.sort(order='serial') causes sometimes a SystemError:
         # <ufunc 'greater'> returned a result with an error set
-        # this is way I am sorting with Python and not with numpy below
-        rupgeoms = self.dstore['rupgeoms']
-        for rec in sorted(ruptures, key=operator.itemgetter('serial')):
+        # this is why I am sorting with argsort below
+        ruptures = ruptures[
+            numpy.argsort(ruptures['serial'], kind='mergesort')]
+        # read the events and the geometries with a single read each
+        events = _read_block(self.dstore['events'], ruptures, 'eidx')
+        rupgeoms = _read_block(self.dstore['rupgeoms'], ruptures, 'gidx')
+        for rec in ruptures:
             evs = events[rec['eidx1']:rec['eidx2']]
-            if self.grp_id is not None and self.grp_id != rec['grp_id']:
-                continue
-            mesh = numpy.zeros((3, rec['sy'], rec['sz']), F32)
-            geom = rupgeoms[rec['gidx1']:rec['gidx2']].reshape(
-                rec['sy'], rec['sz'])
-            mesh[0] = geom['lon']
-            mesh[1] = geom['lat']
-            mesh[2] = geom['depth']
-            rupture_cls, surface_cls = code2cls[rec['code']]
-            rupture = object.__new__(rupture_cls)
-            rupture.serial = rec['serial']
-            rupture.surface = object.__new__(surface_cls)
-            rupture.mag = rec['mag']
-            rupture.rake = rec['rake']
-            rupture.hypocenter = geo.Point(*rec['hypo'])
-            rupture.occurrence_rate = rec['occurrence_rate']
-            rupture.tectonic_region_type = grp_trt[rec['grp_id']]
+            geom = rupgeoms[rec['gidx1']:rec['gidx2']]
             pmfx = rec['pmfx']
-            if pmfx != -1:
-                rupture.pmf = self.dstore['pmfs'][pmfx]
-            if surface_cls is geo.PlanarSurface:
-                rupture.surface = geo.PlanarSurface.from_array(mesh[:, 0, :])
-            elif surface_cls is geo.MultiSurface:
-                # mesh has shape (3, n, 4)
-                rupture.surface.__init__([
-                    geo.PlanarSurface.from_array(mesh[:, i, :])
-                    for i in range(mesh.shape[1])])
-            elif surface_cls is geo.GriddedSurface:
-                # fault surface, strike and dip will be computed
-                rupture.surface.strike = rupture.surface.dip = None
-                rupture.surface.mesh = Mesh(*mesh)
-            else:
-                # fault surface, strike and dip will be computed
-                rupture.surface.strike = rupture.surface.dip = None
-                rupture.surface.__init__(RectangularMesh(*mesh))
-            ebr = EBRupture(rupture, rec['srcidx'], (), evs)
-            ebr.eidx1 = rec['eidx1']
-            ebr.eidx2 = rec['eidx2']
-            # not implemented: rupture_slip_direction
-            yield ebr
+            pmf = self.dstore['pmfs'][pmfx] if pmfx != -1 else None
+            yield StoredEBRupture(rec, geom, evs, code2cls[rec['code']],
+                                  grp_trt[rec['grp_id']], pmf)
 
     def __len__(self):
         if hasattr(self.mask, 'start'):  # is a slice
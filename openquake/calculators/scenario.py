@@ -57,7 +57,8 @@ class ScenarioCalculator(base.HazardCalculator):
         events['eid'] = numpy.arange(E)
         ebr = EBRupture(self.rup, 0, self.sitecol.sids, events)
         self.datastore['events'] = ebr.events
-        rupser = calc.RuptureSerializer(self.datastore)
+        rupser = calc.RuptureSerializer(
+            self.datastore, oq.ruptures_compression)
         rupser.save([ebr])
         rupser.close()
         self.computer = GmfComputer(
@@ -86,4 +87,5 @@ class ScenarioCalculator(base.HazardCalculator):
             with self.monitor('saving gmfs', autoflush=True):
                 base.save_gmf_data(
                     self.datastore, self.sitecol,
-                    numpy.array(list(self.gmfa.values())))
+                    numpy.array(list(self.gmfa.values())), (),
+                    self.oqparam.gmf_storage, self.oqparam.gmf_compression)
@@ -16,7 +16,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
-import itertools
 import logging
 import numpy
 
@@ -39,15 +38,15 @@ def dist_by_asset(data, multi_stat_dt, number):
     N, R, L = data.shape[:3]
     out = numpy.zeros((N, R), multi_stat_dt)
     for l, lt in enumerate(multi_stat_dt.names):
-        out_lt = out[lt]
-        for n, r in itertools.product(range(N), range(R)):
-            mean, stddev = data[n, r, l]
-            out_lt[n, r] = (mean, stddev)
-            # sanity check on the sum over all damage states
-            if abs(mean.sum() / number[n] - 1) > 1E-3:
-                logging.warn(
-                    'Asset #%d, rlz=%d, expected %s, got %s for %s damage',
-                    n, r, number[n], mean.sum(), lt)
+        out[lt]['mean'] = data[:, :, l, 0]
+        out[lt]['stddev'] = data[:, :, l, 1]
+        # sanity check on the sum over all damage states
+        totals = data[:, :, l, 0].sum(axis=-1)  # shape (N, R)
+        bad = numpy.abs(totals / number[:, None] - 1) > 1E-3
+        for n, r in zip(*bad.nonzero()):
+            logging.warn(
+                'Asset #%d, rlz=%d, expected %s, got %s for %s damage',
+                n, r, number[n], totals[n, r], lt)
     return out
 
 
@@ -64,15 +63,20 @@ def scenario_damage(riskinputs, riskmodel, param, monitor):
     :param param:
         dictionary of extra parameters
     :returns:
-        a dictionary {'d_asset': [(l, r, a, mean-stddev), ...],
-                      'd_event': damage array of shape R, L, E, D,
-                      'c_asset': [(l, r, a, mean-stddev), ...],
-                      'c_event': damage array of shape R, L, E}
+        a dictionary {'d_asset': [(l, r, aids, mean-stddev array), ...],
+                      'd_event': damage array of shape E, R, L, D,
+                      'c_asset': [(l, r, aids, mean-stddev array), ...],
+                      'c_event': damage array of shape E, R, L}
 
-    `d_asset` and `d_tag` are related to the damage distributions
-    whereas `c_asset` and `c_tag` are the consequence distributions.
+    `d_asset` and `d_event` are related to the damage distributions
+    whereas `c_asset` and `c_event` are the consequence distributions.
     If there is no consequence model `c_asset` is an empty list and
-    `c_tag` is a zero-valued array.
+    `c_event` is a zero-valued array.
+
+    The damage fractions are the same for all the assets of a given
+    taxonomy on a given site, so the distributions of all such assets
+    are computed at once by scaling the statistics of the fractions
+    by the number of units and by the asset values.
     """
     c_models = param['consequence_models']
     L = len(riskmodel.loss_types)
@@ -84,26 +88,29 @@ def scenario_damage(riskinputs, riskmodel, param, monitor):
     for ri in riskinputs:
         for outputs in riskmodel.gen_outputs(ri, monitor):
             r = outputs.rlzi
-            for l, damages in enumerate(outputs):
+            assets = outputs.assets
+            aids = assets['ordinal']
+            number = assets['number']
+            taxo = riskmodel.taxonomy[assets['taxonomy'][0]]
+            for l, fractions in enumerate(outputs):  # shape (E, D)
                 loss_type = riskmodel.loss_types[l]
+                result['d_event'][:, r, l] += fractions * number.sum()
+                mean, std = scientific.mean_std(fractions)
+                result['d_asset'].append(
+                    (l, r, aids, numpy.array([numpy.outer(number, mean),
+                                              numpy.outer(number, std)])))
                 c_model = c_models.get(loss_type)
-                for a, fraction in enumerate(damages):
-                    asset = outputs.assets[a]
-                    taxo = riskmodel.taxonomy[asset.taxonomy]
-                    damages = fraction * asset.number
-                    result['d_event'][:, r, l] += damages  # shape (E, D)
-                    if c_model:  # compute consequences
-                        means = [par[0] for par in c_model[taxo].params]
-                        # NB: we add a 0 in front for nodamage state
-                        c_ratio = numpy.dot(fraction, [0] + means)
-                        consequences = c_ratio * asset.value(loss_type)
-                        result['c_asset'].append(
-                            (l, r, asset.ordinal,
-                             scientific.mean_std(consequences)))
-                        result['c_event'][:, r, l] += consequences
-                        # TODO: consequences for the occupants
-                    result['d_asset'].append(
-                        (l, r, asset.ordinal, scientific.mean_std(damages)))
+                if c_model:  # compute consequences
+                    means = [par[0] for par in c_model[taxo].params]
+                    # NB: we add a 0 in front for nodamage state
+                    c_ratio = fractions @ ([0] + means)  # shape E
+                    avals = riskmodels.get_values(loss_type, assets)
+                    result['c_asset'].append(
+                        (l, r, aids, numpy.array([
+                            avals * c_ratio.mean(),
+                            avals * c_ratio.std(ddof=1)])))
+                    result['c_event'][:, r, l] += c_ratio * avals.sum()
+                    # TODO: consequences for the occupants
     result['gmdata'] = ri.gmdata
     return result
 
@@ -145,8 +152,8 @@ class ScenarioDamageCalculator(base.RiskCalculator):
                                                 ('stddev', (F32, D))])))
         multi_stat_dt = numpy.dtype(dt_list)
         d_asset = numpy.zeros((N, R, L, 2, D), F32)
-        for (l, r, a, stat) in result['d_asset']:
-            d_asset[a, r, l] = stat
+        for (l, r, aids, stats) in result['d_asset']:
+            d_asset[aids, r, l] = stats.transpose(1, 0, 2)  # shape (A, 2, D)
         self.datastore['dmg_by_asset'] = dist_by_asset(
             d_asset, multi_stat_dt, self.assetcol.array['number'])
         dmg_dt = [(ds, F32) for ds in self.riskmodel.damage_states]
@@ -160,8 +167,9 @@ class ScenarioDamageCalculator(base.RiskCalculator):
             dtlist = [('eid', U64), ('rlzi', U16), ('loss', (F32, L))]
             stat_dt = numpy.dtype([('mean', F32), ('stddev', F32)])
             c_asset = numpy.zeros((N, R, L), stat_dt)
-            for (l, r, a, stat) in result['c_asset']:
-                c_asset[a, r, l] = stat
+            for (l, r, aids, stats) in result['c_asset']:
+                c_asset['mean'][aids, r, l] = stats[0]
+                c_asset['stddev'][aids, r, l] = stats[1]
             multi_stat_dt = self.oqparam.loss_dt(stat_dt)
             self.datastore['losses_by_asset'] = c_asset
             self.datastore['losses_by_event'] = numpy.fromiter(
@@ -67,15 +67,15 @@ def scenario_risk(riskinputs, riskmodel, param, monitor):
                 if losses is None:  # this may happen
                     continue
                 stats = numpy.zeros((len(assets), I), stat_dt)  # mean, stddev
-                for a, asset in enumerate(assets):
+                for a, aid in enumerate(assets['ordinal']):
                     stats['mean'][a] = losses[a].mean()
                     stats['stddev'][a] = losses[a].std(ddof=1)
-                    result['avg'].append((l, r, asset.ordinal, stats[a]))
+                    result['avg'].append((l, r, aid, stats[a]))
                 agglosses = losses.sum(axis=0)  # shape E, I
                 for i in range(I):
                     result['agg'][:, r, l + L * i] += agglosses[:, i]
                 if param['asset_loss_table']:
-                    aids = [asset.ordinal for asset in outputs.assets]
+                    aids = outputs.assets['ordinal']
                     result['all_losses'][l, r] += AccumDict(zip(aids, losses))
     return result
 
@@ -101,9 +101,30 @@ class EventBasedRiskTestCase(CalculatorTestCase):
 portfolio_loss nonstructural structural
 ============== ============= ==========
 mean           4,585         15,603    
-stddev         838           555       
+stddev         838           556       
 ============== ============= ==========''')
 
+    @attr('qa', 'risk', 'event_based_risk')
+    def test_asset_loss_table(self):
+        self.run_calc(case_1.__file__, 'job.ini', asset_loss_table='true')
+        dstore = self.calc.datastore
+        lbe = dstore['losses_by_event'].value
+        l = dstore['oqparam'].lti['structural']
+
+        # the losses on all the assets are the losses by event
+        alt = extract(dstore, 'asset_loss_table/structural').array
+        ok = lbe['loss'][:, l] != 0
+        numpy.testing.assert_equal(alt['eid'], lbe['eid'][ok])
+        numpy.testing.assert_equal(alt['rlzi'], lbe['rlzi'][ok])
+        numpy.testing.assert_allclose(alt['loss'], lbe['loss'][ok, l],
+                                      rtol=1E-5)
+
+        # the losses on the tags sum up to the total losses
+        tot = sum(extract(dstore, 'asset_loss_table/structural?taxonomy=' +
+                          taxo).array['loss'].sum()
+                  for taxo in ('RC', 'RM', 'W'))
+        self.assertAlmostEqual(tot / alt['loss'].sum(), 1, places=5)
+
     @attr('qa', 'risk', 'event_based_risk')
     def test_case_1g(self):
         # vulnerability function with PMF
@@ -27,11 +27,13 @@ from openquake.baselib.general import group_array, gettemp
 from openquake.baselib.datastore import read
 from openquake.hazardlib import nrml
 from openquake.hazardlib.sourceconverter import RuptureConverter
+from openquake.commonlib import calc
 from openquake.commonlib.util import max_rel_diff_index
 from openquake.calculators.extract import extract
 from openquake.calculators.views import view, rst_table
 from openquake.calculators.export import export
 from openquake.calculators.event_based import get_mean_curves
+from openquake.calculators.getters import GmfDataGetter
 from openquake.calculators.tests import CalculatorTestCase
 from openquake.qa_tests_data.event_based import (
     blocksize, case_1, case_2, case_3, case_4, case_5, case_6, case_7,
@@ -144,6 +146,62 @@ class EventBasedTestCase(CalculatorTestCase):
         self.assertEqualFiles(
             'expected/hazard_curve-smltp_b1-gsimltp_b1-PGA.xml', fname)
 
+    @attr('qa', 'hazard', 'event_based')
+    def test_case_1_curves_only(self):
+        # the hazard curves are the same, but the GMFs are not stored
+        self.run_calc(case_1.__file__, 'job.ini',
+                      ground_motion_fields='false')
+        self.assertNotIn('gmf_data', self.calc.datastore)
+        [fname] = export(('hcurves', 'csv'), self.calc.datastore)
+        self.assertEqualFiles(
+            'expected/hazard_curve-smltp_b1-gsimltp_b1.csv', fname)
+
+    @attr('qa', 'hazard', 'event_based')
+    def test_sorted_gmf_data(self):
+        self.run_calc(case_5.__file__, 'job.ini')
+        dstore = self.calc.datastore
+        data = dstore['gmf_data/data'].value
+        indices = dstore['gmf_data/indices'].value
+        self.assertEqual(indices.dtype.name, 'uint32')
+        # the rows are sorted by site and contiguous
+        self.assertTrue((numpy.diff(data['sid'].astype(int)) >= 0).all())
+        self.assertGreater(len(indices), 1)
+        numpy.testing.assert_equal(indices[1:, 0], indices[:-1, 1])
+        for sid, (start, stop) in enumerate(indices):
+            self.assertTrue((data['sid'][start:stop] == sid).all())
+        # reading a tile of sites is the same as reading site by site
+        sids = list(range(len(indices)))
+        getter = GmfDataGetter(
+            dstore, sids, self.calc.R, self.calc.oqparam.imtls)
+        getter.init()
+        for sid in sids:
+            for rlzi, array in getter[sid].items():
+                numpy.testing.assert_equal(getter.data[sid][rlzi], array)
+
+    @attr('qa', 'hazard', 'event_based')
+    def test_gmf_storage(self):
+        self.run_calc(case_5.__file__, 'job.ini')
+        expected = self.calc.datastore['gmf_data/data'].value
+        self.run_calc(case_5.__file__, 'job.ini', gmf_storage='uint16',
+                      gmf_compression='gzip')
+        dset = self.calc.datastore['gmf_data/data']
+        self.assertEqual(dset.dtype['gmv'].base.name, 'uint16')
+        self.assertEqual(dset.compression, 'gzip')
+        data = calc.decode_gmfs(dset.value)
+        numpy.testing.assert_equal(data['eid'], expected['eid'])
+        numpy.testing.assert_allclose(data['gmv'], expected['gmv'],
+                                      rtol=2E-4)
+
+    @attr('qa', 'hazard', 'event_based')
+    def test_ruptures_compression(self):
+        self.run_calc(case_5.__file__, 'job.ini')
+        expected = self.calc.datastore['ruptures'].value
+        self.run_calc(case_5.__file__, 'job.ini', ruptures_compression='lzf')
+        dset = self.calc.datastore['ruptures']
+        self.assertEqual(dset.compression, 'lzf')
+        self.assertEqual(self.calc.datastore['rupgeoms'].compression, 'lzf')
+        numpy.testing.assert_equal(dset.value, expected)
+
     @attr('qa', 'hazard', 'event_based')
     def test_minimum_intensity(self):
         out = self.run_calc(case_2.__file__, 'job.ini', exports='csv',
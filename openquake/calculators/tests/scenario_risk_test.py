@@ -198,6 +198,29 @@ class ScenarioRiskTestCase(CalculatorTestCase):
         self.assertEqual(obj.tags, [b'state=01'])
         aac(obj.array, [[1316.3723145, 1569.1348877]])
 
+        # the risk array is consistent with the Asset objects
+        assetcol = self.calc.datastore['assetcol']
+        arr = assetcol.get_risk_array()
+        for aid in range(len(assetcol)):
+            asset = assetcol[aid]
+            self.assertEqual(arr['ordinal'][aid], asset.ordinal)
+            for lt in ('structural', 'nonstructural', 'contents'):
+                aac(arr['value-' + lt][aid], asset.value(lt))
+            aac(arr['deductible-structural'][aid],
+                asset.deductible('structural'))
+            aac(arr['insurance_limit-structural'][aid],
+                asset.insurance_limit('structural'))
+
+        # the tag index stored in the datastore is consistent with the tags
+        for tagname in assetcol.tagnames:
+            aids, offsets = assetcol._tag_index[tagname]
+            for tagidx in range(len(offsets) - 1):
+                expected = (assetcol.array[tagname] == tagidx).nonzero()[0]
+                numpy.testing.assert_equal(
+                    aids[offsets[tagidx]:offsets[tagidx + 1]], expected)
+        numpy.testing.assert_equal(assetcol.get_aids('state=01'), [1, 4])
+        self.assertEqual(len(assetcol.get_aids('state=XX')), 0)
+
     @attr('qa', 'risk', 'scenario_risk')
     def test_case_7(self):
         # check independence from concurrent_tasks
@@ -243,3 +266,19 @@ class ScenarioRiskTestCase(CalculatorTestCase):
             atol=.1)
         aac(agglosses['stddev'], numpy.array([[951769.25]], numpy.float32),
             atol=.1)
+
+    @attr('qa', 'risk', 'scenario_risk')
+    def test_case_shakemap_uint16(self):
+        # the ShakeMap GMFs honour gmf_storage and gmf_compression
+        self.run_calc(case_shakemap.__file__, 'pre-job.ini')
+        self.run_calc(case_shakemap.__file__, 'job.ini',
+                      hazard_calculation_id=str(self.calc.datastore.calc_id),
+                      gmf_storage='uint16', gmf_compression='gzip')
+        dset = self.calc.datastore['gmf_data/data']
+        self.assertEqual(dset.dtype['gmv'].base, numpy.uint16)
+        self.assertEqual(dset.compression, 'gzip')
+        agglosses = extract(self.calc.datastore, 'agglosses-rlzs')
+        aac(agglosses['mean'], numpy.array([[795843.7]], numpy.float32),
+            rtol=1E-3)
+        aac(agglosses['stddev'], numpy.array([[951769.25]], numpy.float32),
+            rtol=1E-3)
@@ -776,7 +776,7 @@ def view_global_gmfs(token, dstore):
     Display GMFs averaged on everything for debugging purposes
     """
     imtls = dstore['oqparam'].imtls
-    row = dstore['gmf_data/data']['gmv'].mean(axis=0)
+    row = calc.decode_gmfs(dstore['gmf_data/data'].value)['gmv'].mean(axis=0)
     return rst_table([row], header=imtls)
 
 
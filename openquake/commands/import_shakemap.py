@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2018 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import logging
+from openquake.baselib import sap, performance
+from openquake.hazardlib import shakemap
+
+
+@sap.Script
+def import_shakemap(shakemap_id, grid_file=None, uncertainty_file=None,
+                    cache_dir=None):
+    """
+    Parse a USGS shakemap and store it in the local shakemap cache, so that
+    the calculations with the given shakemap_id will not need to access the
+    network. If no grid file is given, the shakemap is downloaded again,
+    thus refreshing the cache.
+    """
+    logging.basicConfig(level=logging.INFO)
+    with performance.Monitor('import_shakemap') as mon:
+        if grid_file:
+            array = shakemap.get_shakemap_array(grid_file, uncertainty_file)
+        else:
+            array = shakemap.download_array(shakemap_id)
+        checksum = shakemap.cache_array(array, shakemap_id, cache_dir)
+    print('Stored shakemap %s with %d points [%s]' % (
+        shakemap_id, len(array), checksum))
+    print(mon)
+    return checksum
+
+import_shakemap.arg('shakemap_id', 'USGS shakemap ID')
+import_shakemap.arg('grid_file', 'grid.xml file', nargs='?')
+import_shakemap.arg('uncertainty_file', 'uncertainty.xml file', nargs='?')
+import_shakemap.opt(
+    'cache_dir', 'cache directory (default <datadir>/shakemaps)', '-d')
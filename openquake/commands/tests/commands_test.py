@@ -26,7 +26,7 @@ import unittest
 from openquake.baselib.python3compat import encode
 from openquake.baselib.general import gettemp
 from openquake.baselib.datastore import read
-from openquake import commonlib
+from openquake import commonlib, hazardlib
 from openquake.commonlib.readinput import read_csv
 from openquake.commands.info import info
 from openquake.commands.tidy import tidy
@@ -41,9 +41,11 @@ from openquake.commands.from_shapefile import from_shapefile
 from openquake.commands.zip import zip as zip_cmd
 from openquake.commands.check_input import check_input
 from openquake.commands.prepare_site_model import prepare_site_model
+from openquake.commands.import_shakemap import import_shakemap
 from openquake.commands import run
 from openquake.commands.upgrade_nrml import upgrade_nrml
 from openquake.calculators.views import view
+from openquake.hazardlib.shakemap import get_cached_array
 from openquake.qa_tests_data.classical import case_1, case_9, case_18
 from openquake.qa_tests_data.classical_risk import case_3
 from openquake.qa_tests_data.scenario import case_4
@@ -452,3 +454,20 @@ class PrepareSiteModelTestCase(unittest.TestCase):
         sc = prepare_site_model.func(exposure_csv, [vs30_csv],
                                      True, True, False, 0, 5, output)
         self.assertEqual(len(sc), 148)  # 148 sites within 5 km from the params
+
+
+class ImportShakemapTestCase(unittest.TestCase):
+    def test(self):
+        smdir = os.path.join(hazardlib.__path__[0], 'tests', 'shakemap')
+        grid = os.path.join(smdir, 'ghorka_grid.xml')
+        uncertainty = os.path.join(smdir, 'ghorka_uncertainty.xml')
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with Print.patch() as p:
+                checksum = import_shakemap.func(
+                    'us20002926', grid, uncertainty, cache_dir)
+            self.assertIn(checksum, str(p))
+            array = get_cached_array('us20002926', cache_dir)
+            self.assertEqual(len(array), 4)
+        finally:
+            shutil.rmtree(cache_dir)
@@ -140,44 +140,81 @@ def compute_hazard_maps(curves, imls, poes):
     return numpy.array(result)
 
 
-# #########################  GMF->curves #################################### #
+# ########################## GMF storage ################################## #
 
-# NB (MS): the approach used here will not work for non-poissonian models
-def _gmvs_to_haz_curve(gmvs, imls, invest_time, duration):
+# the range of the GMVs which can be stored as log-scaled uint16; the value 0
+# is reserved for zero GMVs and the relative error of the encoding is
+# smaller than GMV_STEP / 2, i.e. less than 0.02%
+GMV_MIN = 1E-6
+GMV_MAX = 1E4
+GMV_STEP = (numpy.log(GMV_MAX) - numpy.log(GMV_MIN)) / (TWO16 - 2)
+F16 = numpy.float16
+F16_MAX = numpy.finfo(F16).max
+
+
+def gmf_storage_dt(gmf_data_dt, gmf_storage='float32'):
     """
-    Given a set of ground motion values (``gmvs``) and intensity measure levels
-    (``imls``), compute hazard curve probabilities of exceedance.
+    :param gmf_data_dt: a composite dtype with a field `gmv`
+    :param gmf_storage: 'float32', 'float16' or 'uint16'
+    :returns: the composite dtype used to store the GMFs
+    """
+    base = dict(float32=F32, float16=F16, uint16=U16)[gmf_storage]
+    return numpy.dtype([
+        (name, (base, gmf_data_dt['gmv'].shape) if name == 'gmv'
+         else gmf_data_dt[name]) for name in gmf_data_dt.names])
 
-    :param gmvs:
-        A list of ground motion values, as floats.
-    :param imls:
-        A list of intensity measure levels, as floats.
-    :param float invest_time:
-        Investigation time, in years. It is with this time span that we compute
-        probabilities of exceedance.
-
-        Another way to put it is the following. When computing a hazard curve,
-        we want to answer the question: What is the probability of ground
-        motion meeting or exceeding the specified levels (``imls``) in a given
-        time span (``invest_time``).
-    :param float duration:
-        Time window during which GMFs occur. Another was to say it is, the
-        period of time over which we simulate ground motion occurrences.
-
-        NOTE: Duration is computed as the calculation investigation time
-        multiplied by the number of stochastic event sets.
 
-    :returns:
-        Numpy array of PoEs (probabilities of exceedance).
+def encode_gmfs(gmfdata, gmf_storage='float32'):
     """
-    # convert to numpy array and redimension so that it can be broadcast with
-    # the gmvs for computing PoE values; there is a gmv for each rupture
-    # here is an example: imls = [0.03, 0.04, 0.05], gmvs=[0.04750576]
-    # => num_exceeding = [1, 1, 0] coming from 0.04750576 > [0.03, 0.04, 0.05]
-    imls = numpy.array(imls).reshape((len(imls), 1))
-    num_exceeding = numpy.sum(numpy.array(gmvs) >= imls, axis=1)
-    poes = 1 - numpy.exp(- (invest_time / duration) * num_exceeding)
-    return poes
+    Convert the GMVs into the storage format. float16 has a relative
+    error of 0.05% for GMVs over 6E-5; uint16 stores the logarithm of the
+    GMVs in the range [GMV_MIN, GMV_MAX] with a relative error of 0.02%.
+
+    :param gmfdata: an array of dtype gmf_data_dt
+    :param gmf_storage: 'float32', 'float16' or 'uint16'
+    :returns: an array of dtype gmf_storage_dt
+    """
+    if gmf_storage == 'float32':
+        return gmfdata
+    data = numpy.zeros(len(gmfdata), gmf_storage_dt(gmfdata.dtype,
+                                                    gmf_storage))
+    for name in gmfdata.dtype.names:
+        if name != 'gmv':
+            data[name] = gmfdata[name]
+    gmv = gmfdata['gmv']
+    if gmf_storage == 'float16':
+        data['gmv'] = numpy.minimum(gmv, F16_MAX)
+    else:  # uint16
+        ok = gmv > 0
+        logs = numpy.log(numpy.clip(gmv[ok], GMV_MIN, GMV_MAX))
+        codes = data['gmv']
+        codes[ok] = numpy.round((logs - numpy.log(GMV_MIN)) / GMV_STEP) + 1
+    return data
+
+
+def decode_gmfs(data):
+    """
+    Convert the stored GMFs into an array with float32 GMVs; the storage
+    format is inferred from the dtype of the field `gmv`.
+
+    :param data: an array of dtype gmf_storage_dt
+    :returns: an array of dtype gmf_data_dt
+    """
+    base = data.dtype['gmv'].base
+    if base == F32:
+        return data
+    gmfdata = numpy.zeros(len(data), gmf_storage_dt(data.dtype))
+    for name in data.dtype.names:
+        if name != 'gmv':
+            gmfdata[name] = data[name]
+    codes = data['gmv']
+    if base == F16:
+        gmfdata['gmv'] = codes
+    else:  # uint16
+        gmv = gmfdata['gmv']
+        ok = codes > 0
+        gmv[ok] = numpy.exp(numpy.log(GMV_MIN) + (codes[ok] - 1.) * GMV_STEP)
+    return gmfdata
 
 
 # ################## utilities for classical calculators ################ #
@@ -352,7 +389,8 @@ class RuptureData(object):
 class RuptureSerializer(object):
     """
     Serialize event based ruptures on an HDF5 files. Populate the datasets
-    `ruptures` and `sids`.
+    `ruptures` and `rupgeoms`. The ruptures are buffered in memory and
+    written in bulk every `bufsize` bytes and when the serializer is closed.
     """
     rupture_dt = numpy.dtype([
         ('serial', U32), ('srcidx', U16), ('grp_id', U16), ('code', U8),
@@ -367,37 +405,47 @@ class RuptureSerializer(object):
         """
         Convert a list of EBRuptures into a numpy composite array
         """
-        lst = []
-        geoms = []
+        array = numpy.zeros(len(ebruptures), cls.rupture_dt)
+        meshes = []
         nbytes = 0
-        for ebrupture in ebruptures:
+        for i, ebrupture in enumerate(ebruptures):
             rup = ebrupture.rupture
             mesh = surface_to_array(rup.surface)
             sy, sz = mesh.shape[1:]
             # sanity checks
             assert sy < TWO16, 'Too many multisurfaces: %d' % sy
             assert sz < TWO16, 'The rupture mesh spacing is too small'
-            hypo = rup.hypocenter.x, rup.hypocenter.y, rup.hypocenter.z
-            rate = getattr(rup, 'occurrence_rate', numpy.nan)
-            points = mesh.reshape(3, -1).T   # shape (n, 3)
-            n = len(points)
-            tup = (ebrupture.serial, ebrupture.srcidx, ebrupture.grp_id,
-                   rup.code, ebrupture.eidx1, ebrupture.eidx2,
-                   offset, offset + n, getattr(ebrupture, 'pmfx', -1),
-                   rup.mag, rup.rake, rate, hypo, sy, sz)
-            offset += n
-            lst.append(tup)
-            geoms.append(numpy.array([tuple(p) for p in points], point3d))
+            array[i] = (
+                ebrupture.serial, ebrupture.srcidx, ebrupture.grp_id,
+                rup.code, ebrupture.eidx1, ebrupture.eidx2, 0, 0,
+                getattr(ebrupture, 'pmfx', -1), rup.mag, rup.rake,
+                getattr(rup, 'occurrence_rate', numpy.nan),
+                (rup.hypocenter.x, rup.hypocenter.y, rup.hypocenter.z),
+                sy, sz)
+            meshes.append(mesh.reshape(3, -1))
             nbytes += cls.rupture_dt.itemsize + mesh.nbytes
-        geom = numpy.concatenate(geoms)
-        return numpy.array(lst, cls.rupture_dt), geom, nbytes
-
-    def __init__(self, datastore):
+        # the geometries are stored as a single array of points
+        lons, lats, depths = numpy.concatenate(meshes, axis=1)
+        geom = numpy.zeros(len(lons), point3d)
+        geom['lon'] = lons
+        geom['lat'] = lats
+        geom['depth'] = depths
+        stops = numpy.cumsum(array['sy'].astype(U32) * array['sz'])
+        array['gidx1'] = offset + stops - array['sy'] * array['sz']
+        array['gidx2'] = offset + stops
+        return array, geom, nbytes
+
+    def __init__(self, datastore, compression=None, bufsize=10 * 1024 ** 2):
         self.datastore = datastore
         self.nbytes = 0
         self.nruptures = 0
-        datastore.create_dset('ruptures', self.rupture_dt, attrs={'nbytes': 0})
-        datastore.create_dset('rupgeoms', point3d)
+        self.ngeoms = 0  # number of points in the rupture geometries
+        self.bufsize = bufsize
+        self.buffer = []  # list of pairs (rupture array, geometry array)
+        self.buffered = 0  # number of bytes in the buffer
+        datastore.create_dset('ruptures', self.rupture_dt,
+                              compression=compression, attrs={'nbytes': 0})
+        datastore.create_dset('rupgeoms', point3d, compression=compression)
 
     def save(self, ebruptures, eidx=0):
         """
@@ -421,26 +469,34 @@ class RuptureSerializer(object):
                 pmfbytes += self.pmfs_dt.itemsize + rup.pmf.nbytes
 
         # store the ruptures in a compact format
-        offset = len(self.datastore['rupgeoms'])
-        array, geom, nbytes = self.get_array_nbytes(ebruptures, offset)
-        previous = self.datastore.get_attr('ruptures', 'nbytes', 0)
-        dset = self.datastore.extend(
-            'ruptures', array, nbytes=previous + nbytes)
-        self.datastore.extend('rupgeoms', geom)
-
-        # save nbytes occupied by the PMFs
-        if pmfbytes:
-            if 'nbytes' in dset.attrs:
-                dset.attrs['nbytes'] += pmfbytes
-            else:
-                dset.attrs['nbytes'] = pmfbytes
+        array, geom, nbytes = self.get_array_nbytes(ebruptures, self.ngeoms)
+        self.ngeoms += len(geom)
+        self.nbytes += nbytes + pmfbytes
+        self.buffer.append((array, geom))
+        self.buffered += array.nbytes + geom.nbytes
+        if self.buffered >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered ruptures and geometries on the datastore
+        """
+        if not self.buffer:
+            return
+        arrays, geoms = zip(*self.buffer)
+        self.datastore.extend('ruptures', numpy.concatenate(arrays),
+                              nbytes=self.nbytes)
+        self.datastore.extend('rupgeoms', numpy.concatenate(geoms))
         self.datastore.flush()
+        self.buffer = []
+        self.buffered = 0
 
     def close(self):
         """
         Save information about the rupture codes as attributes of the
         'ruptures' dataset.
         """
+        self.flush()
         if 'ruptures' not in self.datastore:  # for UCERF
             return
         codes = numpy.unique(self.datastore['ruptures']['code'])
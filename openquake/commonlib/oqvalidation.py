@@ -53,6 +53,7 @@ class OqParam(valid.ParamSet):
     asset_life_expectancy = valid.Param(valid.positivefloat)
     avg_losses = valid.Param(valid.boolean, True)
     base_path = valid.Param(valid.utf8, '.')
+    cache_inputs = valid.Param(valid.boolean, False)
     calculation_mode = valid.Param(valid.Choice(), '')  # -> get_oqparam
     coordinate_bin_width = valid.Param(valid.positivefloat)
     compare_with_classical = valid.Param(valid.boolean, False)
@@ -74,6 +75,10 @@ class OqParam(valid.ParamSet):
     prefilter_sources = valid.Param(valid.Choice('rtree', 'numpy', 'no'),
                                     'rtree')
     filter_distance = valid.Param(valid.Choice('rjb', 'rrup'), None)
+    gmf_compression = valid.Param(
+        valid.NoneOr(valid.Choice('gzip', 'lzf')), None)
+    gmf_storage = valid.Param(
+        valid.Choice('float32', 'float16', 'uint16'), 'float32')
     ground_motion_correlation_model = valid.Param(
         valid.NoneOr(valid.Choice(*GROUND_MOTION_CORRELATION_MODELS)), None)
     ground_motion_correlation_params = valid.Param(valid.dictionary)
@@ -130,6 +135,8 @@ class OqParam(valid.ParamSet):
     risk_imtls = valid.Param(valid.intensity_measure_types_and_levels, {})
     risk_investigation_time = valid.Param(valid.positivefloat, None)
     rupture_mesh_spacing = valid.Param(valid.positivefloat)
+    ruptures_compression = valid.Param(
+        valid.NoneOr(valid.Choice('gzip', 'lzf')), None)
     complex_fault_mesh_spacing = valid.Param(
         valid.NoneOr(valid.positivefloat), None)
     return_periods = valid.Param(valid.positiveints, None)
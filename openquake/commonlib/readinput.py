@@ -21,6 +21,7 @@ import csv
 import copy
 import zlib
 import shutil
+import hashlib
 import zipfile
 import logging
 import tempfile
@@ -28,8 +29,10 @@ import operator
 import configparser
 import collections
 import numpy
+import h5py
 
-from openquake.baselib import performance, hdf5, parallel
+from openquake.baselib import (
+    performance, hdf5, parallel, datastore, __version__)
 from openquake.baselib.general import (
     AccumDict, DictArray, deprecated, random_filter)
 from openquake.baselib.python3compat import decode, zip
@@ -252,10 +255,7 @@ def get_mesh(oqparam):
     :param oqparam:
         an :class:`openquake.commonlib.oqvalidation.OqParam` instance
     """
-    global pmap, exposure, gmfs, eids
-    if 'exposure' in oqparam.inputs and exposure is None:
-        # read it only once
-        exposure = get_exposure(oqparam)
+    global pmap, gmfs, eids
     if oqparam.sites:
         return geo.Mesh.from_coords(oqparam.sites)
     elif 'sites' in oqparam.inputs:
@@ -293,7 +293,7 @@ def get_mesh(oqparam):
         return geo.Mesh.from_coords(oqparam.sites)
     elif oqparam.region_grid_spacing:
         poly = (geo.Polygon.from_wkt(oqparam.region) if oqparam.region
-                else exposure.mesh.get_convex_hull())
+                else get_exposure_mesh(oqparam).get_convex_hull())
         try:
             mesh = poly.dilate(oqparam.region_grid_spacing).discretize(
                 oqparam.region_grid_spacing)
@@ -303,7 +303,7 @@ def get_mesh(oqparam):
                 'Could not discretize region with grid spacing '
                 '%(region_grid_spacing)s' % vars(oqparam))
     elif 'exposure' in oqparam.inputs:
-        return exposure.mesh
+        return get_exposure_mesh(oqparam)
 
 
 def get_site_model(oqparam, req_site_params):
@@ -323,6 +323,19 @@ def get_site_model(oqparam, req_site_params):
         if 'site_id' not in sm.dtype.names:
             sm.sort(order=['lon', 'lat'])
         return sm
+    if oqparam.cache_inputs and isinstance(fname, str):
+        key = get_cache_key([fname], sorted(req_site_params))
+        cache = read_cache(key)
+        if cache is None:
+            sm = _get_site_model(fname, req_site_params)
+            write_cache(key, site_model=sm)
+        else:
+            sm = cache['site_model']
+        return sm
+    return _get_site_model(fname, req_site_params)
+
+
+def _get_site_model(fname, req_site_params):
     nodes = nrml.read(fname).siteModel
     params = [valid.site_param(node.attrib) for node in nodes]
     missing = req_site_params - set(params[0])
@@ -331,7 +344,7 @@ def get_site_model(oqparam, req_site_params):
             param['backarc'] = False
     elif missing:
         raise InvalidFile('%s: missing parameter %s' %
-                          (oqparam.inputs['site_model'], ', '.join(missing)))
+                          (fname, ', '.join(missing)))
     # NB: the sorted in sorted(params[0]) is essential, otherwise there is
     # an heisenbug in scenario/test_case_4
     site_model_dt = numpy.dtype([(p, site.site_param_dt[p])
@@ -896,19 +909,91 @@ def get_exposure(oqparam):
     return exposure
 
 
+def get_exposure_fnames(oqparam):
+    """
+    :param oqparam: calculation parameters
+    :returns: the exposure file and the CSV files it refers to, if any
+    """
+    fname = oqparam.inputs['exposure']
+    # for XML exposures stop at the first asset, for CSV exposures
+    # read the small XML file completely to get the names of the CSV files
+    _exposure, assets = asset._get_exposure(fname, stop='asset')
+    dirname = os.path.dirname(fname)
+    csvnames = (assets.text or '').split() if not len(assets) else []
+    return [fname] + [os.path.join(dirname, name) for name in csvnames]
+
+
+def _exposure_key(oqparam):
+    return get_cache_key(
+        get_exposure_fnames(oqparam), oqparam.calculation_mode,
+        oqparam.region, sorted(oqparam.ignore_missing_costs))
+
+
+def get_exposure_mesh(oqparam):
+    """
+    Read the exposure (only once) and return its mesh; if the parameter
+    `cache_inputs` is set, the mesh is read from the cache, if possible,
+    and the exposure is not parsed.
+
+    :param oqparam: calculation parameters
+    :returns: the mesh of the exposure
+    """
+    global exposure
+    if exposure is not None:
+        return exposure.mesh
+    if oqparam.cache_inputs:
+        key = _exposure_key(oqparam)
+        cache = read_cache(key)
+        if cache is not None:
+            return geo.Mesh(cache['lons'], cache['lats'])
+    exposure = get_exposure(oqparam)
+    if oqparam.cache_inputs:
+        write_cache(key, lons=exposure.mesh.lons, lats=exposure.mesh.lats)
+    return exposure.mesh
+
+
 def get_sitecol_assetcol(oqparam, haz_sitecol=None, cost_types=()):
     """
     :param oqparam: calculation parameters
     :param haz_sitecol: the hazard site collection
     :param cost_types: the expected cost types
     :returns: (site collection, asset collection) instances
+
+    If the parameter `cache_inputs` is set, the collections are stored
+    in the cache and read from there in the following calculations with
+    the same exposure, hazard sites and parameters.
     """
+    if haz_sitecol is None:
+        haz_sitecol = get_site_collection(oqparam)
+    if not oqparam.cache_inputs:
+        return _get_sitecol_assetcol(oqparam, haz_sitecol, cost_types)
+    complete = haz_sitecol.complete.array
+    key = get_cache_key(
+        [], _exposure_key(oqparam), sorted(cost_types), oqparam.time_event,
+        oqparam.asset_hazard_distance, oqparam.region_grid_spacing,
+        bool(oqparam.hazard_calculation_id), 'gmfs' in oqparam.inputs,
+        'hazard_curves' in oqparam.inputs,
+        hashlib.md5(complete.tobytes() + complete.dtype.str.encode('ascii')
+                    + haz_sitecol.sids.tobytes()).hexdigest())
+    cache = read_cache(key)
+    if cache is None:
+        sitecol, assetcol, discarded = _get_sitecol_assetcol(
+            oqparam, haz_sitecol, cost_types)
+        objects = dict(sitecol=sitecol.complete, sids=sitecol.sids,
+                       assetcol=assetcol)
+        if len(discarded):
+            objects['discarded'] = discarded
+        write_cache(key, **objects)
+        return sitecol, assetcol, discarded
+    sitecol = cache['sitecol'].filtered(cache['sids'])
+    return sitecol, cache['assetcol'], cache.get('discarded', [])
+
+
+def _get_sitecol_assetcol(oqparam, haz_sitecol, cost_types):
     global exposure
     if exposure is None:
         # haz_sitecol not extracted from the exposure
         exposure = get_exposure(oqparam)
-    if haz_sitecol is None:
-        haz_sitecol = get_site_collection(oqparam)
     missing = set(cost_types) - set(exposure.cost_types['name']) - set(
         ['occupants'])  # TODO: remove occupants and fragility special cases
     if missing and not oqparam.calculation_mode.endswith('damage'):
@@ -1247,3 +1332,62 @@ def get_checksum32(oqparam):
         else:
             raise ValueError('%s does not exist or is not a file' % fname)
     return checksum
+
+
+# ############################ inputs cache ############################ #
+
+def get_cache_dir():
+    """
+    :returns: the directory where the parsed inputs are cached
+    """
+    return os.path.join(datastore.get_datadir(), 'cache')
+
+
+def get_cache_key(fnames, *params):
+    """
+    :param fnames: a list of input files
+    :param params: the parameters affecting the parsing of the files
+    :returns: the MD5 checksum of the files, the parameters and the
+              engine version, to be used as a key in the cache
+    """
+    md5 = hashlib.md5(__version__.encode('utf8'))
+    for fname in fnames:
+        with open(fname, 'rb') as f:
+            md5.update(f.read())
+    md5.update(repr(params).encode('utf8'))
+    return md5.hexdigest()
+
+
+def read_cache(key, cache_dir=None):
+    """
+    :param key: a key returned by :func:`get_cache_key`
+    :param cache_dir: cache directory (default <datadir>/cache)
+    :returns: a dictionary with the cached objects or None if not cached
+    """
+    fname = os.path.join(cache_dir or get_cache_dir(), key + '.hdf5')
+    if not os.path.exists(fname):
+        return
+    dic = {}
+    with hdf5.File(fname, 'r') as f:
+        for name in f:
+            obj = f[name]
+            dic[name] = obj.value if isinstance(obj, h5py.Dataset) else obj
+    logging.info('Read %s from the cache', ' '.join(sorted(dic)))
+    return dic
+
+
+def write_cache(key, cache_dir=None, **objects):
+    """
+    Store the given objects in the file <cache_dir>/<key>.hdf5
+
+    :param key: a key returned by :func:`get_cache_key`
+    :param cache_dir: cache directory (default <datadir>/cache)
+    :param objects: arrays or objects with a __toh5__ method
+    """
+    cache_dir = cache_dir or get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    fname = os.path.join(cache_dir, key + '.hdf5')
+    with hdf5.File(fname + '.tmp', 'w') as f:
+        for name, obj in objects.items():
+            f[name] = obj
+    os.replace(fname + '.tmp', fname)  # atomic rename
@@ -1,7 +1,12 @@
+import shutil
+import tempfile
 import unittest
 import numpy
-from openquake.baselib import general
+from openquake.baselib import general, datastore
+from openquake.hazardlib import nrml
 from openquake.hazardlib.sourceconverter import SourceConverter
+from openquake.hazardlib.source.rupture import BaseRupture, EBRupture
+from openquake.hazardlib.calc.stochastic import event_dt
 from openquake.commonlib import calc
 
 converter = SourceConverter(
@@ -64,3 +69,64 @@ class HazardMapsTestCase(unittest.TestCase):
         ]
         actual = calc.compute_hazard_maps(numpy.array(curves), imls, poes)
         aaae(expected, actual.T)
+
+
+class RuptureSerializerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        BaseRupture.init()  # initialize rupture codes
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def make_ebruptures(self, serials):
+        ebruptures = []
+        for serial in serials:
+            [rup_node] = nrml.read(planar)
+            rup = converter.convert_node(rup_node)
+            rup.serial = serial
+            ebruptures.append(
+                EBRupture(rup, 0, (), numpy.zeros(2, event_dt)))
+        return ebruptures
+
+    def test_buffering(self):
+        dstore = datastore.DataStore(datadir=self.datadir)
+        rupser = calc.RuptureSerializer(dstore, compression='gzip')
+        rupser.save(self.make_ebruptures([1, 2]))
+        rupser.save(self.make_ebruptures([3]), eidx=4)
+        self.assertEqual(len(dstore['ruptures']), 0)  # still buffered
+        rupser.close()
+        ruptures = dstore['ruptures'][()]
+        geoms = dstore['rupgeoms'][()]
+        self.assertEqual(list(ruptures['serial']), [1, 2, 3])
+        self.assertEqual(list(ruptures['eidx1']), [0, 2, 4])
+        # the geometries are contiguous
+        self.assertEqual(ruptures['gidx1'][0], 0)
+        self.assertEqual(list(ruptures['gidx1'][1:]),
+                         list(ruptures['gidx2'][:-1]))
+        self.assertEqual(ruptures['gidx2'][-1], len(geoms))
+        aaae(geoms[:4]['depth'], [2.4, 2.4, 9.4, 9.4])
+        dstore.close()
+
+
+class GmfStorageTestCase(unittest.TestCase):
+    def test_encode_decode(self):
+        dt = numpy.dtype([('rlzi', numpy.uint16), ('sid', numpy.uint32),
+                          ('eid', numpy.uint64),
+                          ('gmv', (numpy.float32, (2,)))])
+        gmfdata = numpy.zeros(100, dt)
+        gmfdata['sid'] = numpy.arange(100)
+        gmfdata['gmv'] = numpy.random.RandomState(42).lognormal(
+            -3, 1, (100, 2))
+        gmfdata['gmv'][0] = 0  # zeros are preserved
+        for storage, rtol in [('float16', 5E-4), ('uint16', 2E-4)]:
+            data = calc.encode_gmfs(gmfdata, storage)
+            self.assertEqual(data.dtype['gmv'].base.name, storage)
+            decoded = calc.decode_gmfs(data)
+            self.assertEqual(decoded.dtype, dt)
+            numpy.testing.assert_equal(decoded['sid'], gmfdata['sid'])
+            numpy.testing.assert_allclose(
+                decoded['gmv'], gmfdata['gmv'], rtol=rtol)
@@ -32,6 +32,7 @@ from openquake.risklib import asset
 from openquake.risklib.riskinput import ValidationError
 from openquake.commonlib import readinput, writers, oqvalidation
 from openquake.qa_tests_data.classical import case_1, case_2
+from openquake.qa_tests_data.event_based import case_16
 from openquake.qa_tests_data.event_based_risk import case_caracas
 
 
@@ -488,6 +489,79 @@ POLYGON((78.0 31.5, 89.5 31.5, 89.5 25.5, 78.0 25.5, 78.0 31.5))'''
         self.assertIn("'RM ' contains whitespace chars, line 11",
                       str(ctx.exception))
 
+    def _csv_exposure(self, rows):
+        csvname = general.gettemp('''\
+id,number,taxonomy,lon,lat,structural
+''' + rows, suffix='.csv')
+        return general.gettemp('''\
+<?xml version='1.0' encoding='UTF-8'?>
+<nrml xmlns="http://openquake.org/xmlns/nrml/0.5">
+  <exposureModel id="ep" category="buildings">
+    <description>Exposure model for buildings</description>
+    <conversions>
+      <costTypes>
+        <costType name="structural" unit="USD" type="per_asset"/>
+      </costTypes>
+    </conversions>
+    <assets>%s</assets>
+  </exposureModel>
+</nrml>''' % os.path.basename(csvname), suffix='.xml'), csvname
+
+    def test_csv_chunks(self):
+        rows = ''.join('a%d,%d,RM%d,81.29851,29.10982,%d\n' % (i, i + 1, i % 2,
+                                                                1000 * i)
+                       for i in range(5))
+        rows += '\n\n'  # empty lines are skipped
+        fname, _ = self._csv_exposure(rows)
+        with mock.patch.object(asset, 'CSV_CHUNKSIZE', 2):
+            exp = asset.Exposure.read(fname)
+        self.assertEqual(exp.asset_refs, [b'a0', b'a1', b'a2', b'a3', b'a4'])
+        self.assertEqual(exp.tagcol.taxonomy, ['?', 'RM0', 'RM1'])
+        nodes = list(asset.Exposure.read(fname, asset_nodes=True))
+        for ass, node in zip(exp.assets, nodes):
+            self.assertEqual(ass.location, (node.location['lon'],
+                                            node.location['lat']))
+            self.assertEqual(ass.number, node['number'])
+            self.assertEqual(ass.values['structural'],
+                             float(node.costs[0]['value']))
+            self.assertEqual(exp.tagcol.taxonomy[ass.taxonomy],
+                             node['taxonomy'])
+
+    def test_csv_fallback(self):
+        # the fields past the header are ignored, as in csv.DictReader;
+        # the chunk with a short row is read again row by row, with the
+        # asset ordinals continuing from the previous chunks
+        rows = ('a0,1,RM,81.2985,29.1098,1000,\n'
+                'a1,1,RM,81.2985,29.1098,1000\n'
+                'a2,1,RM,81.2985,29.1098,-1000\n'
+                'a3,1,RM,81.2985,29.1098\n'
+                'a4,1,RM,81.2985,29.1098,3000\n')
+        fname, _ = self._csv_exposure(rows)
+        with mock.patch.object(asset, 'CSV_CHUNKSIZE', 2):
+            exp = asset.Exposure.read(fname)
+        self.assertEqual(exp.asset_refs, [b'a0', b'a1', b'a2', b'a3', b'a4'])
+        self.assertEqual([ass.ordinal for ass in exp.assets], [0, 1, 2, 3, 4])
+        self.assertEqual(float(exp.assets[2].values['structural']), -1000)
+        self.assertIsNone(exp.assets[3].values['structural'])
+
+    def test_csv_invalid_row(self):
+        rows = ('a0,1,RM,81.2985,29.1098,1000\n'
+                'a1,1,RM,181.2985,29.1098,1000\n')
+        fname, csvname = self._csv_exposure(rows)
+        with self.assertRaises(ValueError) as ctx:
+            asset.Exposure.read(fname)
+        self.assertEqual(
+            str(ctx.exception), 'node asset: longitude 181.2985 > 180, '
+            'line 2 of %s' % csvname)
+
+        rows = ('a0,1,RM,81.2985,29.1098,1000\n'
+                'a1,1,?,81.2985,29.1098,1000\n')
+        fname, csvname = self._csv_exposure(rows)
+        with self.assertRaises(ValueError) as ctx:
+            asset.Exposure.read(fname)
+        self.assertIn('Invalid tagvalue="?"', str(ctx.exception))
+        self.assertIn('line 2 of %s' % fname, str(ctx.exception))
+
     def test_missing_cost_types(self):
         job_ini = general.gettemp('''\
 [general]
@@ -646,3 +720,33 @@ class GetCompositeRiskModelTestCase(unittest.TestCase):
         oq = readinput.get_oqparam('job.ini', case_caracas)
         with self.assertRaises(ValidationError):
             readinput.get_risk_model(oq)
+
+
+class InputsCacheTestCase(unittest.TestCase):
+    def test_sitecol_assetcol(self):
+        # case with a CSV exposure, a site model and a grid
+        oq = readinput.get_oqparam('job.ini', case_16)
+        oq.cache_inputs = True
+        cache_dir = tempfile.mkdtemp()
+        readinput.exposure = None  # could be set by a previous test
+        try:
+            with mock.patch.object(readinput, 'get_cache_dir',
+                                   lambda: cache_dir):
+                sitecol1, assetcol1, _ = readinput.get_sitecol_assetcol(oq)
+                readinput.exposure = None
+                # now the exposure and the site model are not parsed
+                with mock.patch.object(readinput, 'get_exposure') as expo, \
+                        mock.patch.object(readinput, '_get_site_model') as sm:
+                    sitecol2, assetcol2, _ = readinput.get_sitecol_assetcol(
+                        oq)
+                self.assertFalse(expo.called)
+                self.assertFalse(sm.called)
+        finally:
+            readinput.exposure = None
+            shutil.rmtree(cache_dir)
+        numpy.testing.assert_equal(sitecol1.array, sitecol2.array)
+        numpy.testing.assert_equal(sitecol1.complete.array,
+                                   sitecol2.complete.array)
+        numpy.testing.assert_equal(assetcol1.array, assetcol2.array)
+        self.assertEqual(list(assetcol1.tagcol.name_1),
+                         list(assetcol2.tagcol.name_1))
@@ -43,11 +43,6 @@ intra event standard deviations.''' % (
             self.corr.__class__.__name__, self.gsim.__class__.__name__)
 
 
-def rvs(distribution, *size):
-    array = distribution.rvs(size)
-    return array
-
-
 class GmfComputer(object):
     """
     Given an earthquake rupture, the ground motion field computer computes
@@ -121,52 +116,58 @@ class GmfComputer(object):
             seed = seed or self.rupture.serial
         except AttributeError:
             pass
-        if seed is not None:
-            numpy.random.seed(seed)
+        # use a random stream local to the rupture, so that the GMFs do not
+        # depend on the order of the computation and the global numpy
+        # random state is not touched
+        rng = None if seed is None else numpy.random.RandomState(seed)
+        gsims = [gsim[str(imt)] if isinstance(gsim, MultiGMPE) else gsim
+                 for imt in self.imts]  # one GSIM per IMT
+        # NB: the means and stddevs are computed for all IMTs before
+        # sampling, so that the residuals for all IMTs and events are
+        # drawn with a single call to the random number generator
+        mean_stds = []
+        for gs, imt in zip(gsims, self.imts):
+            try:
+                mean_stds.append(self.get_mean_stds(gs, imt))
+            except Exception as exc:
+                raise self._annotate(exc, gs, imt)
+        if self.correlation_model is None:
+            all_eps = self.get_eps(mean_stds, num_events, rng)
+        else:  # the residuals are sampled in _compute, IMT by IMT
+            all_eps = [None] * len(self.imts)
         result = numpy.zeros(
             (len(self.imts), len(self.sids), num_events), numpy.float32)
-        for imti, imt in enumerate(self.imts):
-            if isinstance(gsim, MultiGMPE):
-                gs = gsim[str(imt)]  # MultiGMPE
-            else:
-                gs = gsim  # regular GMPE
+        for imti, (gs, imt) in enumerate(zip(gsims, self.imts)):
+            mean, stddevs = mean_stds[imti]
             try:
-                result[imti] = self._compute(None, gs, num_events, imt)
+                result[imti] = self._compute(
+                    gs, imt, mean, stddevs, all_eps[imti], num_events, rng)
             except Exception as exc:
-                raise exc.__class__(
-                    '%s for %s, %s, srcidx=%s' % (exc, gs, imt, self.srcidx)
-                ).with_traceback(exc.__traceback__)
+                raise self._annotate(exc, gs, imt)
         return result
 
-    def _compute(self, seed, gsim, num_events, imt):
+    def _annotate(self, exc, gsim, imt):
+        # add information about the GSIM, IMT and source to the exception
+        return exc.__class__(
+            '%s for %s, %s, srcidx=%s' % (exc, gsim, imt, self.srcidx)
+        ).with_traceback(exc.__traceback__)
+
+    def get_mean_stds(self, gsim, imt):
         """
-        :param seed: a random seed or None if the seed is already set
         :param gsim: a GSIM instance
-        :param num_events: the number of seismic events
         :param imt: an IMT instance
-        :returns: a 32 bit array of shape (num_sites, num_events)
+        :returns:
+            a pair (mean, stddevs) with the stddevs list containing no
+            elements if the truncation level is zero, the total stddev if the
+            GSIM defines only the total standard deviation, the inter and intra
+            event stddevs otherwise
         """
         rctx = getattr(self.rupture, 'rupture', self.rupture)
-        if seed is not None:
-            numpy.random.seed(seed)
         dctx = self.dctx.roundup(gsim.minimum_distance)
         if self.truncation_level == 0:
             assert self.correlation_model is None
-            mean, _stddevs = gsim.get_mean_and_stddevs(
-                self.sctx, rctx, dctx, imt, stddev_types=[])
-            mean = gsim.to_imt_unit_values(mean)
-            mean.shape += (1, )
-            mean = mean.repeat(num_events, axis=1)
-            return mean
-        elif self.truncation_level is None:
-            distribution = scipy.stats.norm()
-        else:
-            assert self.truncation_level > 0
-            distribution = scipy.stats.truncnorm(
-                - self.truncation_level, self.truncation_level)
-
-        num_sids = len(self.sids)
-        if gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES == {StdDev.TOTAL}:
+            stddev_types = []
+        elif gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES == {StdDev.TOTAL}:
             # If the GSIM provides only total standard deviation, we need
             # to compute mean and total standard deviation at the sites
             # of interest.
@@ -174,35 +175,90 @@ class GmfComputer(object):
             if self.correlation_model:
                 raise CorrelationButNoInterIntraStdDevs(
                     self.correlation_model, gsim)
+            stddev_types = [StdDev.TOTAL]
+        else:
+            stddev_types = [StdDev.INTER_EVENT, StdDev.INTRA_EVENT]
+        return gsim.get_mean_and_stddevs(
+            self.sctx, rctx, dctx, imt, stddev_types)
 
-            mean, [stddev_total] = gsim.get_mean_and_stddevs(
-                self.sctx, rctx, dctx, imt, [StdDev.TOTAL])
-            stddev_total = stddev_total.reshape(stddev_total.shape + (1, ))
-            mean = mean.reshape(mean.shape + (1, ))
+    def get_distribution(self):
+        """
+        :returns: the distribution of the normalized residuals
+        """
+        if self.truncation_level is None:
+            return scipy.stats.norm()
+        assert self.truncation_level > 0
+        return scipy.stats.truncnorm(
+            - self.truncation_level, self.truncation_level)
+
+    def get_eps(self, mean_stds, num_events, rng=None):
+        """
+        Sample the normalized residuals for all IMTs with a single call.
 
-            total_residual = stddev_total * rvs(
-                distribution, num_sids, num_events)
+        :param mean_stds: a list of pairs (mean, stddevs), one per IMT
+        :param num_events: the number of seismic events
+        :param rng: a RandomState instance or None (use the global generator)
+        :returns: a list of arrays of residuals, one per IMT
+        """
+        if self.truncation_level == 0:  # no residuals
+            return [None] * len(mean_stds)
+        distribution = self.get_distribution()
+        # for each IMT there are N x E intra event residuals (or total
+        # residuals) followed by E inter event residuals, if any
+        num_sids = len(self.sids)
+        sizes = [(num_sids + len(stddevs) - 1) * num_events
+                 for mean, stddevs in mean_stds]
+        eps = distribution.rvs(sum(sizes), random_state=rng)
+        return numpy.split(eps, numpy.cumsum(sizes)[:-1])
+
+    def _compute(self, gsim, imt, mean, stddevs, eps, num_events, rng=None):
+        """
+        :param gsim: a GSIM instance
+        :param imt: an IMT instance
+        :param mean: an array of N means
+        :param stddevs: a list of arrays of N standard deviations
+        :param eps: an array of normalized residuals or None if they
+            must be sampled here (i.e. there is a correlation model)
+        :param num_events: the number of seismic events
+        :param rng: a RandomState instance or None
+        :returns: a 32 bit array of shape (num_sites, num_events)
+        """
+        mean = mean.reshape(mean.shape + (1, ))
+        if len(stddevs) == 0:  # truncation_level == 0
+            mean = gsim.to_imt_unit_values(mean)
+            return mean.repeat(num_events, axis=1)
+
+        num_sids = len(self.sids)
+        if len(stddevs) == 1:  # total stddev
+            [stddev_total] = stddevs
+            stddev_total = stddev_total.reshape(stddev_total.shape + (1, ))
+            total_residual = stddev_total * eps.reshape(num_sids, num_events)
             gmf = gsim.to_imt_unit_values(mean + total_residual)
         else:
-            mean, [stddev_inter, stddev_intra] = gsim.get_mean_and_stddevs(
-                self.sctx, rctx, dctx, imt,
-                [StdDev.INTER_EVENT, StdDev.INTRA_EVENT])
+            stddev_inter, stddev_intra = stddevs
             stddev_intra = stddev_intra.reshape(stddev_intra.shape + (1, ))
             stddev_inter = stddev_inter.reshape(stddev_inter.shape + (1, ))
-            mean = mean.reshape(mean.shape + (1, ))
-            intra_residual = stddev_intra * rvs(
-                distribution, num_sids, num_events)
-
-            if self.correlation_model is not None:
+            if self.correlation_model is None:
+                nse = num_sids * num_events
+                intra_residual = stddev_intra * eps[:nse].reshape(
+                    num_sids, num_events)
+                inter_residual = stddev_inter * eps[nse:]
+            else:
+                # the correlation model can draw from rng too (HM2018 with
+                # uncertainty), so the inter event residuals must be
+                # sampled after applying the correlation
+                distribution = self.get_distribution()
+                intra_residual = stddev_intra * distribution.rvs(
+                    (num_sids, num_events), random_state=rng)
                 ir = self.correlation_model.apply_correlation(
-                    self.sites, imt, intra_residual, stddev_intra)
+                    self.sites, imt, intra_residual, stddev_intra, rng)
                 # this fixes a mysterious bug: ir[row] is actually
                 # a matrix of shape (E, 1) and not a vector of size E
                 intra_residual = numpy.zeros(ir.shape)
                 for i, val in numpy.ndenumerate(ir):
                     intra_residual[i] = val
-
-            inter_residual = stddev_inter * rvs(distribution, num_events)
+                inter_residual = stddev_inter * distribution.rvs(
+                    num_events, random_state=rng)
 
             gmf = gsim.to_imt_unit_values(
                 mean + intra_residual + inter_residual)
@@ -222,7 +278,8 @@ def ground_motion_fields(rupture, sites, imts, gsim, truncation_level,
     .. note::
 
      This calculator is using random numbers. In order to reproduce the
-     same results numpy random numbers generator needs to be seeded, see
+     same results a seed must be passed, otherwise the global numpy random
+     numbers generator is used and it needs to be seeded, see
      http://docs.scipy.org/doc/numpy/reference/generated/numpy.random.seed.html
 
     :param openquake.hazardlib.source.rupture.Rupture rupture:
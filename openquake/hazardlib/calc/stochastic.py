@@ -22,8 +22,6 @@
 """
 import sys
 import time
-import operator
-import collections
 import numpy
 from openquake.baselib.general import AccumDict
 from openquake.baselib.performance import Monitor
@@ -38,6 +36,8 @@ U32 = numpy.uint32
 U16 = numpy.uint16
 event_dt = numpy.dtype([('eid', U64), ('grp_id', U16), ('ses', U32),
                         ('sample', U32)])
+occ_dt = numpy.dtype([('rup', U32), ('sample', U32), ('ses', U32),
+                      ('n_occ', U32)])
 
 
 def source_site_noop_filter(srcs):
@@ -137,15 +137,25 @@ def sample_ruptures(sources, src_filter=source_site_noop_filter,
         mutex_weight = getattr(src, 'mutex_weight', 1)
         samples = getattr(src, 'samples', 1)
         t0 = time.time()
-        with cmaker.ir_mon:
-            ruptures = list(src.iter_ruptures())
-        num_occ_by_rup = _sample_ruptures(
-            src, mutex_weight, param['ses_per_logic_tree_path'],
-            samples, ruptures)
+        num_ses = param['ses_per_logic_tree_path']
+        rates = src.get_rupture_rates()
+        if rates is None:  # the ruptures must be generated to be sampled
+            with cmaker.ir_mon:
+                ruptures = list(src.iter_ruptures())
+            occ = sample_occurrences(
+                ruptures, src.serial, mutex_weight, num_ses, samples)
+        else:  # build only the ruptures which occur
+            occ = sample_occurrences(
+                rates, src.serial, mutex_weight, num_ses, samples,
+                src.temporal_occurrence_model)
+            rup_nos = numpy.unique(occ['rup'])
+            with cmaker.ir_mon:
+                ruptures = dict(zip(
+                    rup_nos, src.iter_ruptures_by_index(rup_nos)))
         # NB: the number of occurrences is very low, << 1, so it is
         # more efficient to filter only the ruptures that occur, i.e.
-        # to call sample_ruptures *before* the filtering
-        ebrs = list(_build_eb_ruptures(src, num_occ_by_rup, cmaker,
+        # to call sample_occurrences *before* the filtering
+        ebrs = list(_build_eb_ruptures(src, ruptures, occ, cmaker,
                                        sites, monitor))
         eb_ruptures.extend(ebrs)
         eids = set_eids(ebrs)
@@ -155,42 +165,69 @@ def sample_ruptures(sources, src_filter=source_site_noop_filter,
     return dic
 
 
-def _sample_ruptures(src, prob, num_ses, num_samples, ruptures):
+def sample_occurrences(ruptures, serials, prob, num_ses, num_samples,
+                       tom=None):
     """
-    Sample the ruptures contained in the given source.
-
-    :param src: a hazardlib source object
+    Sample the number of occurrences of the given ruptures. Each rupture
+    has its own random stream depending only on the rupture serial, so the
+    sampling does not depend on how the sources are split in tasks and does
+    not touch the global state; the occurrences for all the samples and
+    stochastic event sets of a rupture are drawn in a single call.
+    If a temporal occurrence model is passed, the ruptures are replaced
+    by their occurrence rates, so that they can be sampled before
+    being generated.
+
+    :param ruptures: a sequence of ruptures or of occurrence rates
+    :param serials: the serials of the ruptures
     :param prob: a probability (1 for indep sources, < 1 for mutex sources)
     :param num_ses: the number of Stochastic Event Sets to generate
     :param num_samples: how many samples for the given source
-    :param ruptures: ruptures to sample
-    :returns: a dictionary of dictionaries rupture -> {ses_id: num_occurrences}
+    :param tom: a temporal occurrence model or None
+    :returns:
+        an array of dtype occ_dt with fields (rup, sample, ses, n_occ) for the
+        occurring ruptures, ordered by rupture index, sample and ses
     """
-    # the dictionary `num_occ_by_rup` contains a dictionary
-    # ses_id -> num_occurrences for each occurring rupture
-    num_occ_by_rup = collections.defaultdict(AccumDict)
-    # generating ruptures for the given source
-    for rup_no, rup in enumerate(ruptures):
-        rup.serial = src.serial[rup_no]
-        numpy.random.seed(rup.serial)
-        for sam_idx in range(num_samples):
-            for ses_idx in range(1, num_ses + 1):
-                # sampling of mutex sources if prob < 1
-                ok = numpy.random.random() < prob if prob < 1 else True
-                if ok:
-                    num_occ = rup.sample_number_of_occurrences()
-                    if num_occ:
-                        num_occ_by_rup[rup] += {(sam_idx, ses_idx): num_occ}
-        rup.rup_no = rup_no + 1
-    return num_occ_by_rup
-
-
-def _build_eb_ruptures(src, num_occ_by_rup, cmaker, s_sites, rup_mon):
-    # Filter the ruptures stored in the dictionary num_occ_by_rup and
-    # yield pairs (rupture, <list of associated EBRuptures>).
+    n = num_samples * num_ses
+    samples = numpy.repeat(numpy.arange(num_samples, dtype=U32), num_ses)
+    sess = numpy.tile(numpy.arange(1, num_ses + 1, dtype=U32), num_samples)
+    rng = numpy.random.RandomState()
+    arrays = []
+    for rup_no, (rup, serial) in enumerate(zip(ruptures, serials)):
+        rng.seed(serial)
+        if prob < 1:  # sampling of mutex sources
+            num_occ = numpy.zeros(n, U32)
+            ok = rng.random_sample(n) < prob
+            num_occ[ok] = _sample(rup, tom, rng, ok.sum())
+        else:
+            num_occ = _sample(rup, tom, rng, n)
+        idxs, = num_occ.nonzero()
+        if len(idxs):
+            arr = numpy.zeros(len(idxs), occ_dt)
+            arr['rup'] = rup_no
+            arr['sample'] = samples[idxs]
+            arr['ses'] = sess[idxs]
+            arr['n_occ'] = num_occ[idxs]
+            arrays.append(arr)
+    return numpy.concatenate(arrays) if arrays else numpy.zeros(0, occ_dt)
+
+
+def _sample(rup, tom, rng, size):
+    if tom is None:  # rup is a rupture
+        return rup.sample_number_of_occurrences(rng, size)
+    # rup is an occurrence rate
+    return tom.sample_number_of_occurrences(rup, rng, size)
+
+
+def _build_eb_ruptures(src, ruptures, occ, cmaker, s_sites, rup_mon):
+    # Filter the occurring ruptures and yield the associated EBRuptures.
     # NB: s_sites can be None if cmaker.maximum_distance is False, then
     # the contexts are not computed and the ruptures not filtered
-    for rup in sorted(num_occ_by_rup, key=operator.attrgetter('rup_no')):
+    if len(occ) == 0:
+        return
+    rup_nos, starts = numpy.unique(occ['rup'], return_index=True)
+    for rup_no, occs in zip(rup_nos, numpy.split(occ, starts[1:])):
+        rup = ruptures[rup_no]
+        rup.serial = src.serial[rup_no]
         if cmaker.maximum_distance:
             with rup_mon:
                 try:
@@ -198,19 +235,14 @@ def _build_eb_ruptures(src, num_occ_by_rup, cmaker, s_sites, rup_mon):
                     indices = rup.sctx.sids
                 except FarAwayRupture:
                     # ignore ruptures which are far away
-                    del num_occ_by_rup[rup]  # save memory
                     continue
         else:
             indices = ()
 
         # creating EBRuptures
-        events = []
-        for (sam_idx, ses_idx), num_occ in sorted(
-                num_occ_by_rup[rup].items()):
-            for _ in range(num_occ):
-                # NB: the 0 below is a placeholder; the right eid will be
-                # set a bit later, in set_eids
-                events.append((0, src.src_group_id, ses_idx, sam_idx))
-        if events:
-            yield EBRupture(rup, src.id, indices,
-                            numpy.array(events, event_dt))
+        # NB: the eids are set a bit later, in set_eids
+        events = numpy.zeros(occs['n_occ'].sum(), event_dt)
+        events['grp_id'] = src.src_group_id
+        events['ses'] = numpy.repeat(occs['ses'], occs['n_occ'])
+        events['sample'] = numpy.repeat(occs['sample'], occs['n_occ'])
+        yield EBRupture(rup, src.id, indices, events)
@@ -26,7 +26,8 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
     Base class for correlation models for spatially-distributed ground-shaking
     intensities.
     """
-    def apply_correlation(self, sites, imt, residuals, stddev_intra=0):
+    def apply_correlation(self, sites, imt, residuals, stddev_intra=0,
+                          rng=None):
         """
         Apply correlation to randomly sampled residuals.
 
@@ -42,6 +43,9 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
         :param stddev_intra:
             Intra-event standard deviation array. Note that different sites do
             not necessarily have the same intra-event standard deviation.
+        :param rng:
+            :class:`numpy.random.RandomState` used by the models with
+            uncertainty; if None, the global numpy generator is used
         :returns:
             Array of the same structure and semantics as ``residuals``
             but with correlations applied.
@@ -162,15 +166,17 @@ class HM2018CorrelationModel(BaseCorrelationModel):
         self.distance_matrix = {}
         self.cache = {}
 
-    def _get_correlation_matrix(self, sites, imt):
-        return hmcorrelation(sites, imt, self.uncertainty_multiplier)
+    def _get_correlation_matrix(self, sites, imt, rng=None):
+        return hmcorrelation(sites, imt, self.uncertainty_multiplier, rng)
 
-    def apply_correlation(self, sites, imt, residuals, stddev_intra):
+    def apply_correlation(self, sites, imt, residuals, stddev_intra,
+                          rng=None):
         """
         Apply correlation to randomly sampled residuals.
 
         See Parent function
         """
+        rng = numpy.random if rng is None else rng
         # stddev_intra is repeated if it is only 1 value for all the residuals
         if stddev_intra.shape[0] == 1:
             stddev_intra = numpy.matlib.repmat(
@@ -212,17 +218,18 @@ class HM2018CorrelationModel(BaseCorrelationModel):
             # Re-sample all the residuals
             residuals_correlated = residuals * 0
             for isim in range(0, nsim):
-                corma = self._get_correlation_matrix(sites, imt)
+                corma = self._get_correlation_matrix(sites, imt, rng)
                 cov = (numpy.diag(stddev_intra[sites.sids]) * corma *
                        numpy.diag(stddev_intra[sites.sids]))
                 residuals_correlated[0:, isim] = (
-                    numpy.random.multivariate_normal(
+                    rng.multivariate_normal(
                         numpy.zeros(nsites), cov, 1))
 
             return residuals_correlated
 
 
-def hmcorrelation(sites_or_distances, imt, uncertainty_multiplier=0):
+def hmcorrelation(sites_or_distances, imt, uncertainty_multiplier=0,
+                  rng=None):
     """
     Returns the Heresi-Miranda correlation model.
 
@@ -234,6 +241,9 @@ def hmcorrelation(sites_or_distances, imt, uncertainty_multiplier=0):
         Value to be multiplied by the uncertainty in the correlation parameter
         beta. If uncertainty_multiplier = 0 (default), the median value is
         used as a constant value.
+    :param rng:
+        random number generator to use if uncertainty_multiplier > 0;
+        if None, the global numpy generator is used
     """
     if hasattr(sites_or_distances, 'mesh'):
         distances = sites_or_distances.mesh.get_distance_matrix()
@@ -255,7 +265,8 @@ def hmcorrelation(sites_or_distances, imt, uncertainty_multiplier=0):
     if uncertainty_multiplier == 0:
         beta = Med_b
     else:
-        beta = numpy.random.lognormal(
+        rng = numpy.random if rng is None else rng
+        beta = rng.lognormal(
             numpy.log(Med_b), Std_b * uncertainty_multiplier)
 
     # Eq. (8)
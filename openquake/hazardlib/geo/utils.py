@@ -95,6 +95,21 @@ class _GeographicObjects(object):
         min_dist, idx = self.kdtree.query(xyz)
         return self.objects[idx], min_dist
 
+    def get_closest_idxs(self, lons, lats, depths=0):
+        """
+        Vectorized version of :meth:`get_closest`, performing a single query
+        on the k-d tree for all the given points. Since the tree is built on
+        cartesian coordinates there are no issues with the dateline.
+
+        :param lons: longitudes in degrees
+        :param lats: latitudes in degrees
+        :param depths: depths in km (default 0)
+        :returns: (indices of the closest objects, distances)
+        """
+        xyz = spherical_to_cartesian(lons, lats, depths)
+        dists, idxs = self.kdtree.query(xyz.reshape(-1, 3))
+        return idxs, dists
+
     def assoc(self, sitecol, assoc_dist, mode):
         """
         :param sitecol: a (filtered) site collection
@@ -103,31 +118,35 @@ class _GeographicObjects(object):
         :returns: (filtered site collection, filtered objects)
         """
         assert mode in 'strict warn filter', mode
-        dic = {}
+        sids = sitecol.sids
+        idxs, dists = self.get_closest_idxs(sitecol.lons, sitecol.lats)
+        if assoc_dist is None:  # associate all
+            ok = numpy.ones(len(sids), bool)
+        else:
+            ok = dists <= assoc_dist
         discarded = []
-        for sid, lon, lat in zip(sitecol.sids, sitecol.lons, sitecol.lats):
-            obj, distance = self.get_closest(lon, lat)
-            if assoc_dist is None:
-                dic[sid] = obj  # associate all
-            elif distance <= assoc_dist:
-                dic[sid] = obj  # associate within
-            elif mode == 'warn':
-                dic[sid] = obj  # associate outside
+        if mode == 'strict' and not ok.all():
+            i = (~ok).nonzero()[0][0]
+            raise SiteAssociationError(
+                'There is nothing closer than %s km '
+                'to site (%s %s)' % (assoc_dist, sitecol.lons[i],
+                                     sitecol.lats[i]))
+        elif mode == 'warn':  # associate outside
+            for i in (~ok).nonzero()[0]:
+                obj = self.objects[idxs[i]]
                 logging.warn(
                     'The closest vs30 site (%.1f %.1f) is distant more than %d'
                     ' km from site #%d (%.1f %.1f)', obj['lon'], obj['lat'],
-                    int(distance), sid, lon, lat)
-            elif mode == 'filter':
-                discarded.append(obj)
-            elif mode == 'strict':
-                raise SiteAssociationError(
-                    'There is nothing closer than %s km '
-                    'to site (%s %s)' % (assoc_dist, lon, lat))
-        if not dic:
+                    int(dists[i]), sids[i], sitecol.lons[i], sitecol.lats[i])
+            ok[:] = True
+        elif mode == 'filter':
+            discarded.extend(self.objects[idxs[~ok]])
+        if not ok.any():
             raise SiteAssociationError(
                 'No sites could be associated within %s km' % assoc_dist)
-        return (sitecol.filtered(dic),
-                numpy.array([dic[sid] for sid in sorted(dic)]),
+        order = numpy.argsort(sids[ok], kind='mergesort')
+        return (sitecol.filtered(sids[ok]),
+                self.objects[idxs[ok][order]],
                 discarded)
 
     def assoc2(self, assets_by_site, assoc_dist, mode):
@@ -143,14 +162,17 @@ class _GeographicObjects(object):
         assert mode in 'strict warn filter', mode
         self.objects.filtered  # self.objects must be a SiteCollection
         site_dt = numpy.dtype([('lon', F32), ('lat', F32)])
+        lonlats = numpy.array([assets[0].location for assets in
+                               assets_by_site]).reshape(-1, 2)
+        idxs, dists = self.get_closest_idxs(lonlats[:, 0], lonlats[:, 1])
+        objsids = self.objects.sids[idxs]
         assets_by_sid = collections.defaultdict(list)
         discarded = []
-        for assets in assets_by_site:
-            lon, lat = assets[0].location
-            obj, distance = self.get_closest(lon, lat)
+        for assets, sid, distance, (lon, lat) in zip(
+                assets_by_site, objsids, dists, lonlats):
             if distance <= assoc_dist:
                 # keep the assets, otherwise discard them
-                assets_by_sid[obj['sids']].extend(assets)
+                assets_by_sid[sid].extend(assets)
             elif mode == 'strict':
                 raise SiteAssociationError(
                     'There is nothing closer than %s km '
@@ -18,14 +18,17 @@
 from urllib.request import urlopen
 from urllib.error import HTTPError
 import io
+import os
 import re
 import math
+import hashlib
 import zipfile
 import logging
 import numpy
 from scipy.stats import truncnorm, norm
 from scipy import interpolate
 
+from openquake.baselib import datastore
 from openquake.hazardlib import geo, site, imt, correlation
 from openquake.hazardlib.shakemapconverter import get_shakemap_array
 
@@ -37,6 +40,11 @@ UNCERTAINTY_RX = URL_RX + "uncertainty\.xml(\.zip)?"
 
 F32 = numpy.float32
 PCTG = 100  # percent of g, the gravity acceleration
+# maximum size of the (M * N, M * N) matrices to decompose; larger shakemaps
+# are split in tiles of nearby sites which are decomposed independently
+MAX_MATRIX_SIZE = 4000
+# maximum number of normal variates of shape (M * N, E) drawn in one go
+MAX_VARIATES = 10 ** 7
 
 
 class DownloadFailed(Exception):
@@ -88,6 +96,73 @@ def download_array(shakemap_id, shakemap_url=SHAKEMAP_URL):
             return get_shakemap_array(f1, f2)
 
 
+def get_cache_dir():
+    """
+    :returns: the directory where the parsed shakemaps are cached
+    """
+    return os.path.join(datastore.get_datadir(), 'shakemaps')
+
+
+def cache_array(array, shakemap_id=None, cache_dir=None):
+    """
+    Store a parsed shakemap in the cache as a .npy file named after the
+    MD5 checksum of its content; if a shakemap ID is given, associate it
+    to the checksum, possibly overriding a previous association.
+
+    :param array: shakemap array
+    :param shakemap_id: USGS Shakemap ID or None
+    :param cache_dir: cache directory (default <datadir>/shakemaps)
+    :returns: the checksum of the array
+    """
+    cache_dir = cache_dir or get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    checksum = hashlib.md5(array.tobytes()).hexdigest()
+    fname = os.path.join(cache_dir, checksum + '.npy')
+    if not os.path.exists(fname):
+        numpy.save(fname + '.tmp', array)  # saved as fname.tmp.npy
+        os.replace(fname + '.tmp.npy', fname)  # atomic rename
+    if shakemap_id:
+        with open(os.path.join(cache_dir, shakemap_id + '.txt'), 'w') as f:
+            f.write(checksum)
+    return checksum
+
+
+def get_cached_array(shakemap_id, cache_dir=None):
+    """
+    :param shakemap_id: USGS Shakemap ID
+    :param cache_dir: cache directory (default <datadir>/shakemaps)
+    :returns: the cached shakemap array or None if not in the cache
+    """
+    cache_dir = cache_dir or get_cache_dir()
+    try:
+        with open(os.path.join(cache_dir, shakemap_id + '.txt')) as f:
+            checksum = f.read().strip()
+        array = numpy.load(os.path.join(cache_dir, checksum + '.npy'))
+    except IOError:  # not in the cache
+        return
+    if hashlib.md5(array.tobytes()).hexdigest() != checksum:
+        logging.warning('The cached shakemap %s is corrupted', shakemap_id)
+        return
+    logging.info('Using the cached shakemap %s [%s]', shakemap_id, checksum)
+    return array
+
+
+def get_array(shakemap_id, cache_dir=None):
+    """
+    Read the shakemap from the cache if possible, otherwise download it
+    and store it in the cache.
+
+    :param shakemap_id: USGS Shakemap ID
+    :param cache_dir: cache directory (default <datadir>/shakemaps)
+    :returns: an array with the shakemap
+    """
+    array = get_cached_array(shakemap_id, cache_dir)
+    if array is None:
+        array = download_array(shakemap_id)
+        cache_array(array, shakemap_id, cache_dir)
+    return array
+
+
 def get_sitecol_shakemap(array_or_id, imts, sitecol=None, assoc_dist=None):
     """
     :param array_or_id: shakemap array or shakemap ID
@@ -97,7 +172,7 @@ def get_sitecol_shakemap(array_or_id, imts, sitecol=None, assoc_dist=None):
     :returns: a pair (filtered site collection, filtered shakemap)
     """
     if isinstance(array_or_id, str):  # shakemap ID
-        array = download_array(array_or_id)
+        array = get_array(array_or_id)
     else:  # shakemap array
         array = array_or_id
     available_imts = set(array['val'].dtype.names)
@@ -169,15 +244,8 @@ def spatial_covariance_array(stddev, corrmatrices):
     :returns: an array of shape (M, N, N)
     """
     # this depends on sPGA, sSa03, sSa10, sSa30
-    M, N = corrmatrices.shape[:2]
-    matrices = []
-    for i, std in enumerate(stddev):
-        covmatrix = numpy.zeros((N, N))
-        for j in range(N):
-            for k in range(N):
-                covmatrix[j, k] = corrmatrices[i, j, k] * std[j] * std[k]
-        matrices.append(covmatrix)
-    return numpy.array(matrices)
+    return numpy.array([corr * numpy.outer(std, std)
+                        for std, corr in zip(stddev, corrmatrices)])
 
 
 def cross_correlation_matrix(imts, corr='cross'):
@@ -251,51 +319,118 @@ def cholesky(spatial_cov, cross_corr):
     """
     Decompose the spatial covariance and cross correlation matrices
     """
-    M, N = spatial_cov.shape[:2]
+    M = len(spatial_cov)
     L = numpy.array([numpy.linalg.cholesky(spatial_cov[i]) for i in range(M)])
-    LLT = []
-    for i in range(M):
-        row = [numpy.dot(L[i], L[j].T) * cross_corr[i, j] for j in range(M)]
-        for j in range(N):
-            singlerow = numpy.zeros(M * N)
-            for i in range(M):
-                singlerow[i * N:(i + 1) * N] = row[i][j]
-            LLT.append(singlerow)
-    return numpy.linalg.cholesky(numpy.array(LLT))
+    LLT = numpy.block([[numpy.dot(L[i], L[j].T) * cross_corr[i, j]
+                        for j in range(M)] for i in range(M)])
+    return numpy.linalg.cholesky(LLT)
 
 
-def to_gmfs(shakemap, crosscorr, site_effects, trunclevel, num_gmfs, seed,
-            imts=None):
+def get_tiles(lons, lats, max_sites):
     """
-    :returns: an array of GMFs of shape (R, N, E, M)
+    Split a set of sites in tiles of nearby sites, first by cutting
+    vertical strips of similar longitude and then by cutting the strips
+    by latitude.
+
+    :param lons: N longitudes
+    :param lats: N latitudes
+    :param max_sites: maximum number of sites per tile
+    :returns: a list of sorted arrays of indices in the range 0..N-1
     """
+    N = len(lons)
+    if N <= max_sites:
+        return [numpy.arange(N)]
+    nstrips = math.ceil(math.sqrt(math.ceil(N / max_sites)))
+    tiles = []
+    for strip in numpy.array_split(
+            numpy.argsort(lons, kind='mergesort'), nstrips):
+        strip = strip[numpy.argsort(lats[strip], kind='mergesort')]
+        tiles.extend(numpy.array_split(
+            strip, math.ceil(len(strip) / max_sites)))
+    return [numpy.sort(tile) for tile in tiles]
+
+
+def _gen_gmfs(shakemap, imts, crosscorr, site_effects, trunclevel,
+              num_gmfs, seed):
+    # yield pairs (slice of events, array of shape (M * N, e))
     std = shakemap['std']
-    if imts is None or len(imts) == 0:
-        imts = std.dtype.names
-    val = {imt: numpy.log(shakemap['val'][imt]) - std[imt] ** 2 / 2.
-           for imt in imts}
-    imts_ = [imt.from_string(name) for name in imts]
+    val = [numpy.log(shakemap['val'][str(im)]) - std[str(im)] ** 2 / 2.
+           for im in imts]
     dmatrix = geo.geodetic.distance_matrix(shakemap['lon'], shakemap['lat'])
-    spatial_corr = spatial_correlation_array(dmatrix, imts_)
-    stddev = [std[str(imt)] for imt in imts_]
-    for im, std in zip(imts_, stddev):
+    spatial_corr = spatial_correlation_array(dmatrix, imts)
+    stddev = [std[str(im)] for im in imts]
+    for im, std in zip(imts, stddev):
         if std.sum() == 0:
             raise ValueError('Cannot decompose the spatial covariance '
                              'because stddev==0 for IMT=%s' % im)
     spatial_cov = spatial_covariance_array(stddev, spatial_corr)
-    cross_corr = cross_correlation_matrix(imts_, crosscorr)
-    M, N = spatial_corr.shape[:2]
-    mu = numpy.array([numpy.ones(num_gmfs) * val[str(imt)][j]
-                      for imt in imts_ for j in range(N)])
-    # mu has shape (M * N, E)
+    cross_corr = cross_correlation_matrix(imts, crosscorr)
+    mu = numpy.concatenate(val)[:, None]  # shape (M * N, 1)
     L = cholesky(spatial_cov, cross_corr)  # shape (M * N, M * N)
-    if trunclevel:
-        Z = truncnorm.rvs(-trunclevel, trunclevel, loc=0, scale=1,
-                          size=(M * N, num_gmfs), random_state=seed)
-    else:
-        Z = norm.rvs(loc=0, scale=1, size=(M * N, num_gmfs), random_state=seed)
-    # Z has shape (M * N, E)
-    gmfs = numpy.exp(numpy.dot(L, Z) + mu) / PCTG
-    if site_effects:
-        gmfs = amplify_gmfs(imts_, shakemap['vs30'], gmfs) * 0.8
-    return gmfs.reshape((1, M, N, num_gmfs)).transpose(0, 2, 3, 1)
+    del dmatrix, spatial_corr, spatial_cov
+    rng = numpy.random.RandomState(seed)
+    size = max(MAX_VARIATES // len(L), 1)
+    for start in range(0, num_gmfs, size):
+        e = min(size, num_gmfs - start)
+        if trunclevel:
+            Z = truncnorm.rvs(-trunclevel, trunclevel, loc=0, scale=1,
+                              size=(len(L), e), random_state=rng)
+        else:
+            Z = norm.rvs(loc=0, scale=1, size=(len(L), e), random_state=rng)
+        # Z has shape (M * N, e)
+        gmfs = numpy.exp(numpy.dot(L, Z) + mu) / PCTG
+        if site_effects:
+            gmfs = amplify_gmfs(imts, shakemap['vs30'], gmfs) * 0.8
+        yield slice(start, start + e), gmfs
+
+
+def gen_gmfs(shakemap, crosscorr, site_effects, trunclevel, num_gmfs, seed,
+             imts=None, max_matrix_size=MAX_MATRIX_SIZE):
+    """
+    Generate the GMFs tile by tile. The spatial covariance is decomposed
+    separately for each tile, so that the memory required is bounded by
+    the size of a tile and not by the size of the shakemap; the correlation
+    between sites in different tiles is neglected. The variates are drawn
+    in blocks of events, with a different seed for each tile, and the GMFs
+    are yielded block by block, so that the memory required is bounded
+    also by the number of events.
+
+    :param shakemap: a shakemap array with N sites
+    :param crosscorr: 'no correlation', 'full correlation' or 'cross'
+    :param site_effects: flag to amplify the ground shaking
+    :param trunclevel: truncation level
+    :param num_gmfs: the number of events E
+    :param seed: random seed
+    :param imts: M intensity measure types (default all the available ones)
+    :param max_matrix_size: maximum size of the matrices to decompose
+    :yields: triples (site indices, slice of events, array of shape (n, e, M))
+    """
+    if imts is None or len(imts) == 0:
+        imts = shakemap['std'].dtype.names
+    imts_ = [imt.from_string(name) for name in imts]
+    M = len(imts_)
+    tiles = get_tiles(shakemap['lon'], shakemap['lat'],
+                      max(max_matrix_size // M, 1))
+    if len(tiles) > 1:
+        logging.info('Splitting the shakemap in %d tiles', len(tiles))
+    for i, tile in enumerate(tiles):
+        n = len(tile)
+        for slc, gmfs in _gen_gmfs(
+                shakemap[tile], imts_, crosscorr, site_effects, trunclevel,
+                num_gmfs, seed + i):
+            e = slc.stop - slc.start
+            yield tile, slc, gmfs.reshape((M, n, e)).transpose(1, 2, 0)
+
+
+def to_gmfs(shakemap, crosscorr, site_effects, trunclevel, num_gmfs, seed,
+            imts=None):
+    """
+    :returns: an array of GMFs of shape (R, N, E, M)
+    """
+    out = None
+    for tile, slc, gmfs in gen_gmfs(shakemap, crosscorr, site_effects,
+                                    trunclevel, num_gmfs, seed, imts):
+        if out is None:
+            out = numpy.zeros((len(shakemap), num_gmfs, gmfs.shape[2]))
+        out[tile, slc] = gmfs
+    return out[numpy.newaxis]
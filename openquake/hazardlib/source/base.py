@@ -101,6 +101,27 @@ class BaseSeismicSource(metaclass=abc.ABCMeta):
             `~openquake.hazardlib.source.rupture.BaseProbabilisticRupture`.
         """
 
+    def get_rupture_rates(self):
+        """
+        Return the occurrence rates of the ruptures, in the same order as
+        :meth:`iter_ruptures`, without building the rupture surfaces.
+        Sources which cannot compute them cheaply return None (the default).
+        """
+
+    def iter_ruptures_by_index(self, indices):
+        """
+        Generate the ruptures with the given indices, in increasing order.
+        By default all the ruptures are generated and the ones with the right
+        indices are yielded; subclasses can override this method to build
+        only the required ruptures.
+
+        :param indices: indices in the range 0 .. num_ruptures - 1
+        """
+        indices = set(indices)
+        for rup_no, rup in enumerate(self.iter_ruptures()):
+            if rup_no in indices:
+                yield rup
+
     def __iter__(self):
         """
         Override to implement source splitting
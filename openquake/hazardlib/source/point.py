@@ -174,22 +174,54 @@ class PointSource(ParametricSeismicSource):
         for mag, mag_occ_rate in self.get_annual_occurrence_rates():
             for np_prob, np in self.nodal_plane_distribution.data:
                 for hc_prob, hc_depth in self.hypocenter_distribution.data:
-                    hypocenter = Point(latitude=self.location.latitude,
-                                       longitude=self.location.longitude,
-                                       depth=hc_depth)
                     occurrence_rate = (mag_occ_rate *
                                        (np_prob if npdist else 1) *
                                        (hc_prob if hcdist else 1))
-                    surface = self._get_rupture_surface(mag, np, hypocenter)
-                    yield ParametricProbabilisticRupture(
-                        mag, np.rake, self.tectonic_region_type, hypocenter,
-                        surface, occurrence_rate,
-                        self.temporal_occurrence_model)
+                    yield self._get_rupture(mag, np, hc_depth,
+                                            occurrence_rate)
                     if not hcdist:
                         break
                 if not npdist:
                     break
 
+    def _get_rupture(self, mag, np, hc_depth, occurrence_rate):
+        hypocenter = Point(latitude=self.location.latitude,
+                           longitude=self.location.longitude,
+                           depth=hc_depth)
+        surface = self._get_rupture_surface(mag, np, hypocenter)
+        return ParametricProbabilisticRupture(
+            mag, np.rake, self.tectonic_region_type, hypocenter,
+            surface, occurrence_rate, self.temporal_occurrence_model)
+
+    def get_rupture_rates(self):
+        """
+        See :meth:
+        `openquake.hazardlib.source.base.BaseSeismicSource.get_rupture_rates`.
+        """
+        mag_rates = [rate for mag, rate in self.get_annual_occurrence_rates()]
+        np_probs = [prob for prob, np in self.nodal_plane_distribution.data]
+        hc_probs = [prob for prob, hc in self.hypocenter_distribution.data]
+        rates = numpy.multiply.outer(
+            numpy.multiply.outer(mag_rates, np_probs), hc_probs)
+        return rates.flatten()
+
+    def iter_ruptures_by_index(self, indices):
+        """
+        See :meth:
+        `openquake.hazardlib.source.base.BaseSeismicSource.iter_ruptures_by_index`.
+        Only the surfaces of the required ruptures are built.
+        """
+        mag_rates = self.get_annual_occurrence_rates()
+        nps = self.nodal_plane_distribution.data
+        hcs = self.hypocenter_distribution.data
+        for m, n, h in zip(*numpy.unravel_index(
+                numpy.sort(indices), (len(mag_rates), len(nps), len(hcs)))):
+            mag, mag_occ_rate = mag_rates[m]
+            np_prob, np = nps[n]
+            hc_prob, hc_depth = hcs[h]
+            yield self._get_rupture(mag, np, hc_depth,
+                                    mag_occ_rate * np_prob * hc_prob)
+
     def count_ruptures(self):
         """
         See :meth:
@@ -135,18 +135,25 @@ class BaseRupture(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError
 
-    def sample_number_of_occurrences(self):
+    def sample_number_of_occurrences(self, rng=None, size=None):
         """
         Randomly sample number of occurrences from temporal occurrence model
         probability distribution.
 
         .. note::
             This method is using random numbers. In order to reproduce the
-            same results numpy random numbers generator needs to be seeded, see
+            same results either a seeded :class:`numpy.random.RandomState`
+            must be passed or the global numpy random numbers generator
+            needs to be seeded, see
             http://docs.scipy.org/doc/numpy/reference/generated/numpy.random.seed.html
 
+        :param rng:
+            a :class:`numpy.random.RandomState` instance or None (in that
+            case the global numpy generator is used)
+        :param size:
+            if given, draw an array of `size` independent samples
         :returns:
-            int, Number of rupture occurrences
+            int, Number of rupture occurrences (or an array of them)
         """
         raise NotImplementedError
 
@@ -217,7 +224,7 @@ class NonParametricProbabilisticRupture(BaseRupture):
         prob_no_exceed[poes == 0.] = 1.  # avoid numeric issues
         return prob_no_exceed
 
-    def sample_number_of_occurrences(self):
+    def sample_number_of_occurrences(self, rng=None, size=None):
         """
         See :meth:`superclass method
         <.rupture.BaseRupture.sample_number_of_occurrences>`
@@ -228,10 +235,11 @@ class NonParametricProbabilisticRupture(BaseRupture):
         # compute cdf from pmf
         cdf = numpy.cumsum(self.probs_occur)
 
-        rn = numpy.random.random()
-        [n_occ] = numpy.digitize([rn], cdf)
-
-        return n_occ
+        rn = (numpy.random if rng is None else rng).random_sample(size)
+        if size is None:
+            [n_occ] = numpy.digitize([rn], cdf)
+            return n_occ
+        return numpy.digitize(rn, cdf)
 
 
 @with_slots
@@ -287,7 +295,7 @@ class ParametricProbabilisticRupture(BaseRupture):
         rate = self.occurrence_rate
         return tom.get_probability_one_occurrence(rate)
 
-    def sample_number_of_occurrences(self):
+    def sample_number_of_occurrences(self, rng=None, size=None):
         """
         Draw a random sample from the distribution and return a number
         of events to occur.
@@ -297,7 +305,7 @@ class ParametricProbabilisticRupture(BaseRupture):
         of an assigned temporal occurrence model.
         """
         return self.temporal_occurrence_model.sample_number_of_occurrences(
-            self.occurrence_rate
+            self.occurrence_rate, rng, size
         )
 
     def get_probability_no_exceedance(self, poes):
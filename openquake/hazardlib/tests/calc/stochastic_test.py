@@ -19,8 +19,10 @@ import numpy
 from openquake.hazardlib import nrml, geo
 from openquake.hazardlib.calc.filters import SourceFilter
 from openquake.hazardlib.calc.stochastic import (
-    stochastic_event_set, sample_ruptures)
+    stochastic_event_set, sample_ruptures, sample_occurrences)
 from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
+from openquake.hazardlib.tom import PoissonTOM
 from openquake.hazardlib.gsim.si_midorikawa_1999 import SiMidorikawa1999SInter
 
 aae = numpy.testing.assert_almost_equal
@@ -66,3 +68,48 @@ class StochasticEventSetTestCase(unittest.TestCase):
         # test no filtering 2
         ruptures = sample_ruptures(group)['eb_ruptures']
         self.assertEqual(len(ruptures), 2)
+
+    def test_independent_from_splitting(self):
+        source_model = os.path.join(os.path.dirname(__file__), 'nankai.xml')
+        [group] = nrml.to_python(source_model)
+        serial = 42
+        for i, src in enumerate(group):
+            src.id = i
+            nr = src.num_ruptures
+            src.serial = numpy.arange(serial, serial + nr, dtype=numpy.uint32)
+            serial += nr
+        param = dict(ses_per_logic_tree_path=10, filter_distance='rjb')
+
+        def sample(srcs):
+            ebrs = sample_ruptures(srcs, param=param)['eb_ruptures']
+            return sorted((ebr.serial, ebr.multiplicity) for ebr in ebrs)
+
+        # sampling all the sources together or one source at the time in
+        # reverse order gives the same ruptures, whatever the global seed
+        numpy.random.seed(1)
+        expected = sample(group)
+        numpy.random.seed(2)
+        got = sorted(sum([sample([src]) for src in reversed(group)], []))
+        self.assertEqual(got, expected)
+
+    def test_sample_occurrences(self):
+        source_model = os.path.join(os.path.dirname(__file__), 'nankai.xml')
+        [group] = nrml.to_python(source_model)
+        rup = next(group[12].iter_ruptures())
+        ruptures = [ParametricProbabilisticRupture(
+            rup.mag, rup.rake, rup.tectonic_region_type, rup.hypocenter,
+            rup.surface, rate, PoissonTOM(1)) for rate in (.05, .1, .5)]
+        serials = numpy.arange(42, 42 + len(ruptures))
+        occ = sample_occurrences(ruptures, serials, 1, 20, 2)
+        self.assertEqual(occ.dtype.names, ('rup', 'sample', 'ses', 'n_occ'))
+
+        # same numbers as drawing one (sample, ses) at the time
+        expected = []
+        for rup_no, (rup, serial) in enumerate(zip(ruptures, serials)):
+            rng = numpy.random.RandomState(serial)
+            for sam_idx in range(2):
+                for ses_idx in range(1, 21):
+                    n_occ = rup.sample_number_of_occurrences(rng)
+                    if n_occ:
+                        expected.append((rup_no, sam_idx, ses_idx, n_occ))
+        self.assertEqual(occ.tolist(), expected)
@@ -21,7 +21,13 @@ from openquake.hazardlib.imt import SA, PGA
 from openquake.hazardlib.correlation import JB2009CorrelationModel, \
                                             HM2018CorrelationModel
 from openquake.hazardlib.site import Site, SiteCollection
-from openquake.hazardlib.geo import Point
+from openquake.hazardlib.geo import Point, Line
+from openquake.hazardlib.geo.surface import SimpleFaultSurface
+from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
+from openquake.hazardlib.tom import PoissonTOM
+from openquake.hazardlib.const import TRT
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from openquake.hazardlib.calc.gmf import ground_motion_fields
 
 aaae = numpy.testing.assert_array_almost_equal
 
@@ -287,3 +293,32 @@ class HM2018ApplyCorrelationTestCase(unittest.TestCase):
              [[1.        , 0.3807, 0.5066],
               [0.3807, 1.        , 0.3075],
               [0.5066, 0.3075, 1.        ]], 2)
+
+
+class HM2018GroundMotionFieldsTestCase(unittest.TestCase):
+    SITECOL = SiteCollection([Site(Point(2, -40), 760., True, 1, 1),
+                              Site(Point(2, -40.1), 760., True, 1, 1),
+                              Site(Point(2, -39.95), 760., True, 1, 1)])
+
+    def make_rupture(self):
+        surface = SimpleFaultSurface.from_fault_data(
+            Line([Point(1.9, -40.2), Point(2.1, -40.2)]), 3., 15.,
+            dip=90., mesh_spacing=1.)
+        return ParametricProbabilisticRupture(
+            mag=6.5, rake=180., tectonic_region_type=TRT.ACTIVE_SHALLOW_CRUST,
+            hypocenter=Point(2, -40.2, 9.), surface=surface,
+            occurrence_rate=0.01, temporal_occurrence_model=PoissonTOM(50))
+
+    def test_multiple_imts_with_uncertainty(self):
+        # the correlation model draws from the random generator, so the
+        # GMFs of the first IMT must not depend on the other IMTs
+        rupture = self.make_rupture()
+        cormo = HM2018CorrelationModel(uncertainty_multiplier=1)
+        gsim = BooreAtkinson2008()
+        single = ground_motion_fields(
+            rupture, self.SITECOL, [PGA()], gsim, 3, 5, cormo, seed=42)
+        multi = ground_motion_fields(
+            rupture, self.SITECOL, [PGA(), SA(0.3)], gsim, 3, 5, cormo,
+            seed=42)
+        aaae(single[PGA()], multi[PGA()])
+        self.assertFalse(numpy.allclose(multi[PGA()], multi[SA(0.3)]))
@@ -25,6 +25,7 @@ import shapely.geometry
 
 from openquake.hazardlib import geo
 from openquake.hazardlib.geo import utils
+from openquake.hazardlib.site import SiteCollection
 
 Point = collections.namedtuple("Point",  'lon lat')
 aac = numpy.testing.assert_allclose
@@ -468,4 +469,33 @@ class PlaneFit(unittest.TestCase):
         self.assertAlmostEqual(self.c[-1], -sum(par*pnt), 2)
 
 
-# NB: utils.assoc is tested in the engine
+# NB: utils.assoc is tested also in the engine
+class AssocTestCase(unittest.TestCase):
+    def setUp(self):
+        # three sites, two of them across the dateline
+        self.sitecol = SiteCollection.from_points(
+            [179.99, -179.99, 0.], [0., 10., 0.])
+
+    def test_assoc_across_dateline(self):
+        params = numpy.array(
+            [(179.995, 10., 800.), (-179.995, 0., 760.)],
+            [('lon', float), ('lat', float), ('vs30', float)])
+        sitecol, objs, discarded = utils.assoc(
+            params, self.sitecol, 10, 'filter')
+        self.assertEqual(list(sitecol.sids), [0, 1])
+        self.assertEqual(list(objs['vs30']), [760., 800.])
+        self.assertEqual(len(discarded), 1)  # the site (0, 0) is too far
+
+        with self.assertRaises(utils.SiteAssociationError):
+            utils.assoc(params, self.sitecol, 10, 'strict')
+
+    def test_assoc_assets(self):
+        Asset = collections.namedtuple('Asset', 'ordinal location')
+        assets_by_site = [[Asset(0, (-179.999, 0.)), Asset(2, (-179.999, 0.))],
+                          [Asset(1, (179.999, 10.))], [Asset(3, (90., 0.))]]
+        sitecol, assets_by, discarded = utils.assoc(
+            assets_by_site, self.sitecol, 10, 'filter')
+        self.assertEqual(list(sitecol.sids), [0, 1])
+        self.assertEqual([[a.ordinal for a in assets] for assets in assets_by],
+                         [[0, 2], [1]])
+        self.assertEqual(discarded.tolist(), [(90., 0.)])
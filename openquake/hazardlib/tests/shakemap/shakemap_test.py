@@ -1,11 +1,15 @@
 import os.path
+import shutil
+import tempfile
 import unittest
 import numpy
+from unittest import mock
 from openquake.hazardlib import geo, imt
 from openquake.hazardlib.shakemap import (
     get_shakemap_array, get_sitecol_shakemap, to_gmfs, amplify_ground_shaking,
     spatial_correlation_array, spatial_covariance_array,
-    cross_correlation_matrix, cholesky)
+    cross_correlation_matrix, cholesky, get_tiles, gen_gmfs,
+    cache_array, get_cached_array)
 
 aae = numpy.testing.assert_almost_equal
 F64 = numpy.float64
@@ -89,3 +93,51 @@ class ShakemapTestCase(unittest.TestCase):
             num_gmfs=2, seed=42)
         aae(gmfs[..., 0].sum(axis=1), [[0.4101717, 0.6240185]])  # PGA
         aae(gmfs[..., 2].sum(axis=1), [[0.3946015, 0.5385107]])  # SA(1.0)
+
+    def test_tiles(self):
+        lons = numpy.array([84., 84., 84., 85.5, 85.5, 85.5, 87., 87., 87.])
+        lats = numpy.array([26., 27.5, 29., 26., 27.5, 29., 26., 27.5, 29.])
+        tiles = get_tiles(lons, lats, max_sites=4)
+        self.assertEqual([list(t) for t in tiles],
+                         [[0, 1, 3], [2, 4], [5, 6, 7, 8]])
+        tiles = get_tiles(lons, lats, max_sites=9)
+        self.assertEqual([list(t) for t in tiles], [list(range(9))])
+
+        # generating the GMFs by tiles
+        shakemap = numpy.zeros(9, shakemap_dt)  # 9 sites
+        shakemap['lon'] = lons
+        shakemap['lat'] = lats
+        shakemap['vs30'] = numpy.array([301.17] * 9)
+        shakemap['val'] = numpy.array(
+            [(5.38409665, 3.9383686, 3.55435415, 4.37692394)] * 9, imt_dt)
+        shakemap['std'] = numpy.array([(0.5, 0.52, 0.64, 0.73)] * 9, imt_dt)
+        sids = []
+        for tile, slc, gmfs in gen_gmfs(
+                shakemap, crosscorr='cross', site_effects=False, trunclevel=3,
+                num_gmfs=5, seed=42, max_matrix_size=12):
+            self.assertEqual(slc, slice(0, 5))
+            self.assertEqual(gmfs.shape, (len(tile), 5, 4))
+            sids.extend(tile)
+        self.assertEqual(sorted(sids), list(range(9)))
+
+        # generating the GMFs in blocks of 2 events
+        with mock.patch('openquake.hazardlib.shakemap.MAX_VARIATES', 24):
+            blocks = [(len(tile), slc) for tile, slc, gmfs in gen_gmfs(
+                shakemap, crosscorr='cross', site_effects=False, trunclevel=3,
+                num_gmfs=5, seed=42, max_matrix_size=12)]
+        self.assertEqual(blocks[:3], [(3, slice(0, 2)), (3, slice(2, 4)),
+                                      (3, slice(4, 5))])
+
+    def test_cache(self):
+        f1 = os.path.join(CDIR, 'ghorka_grid.xml')
+        f2 = os.path.join(CDIR, 'ghorka_uncertainty.xml')
+        array = get_shakemap_array(f1, f2)
+        cache_dir = tempfile.mkdtemp()
+        try:
+            self.assertIsNone(get_cached_array('us20002926', cache_dir))
+            checksum = cache_array(array, 'us20002926', cache_dir)
+            self.assertEqual(cache_array(array, None, cache_dir), checksum)
+            cached = get_cached_array('us20002926', cache_dir)
+            self.assertEqual(cached.tobytes(), array.tobytes())
+        finally:
+            shutil.rmtree(cache_dir)
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import numpy
 from openquake.hazardlib.const import TRT
 from openquake.hazardlib.source.point import PointSource
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
@@ -421,3 +422,26 @@ class PointSourceMaxRupProjRadiusTestCase(unittest.TestCase):
         source = make_point_source(nodal_plane_distribution=np_dist, mfd=mfd)
         radius = source._get_max_rupture_projection_radius()
         self.assertAlmostEqual(radius, 3.8712214)
+
+
+class PointSourceRupturesByIndexTestCase(unittest.TestCase):
+    def test(self):
+        np_dist = PMF([(0.5, NodalPlane(1, 20, 3)),
+                       (0.5, NodalPlane(2, 2, 4))])
+        hc_dist = PMF([(0.3, 2.), (0.7, 4.)])
+        source = make_point_source(nodal_plane_distribution=np_dist,
+                                   hypocenter_distribution=hc_dist)
+        ruptures = list(source.iter_ruptures())
+        self.assertEqual(len(ruptures), 8)
+        numpy.testing.assert_equal(
+            source.get_rupture_rates(),
+            [rup.occurrence_rate for rup in ruptures])
+        indices = numpy.array([6, 1, 4])
+        for idx, rup in zip(sorted(indices),
+                            source.iter_ruptures_by_index(indices)):
+            expected = ruptures[idx]
+            self.assertEqual(rup.mag, expected.mag)
+            self.assertEqual(rup.hypocenter, expected.hypocenter)
+            self.assertEqual(rup.occurrence_rate, expected.occurrence_rate)
+            self.assertEqual(rup.surface.get_strike(),
+                             expected.surface.get_strike())
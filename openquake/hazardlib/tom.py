@@ -68,35 +68,44 @@ class PoissonTOM(object):
         """
         return scipy.stats.poisson(occurrence_rate * self.time_span).pmf(1)
 
-    def sample_number_of_occurrences(self, occurrence_rate, seeds=None):
+    def sample_number_of_occurrences(self, occurrence_rate, seeds=None,
+                                     size=None):
         """
         Draw a random sample from the distribution and return a number
         of events to occur.
 
         The method uses the numpy random generator, which needs a seed
-        in order to get reproducible results. If the seed is None, it
-        should be set outside of this method.
+        in order to get reproducible results. If the seed is None, the
+        global numpy generator is used and it should be seeded outside
+        of this method; otherwise a local generator is used and the global
+        state is not touched, so that it is safe to call the method from
+        multiple threads.
 
         :param occurrence_rate:
             The average number of events per year.
         :param seeds:
-            Random number generator seeds, one per each occurrence_rate
+            Random number generator seeds, one per each occurrence_rate,
+            or a single seed, or a :class:`numpy.random.RandomState` instance
+        :param size:
+            if given, draw an array of `size` samples for a single rate
         :return:
             Sampled integer number of events to occur within model's
             time span.
         """
-        if isinstance(seeds, numpy.ndarray):  # array of seeds
+        if isinstance(seeds, numpy.random.RandomState):
+            rng = seeds
+        elif isinstance(seeds, numpy.ndarray):  # array of seeds
             assert len(seeds) == len(occurrence_rate), (
                 len(seeds), len(occurrence_rate))
             rates = occurrence_rate * self.time_span
-            occ = []
-            for rate, seed in zip(rates, seeds):
-                numpy.random.seed(seed)
-                occ.append(numpy.random.poisson(rate))
+            occ = [numpy.random.RandomState(seed).poisson(rate)
+                   for rate, seed in zip(rates, seeds)]
             return numpy.array(occ)
         elif isinstance(seeds, int):
-            numpy.random.seed(seeds)
-        return numpy.random.poisson(occurrence_rate * self.time_span)
+            rng = numpy.random.RandomState(seeds)
+        else:
+            rng = numpy.random
+        return rng.poisson(occurrence_rate * self.time_span, size)
 
     def get_probability_no_exceedance(self, occurrence_rate, poes):
         """
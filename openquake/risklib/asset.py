@@ -16,11 +16,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import operator
+import itertools
 import logging
 import csv
 import os
 import numpy
-from shapely import wkt, geometry
+from shapely import wkt, geometry, prepared
 
 from openquake.baselib import hdf5, general
 from openquake.baselib.node import Node, context
@@ -255,6 +256,7 @@ U8 = numpy.uint8
 U16 = numpy.uint16
 U32 = numpy.uint32
 F32 = numpy.float32
+F64 = numpy.float64
 U64 = numpy.uint64
 TWO16 = 2 ** 16
 by_taxonomy = operator.attrgetter('taxonomy')
@@ -315,6 +317,22 @@ class TagCollection(object):
                 'specified in the exposure' % ', '.join(dic))
         return idxs
 
+    def add_array(self, tagname, tagvalues):
+        """
+        Vectorized version of :meth:`add`, adding the new tagvalues in order
+        of appearance.
+
+        :param tagname: the name of the tag
+        :param tagvalues: an array of tagvalues
+        :returns: an array of tag indices, one per tagvalue
+        """
+        uniq, first, inv = numpy.unique(
+            tagvalues, return_index=True, return_inverse=True)
+        idxs = numpy.zeros(len(uniq), U16)
+        for u in numpy.argsort(first):
+            idxs[u] = self.add(tagname, str(uniq[u]))
+        return idxs[inv]
+
     def get_tag(self, tagname, tagidx):
         """
         :returns: the tag associated to the given tagname and tag index
@@ -384,6 +402,7 @@ class AssetCollection(object):
         self.deduc = [n for n in fields if n.startswith('deductible-')]
         self.i_lim = [n for n in fields if n.startswith('insurance_limit-')]
         self.retro = [n for n in fields if n == 'retrofitted']
+        self._tag_index = {}
 
     @property
     def tagnames(self):
@@ -392,15 +411,48 @@ class AssetCollection(object):
         """
         return self.tagcol.tagnames
 
+    def get_tag_index(self, tagname):
+        """
+        :param tagname: the name of a tag
+        :returns:
+            a pair (aids, offsets) such that the ordinals of the assets with
+            tag index i are aids[offsets[i]:offsets[i + 1]], in order
+        """
+        try:
+            return self._tag_index[tagname]
+        except KeyError:
+            tagidxs = self.array[tagname]
+            num_tags = len(getattr(self.tagcol, tagname))
+            counts = numpy.bincount(tagidxs, minlength=num_tags)
+            offsets = numpy.zeros(len(counts) + 1, U32)
+            offsets[1:] = numpy.cumsum(counts)
+            aids = numpy.argsort(tagidxs, kind='mergesort').astype(U32)
+            self._tag_index[tagname] = aids, offsets
+            return aids, offsets
+
+    def get_aids(self, tag):
+        """
+        :param tag: a string of the form tagname=tagvalue
+        :returns: the ordered array of the ordinals of the assets with the tag
+        """
+        tagname, tagvalue = tag.split('=', 1)
+        try:
+            tagidx = getattr(self.tagcol, tagname + '_idx')[tagvalue]
+        except (AttributeError, KeyError):  # unknown tag
+            return numpy.zeros(0, U32)
+        aids, offsets = self.get_tag_index(tagname)
+        return aids[offsets[tagidx]:offsets[tagidx + 1]]
+
     def get_aids_by_tag(self):
         """
         :returns: dict tag -> asset ordinals
         """
         aids_by_tag = general.AccumDict(accum=set())
-        for aid, ass in enumerate(self):
-            for tagname, tagidx in zip(self.tagnames, ass.tagidxs):
-                tag = self.tagcol.get_tag(tagname, tagidx)
-                aids_by_tag[tag].add(aid)
+        for tagname in self.tagnames:
+            for tag in self.tagcol.gen_tags(tagname):
+                aids = self.get_aids(tag)
+                if len(aids):
+                    aids_by_tag[tag] = set(aids)
         return aids_by_tag
 
     @property
@@ -419,6 +471,53 @@ class AssetCollection(object):
             assets_by_site[ass['site_id']].append(self[i])
         return numpy.array(assets_by_site)
 
+    def get_risk_array(self, aids=None):
+        """
+        :param aids: asset ordinals (default all the assets)
+        :returns:
+            a structured array with the ordinal, site ID, taxonomy and
+            number of the assets, plus the total values, the deductible and
+            insurance limit fractions and the retrofitted values, i.e. the
+            quantities returned by the methods of the Asset objects,
+            computed for all the assets at once
+        """
+        if aids is None:
+            aids = numpy.arange(len(self.array), dtype=U32)
+        array = self.array[aids]
+        calc = self.cost_calculator
+        costs = [lt for lt in self.loss_types if lt != 'occupants']
+        occupants = [name for name in array.dtype.names
+                     if name.startswith('occupants_')]
+        dtlist = [('ordinal', U32), ('site_id', U32), ('taxonomy', U16),
+                  ('number', F32)] + [('value-' + lt, F64) for lt in costs]
+        for name in occupants + self.deduc + self.i_lim + ['retrofitted']:
+            dtlist.append((name, F64))
+        arr = numpy.zeros(len(array), dtlist)
+        arr['ordinal'] = aids
+        for name in ('site_id', 'taxonomy', 'number'):
+            arr[name] = array[name]
+        area, number = array['area'], array['number']
+        for lt in costs:
+            arr['value-' + lt] = calc(
+                lt, {lt: array['value-' + lt]}, area, number)
+        for name in occupants:
+            arr[name] = array[name]
+        for name in self.deduc + self.i_lim:
+            if name in self.deduc:
+                lt, absolute = name[self.D:], calc.deduct_abs
+            else:
+                lt, absolute = name[self.I:], calc.limit_abs
+            val = calc(lt, {lt: array[name]}, area, number)
+            # convert to a value relative to the asset value
+            arr[name] = val / arr['value-' + lt] if absolute else val
+        if self.retro:
+            arr['retrofitted'] = calc(
+                'structural', {'structural': array['retrofitted']},
+                area, number)
+        else:  # as in Asset.retrofitted
+            arr['retrofitted'] = numpy.nan
+        return arr
+
     def reduce(self, sitecol):
         """
         :returns: a reduced AssetCollection on the given sitecol
@@ -430,6 +529,7 @@ class AssetCollection(object):
         vars(new).update(vars(self))
         new.array = self.array[ok_indices]
         new.asset_refs = self.asset_refs[ok_indices]
+        new._tag_index = {}
         return new
 
     def reduce_also(self, sitecol):
@@ -450,6 +550,7 @@ class AssetCollection(object):
         vars(new).update(vars(self))
         new.array = numpy.concatenate(array)
         new.asset_refs = numpy.concatenate(asset_refs)
+        new._tag_index = {}
         sitecol.make_complete()
         return new
 
@@ -493,9 +594,16 @@ class AssetCollection(object):
                  'tot_sites': self.tot_sites,
                  'tagnames': encode(self.tagnames),
                  'nbytes': self.array.nbytes}
+        # the tag index is stored so that the aggregations by tag
+        # can be performed without scanning the assets
+        tag_index = {}
+        for tagname in self.tagnames:
+            aids, offsets = self.get_tag_index(tagname)
+            tag_index[tagname] = dict(aids=aids, offsets=offsets)
         return dict(
             array=self.array, cost_calculator=self.cost_calculator,
-            tagcol=self.tagcol, asset_refs=self.asset_refs), attrs
+            tagcol=self.tagcol, asset_refs=self.asset_refs,
+            tag_index=tag_index), attrs
 
     def __fromh5__(self, dic, attrs):
         for name in ('loss_types', 'deduc', 'i_lim', 'retro'):
@@ -508,6 +616,11 @@ class AssetCollection(object):
         self.tagcol = dic['tagcol']
         self.cost_calculator = dic['cost_calculator']
         self.asset_refs = dic['asset_refs'].value
+        self._tag_index = {}
+        if 'tag_index' in dic:  # not in datastores from previous versions
+            for tagname, grp in dic['tag_index'].items():
+                self._tag_index[tagname] = (
+                    grp['aids'].value, grp['offsets'].value)
         self.cost_calculator.tagi = {
             decode(tagname): i for i, tagname in enumerate(self.tagnames)}
 
@@ -595,6 +708,38 @@ cost_type_dt = numpy.dtype([('name', hdf5.vstr),
                             ('type', hdf5.vstr),
                             ('unit', hdf5.vstr)])
 
+CSV_CHUNKSIZE = 100000  # number of rows read at once from an exposure CSV
+INVALID_TAGVALUES = ['', '?', '*', '?*']  # see TagCollection.add_tags
+
+
+def _positivefloats(strings):
+    """
+    Vectorized version of :func:`openquake.hazardlib.valid.positivefloat`
+
+    :param strings: an array of strings
+    :returns: an array of non-negative floats
+    """
+    floats = strings.astype(float)
+    if (floats < 0).any():
+        raise ValueError('Found negative floats')
+    return floats
+
+
+def _coordinates(strings, maxval):
+    """
+    Vectorized version of :func:`openquake.hazardlib.valid.longitude` and
+    :func:`openquake.hazardlib.valid.latitude`
+
+    :param strings: an array of strings
+    :param maxval: 180 for longitudes, 90 for latitudes
+    :returns: an array of coordinates rounded to 5 digits
+    """
+    # NB: numpy.round can differ from round in the last digit
+    coords = numpy.array([round(x, 5) for x in strings.astype(float).tolist()])
+    if (numpy.abs(coords) > maxval).any():
+        raise ValueError('Found coordinates out of range')
+    return coords
+
 
 def _get_exposure(fname, stop=None):
     """
@@ -716,11 +861,15 @@ class Exposure(object):
         exposure, assets = _get_exposure(param['fname'])
         param['relevant_cost_types'] = set(exposure.cost_types['name']) - set(
             ['occupants'])
-        nodes = assets if assets else exposure._read_csv(
-            assets.text, os.path.dirname(param['fname']))
+        dirname = os.path.dirname(param['fname'])
         if asset_nodes:  # this is useful for the GED4ALL import script
-            return nodes
-        exposure._populate_from(nodes, param, check_dupl)
+            return assets if assets else exposure._read_csv(
+                assets.text, dirname)
+        if assets:
+            exposure._populate_from(assets, param, check_dupl)
+        else:
+            exposure._populate_from_csv(
+                assets.text, dirname, param, check_dupl)
         if param['region'] and param['out_of_region']:
             logging.info('Discarded %d assets outside the region',
                          param['out_of_region'])
@@ -750,11 +899,11 @@ class Exposure(object):
         fields.extend(self.tagcol.tagnames)
         return set(fields)
 
-    def _read_csv(self, csvnames, dirname):
+    def _csv_fnames(self, csvnames, dirname):
         """
         :param csvnames: names of csv files, space separated
         :param dirname: the directory where the csv files are
-        :yields: asset nodes
+        :returns: the full path names of the csv files, with a checked header
         """
         expected_header = self._csv_header()
         fnames = [os.path.join(dirname, f) for f in csvnames.split()]
@@ -770,41 +919,160 @@ class Exposure(object):
                     raise InvalidFile(
                         'Unexpected header in %s\nExpected: %s\nGot: %s' %
                         (fname, sorted(expected_header), sorted(header)))
-        occupancy_periods = self.occupancy_periods.split()
-        for fname in fnames:
+        return fnames
+
+    def _read_csv(self, csvnames, dirname):
+        """
+        :param csvnames: names of csv files, space separated
+        :param dirname: the directory where the csv files are
+        :yields: asset nodes
+        """
+        for fname in self._csv_fnames(csvnames, dirname):
             with open(fname, encoding='utf-8') as f:
-                for i, dic in enumerate(csv.DictReader(f), 1):
-                    asset = Node('asset', lineno=i)
-                    with context(fname, asset):
-                        asset['id'] = dic['id']
-                        asset['number'] = valid.positivefloat(dic['number'])
-                        asset['taxonomy'] = dic['taxonomy']
-                        if 'area' in dic:  # optional attribute
-                            asset['area'] = dic['area']
-                        loc = Node('location',
-                                   dict(lon=valid.longitude(dic['lon']),
-                                        lat=valid.latitude(dic['lat'])))
-                        costs = Node('costs')
-                        for cost in self.cost_types['name']:
-                            a = dict(type=cost, value=dic[cost])
-                            costs.append(Node('cost', a))
-                        occupancies = Node('occupancies')
-                        for period in occupancy_periods:
-                            a = dict(occupants=float(dic[period]),
-                                     period=period)
-                            occupancies.append(Node('occupancy', a))
-                        tags = Node('tags')
-                        for tagname in self.tagcol.tagnames:
-                            if tagname != 'taxonomy':
-                                tags.attrib[tagname] = dic[tagname]
-                        asset.nodes.extend([loc, costs, occupancies, tags])
-                        if i % 100000 == 0:
-                            logging.info('Read %d assets', i)
-                    yield asset
-
-    def _populate_from(self, asset_nodes, param, check_dupl):
+                yield from self._gen_nodes(fname, csv.DictReader(f))
+
+    def _gen_nodes(self, fname, dicts, start=1):
+        """
+        :param fname: the csv file being read
+        :param dicts: dictionaries with the fields of the csv rows
+        :param start: the number of the first row
+        :yields: validated asset nodes
+        """
+        occupancy_periods = self.occupancy_periods.split()
+        for i, dic in enumerate(dicts, start):
+            asset = Node('asset', lineno=i)
+            with context(fname, asset):
+                asset['id'] = dic['id']
+                asset['number'] = valid.positivefloat(dic['number'])
+                asset['taxonomy'] = dic['taxonomy']
+                if 'area' in dic:  # optional attribute
+                    asset['area'] = dic['area']
+                loc = Node('location',
+                           dict(lon=valid.longitude(dic['lon']),
+                                lat=valid.latitude(dic['lat'])))
+                costs = Node('costs')
+                for cost in self.cost_types['name']:
+                    a = dict(type=cost, value=dic[cost])
+                    costs.append(Node('cost', a))
+                occupancies = Node('occupancies')
+                for period in occupancy_periods:
+                    a = dict(occupants=float(dic[period]),
+                             period=period)
+                    occupancies.append(Node('occupancy', a))
+                tags = Node('tags')
+                for tagname in self.tagcol.tagnames:
+                    if tagname != 'taxonomy':
+                        tags.attrib[tagname] = dic[tagname]
+                asset.nodes.extend([loc, costs, occupancies, tags])
+                if i % 100000 == 0:
+                    logging.info('Read %d assets', i)
+            yield asset
+
+    def _populate_from_csv(self, csvnames, dirname, param, check_dupl):
+        """
+        Read the csv files in chunks of CSV_CHUNKSIZE rows, validate them
+        by columns and add the assets. If a chunk cannot be managed by
+        columns, it is read again row by row as in :meth:`_read_csv`,
+        so that the same assets are accepted and the same errors raised.
+
+        :param csvnames: names of csv files, space separated
+        :param dirname: the directory where the csv files are
+        :param param: a dictionary of parameters as in :meth:`read`
+        :param check_dupl: if True, raise an error for duplicated asset IDs
+        """
         asset_refs = set()
-        for idx, asset_node in enumerate(asset_nodes):
+        idx = 0  # row index over all files, as in _populate_from
+        for fname in self._csv_fnames(csvnames, dirname):
+            with open(fname, encoding='utf-8') as f:
+                reader = csv.reader(f)
+                header = next(reader)
+                start = 1
+                while True:
+                    chunk = list(itertools.islice(reader, CSV_CHUNKSIZE))
+                    if not chunk:
+                        break
+                    # skip the empty lines, as csv.DictReader does
+                    rows = [row for row in chunk if row]
+                    try:
+                        self._add_csv_assets(
+                            idx, header, rows, param, check_dupl, asset_refs)
+                    except nrml.DuplicatedID:
+                        raise
+                    except Exception:  # fall back to the row by row reader
+                        # missing fields are None, as in csv.DictReader
+                        dicts = (dict(itertools.zip_longest(
+                            header, row[:len(header)])) for row in rows)
+                        self._populate_from(
+                            self._gen_nodes(fname, dicts, start), param,
+                            check_dupl, idx, asset_refs)
+                    start += len(rows)
+                    idx += len(rows)
+                    logging.info('Read %d assets', idx)
+
+    def _add_csv_assets(self, idx, header, rows, param, check_dupl,
+                        asset_refs):
+        # add a chunk of assets, validated by columns
+        if not rows:
+            return
+        # the fields past the header are ignored, as in csv.DictReader
+        H = len(header)
+        if any(len(row) < H for row in rows):
+            raise InvalidFile('Rows shorter than the header')
+        cols = dict(zip(header, map(numpy.array, zip(*(
+            row[:H] for row in rows)))))
+        number = _positivefloats(cols['number'])
+        lons = _coordinates(cols['lon'], 180.)
+        lats = _coordinates(cols['lat'], 90.)
+        area = (cols['area'].astype(float) if 'area' in cols
+                else numpy.ones(len(rows)))
+        values = {cost: cols[cost].astype(float)
+                  for cost in self.cost_types['name']
+                  if cost in param['relevant_cost_types']}
+        if 'occupants' in self.cost_types['name']:
+            values['occupants_None'] = number
+        periods = self.occupancy_periods.split()
+        if periods:
+            for period in periods:
+                values['occupants_' + period] = cols[period].astype(float)
+            values['occupants_None'] = sum(
+                values['occupants_' + period] for period in periods
+            ) / len(periods)
+        ok = numpy.ones(len(rows), bool)
+        if param['region']:
+            region = prepared.prep(param['region'])
+            for i, lonlat in enumerate(zip(lons, lats)):
+                ok[i] = region.contains(geometry.Point(*lonlat))
+        tagvalues = [cols[tagname][ok] for tagname in self.tagcol.tagnames]
+        for tagname, tvalues in zip(self.tagcol.tagnames, tagvalues):
+            if numpy.isin(tvalues, INVALID_TAGVALUES).any():
+                raise ValueError('Invalid tagvalue for %s' % tagname)
+
+        # the chunk is valid, now add the assets
+        aids = cols['id'].tolist()
+        if check_dupl:
+            for asset_id in aids:
+                if asset_id in asset_refs:
+                    raise nrml.DuplicatedID(asset_id)
+                asset_refs.add(asset_id)
+        self.asset_refs.extend(asset_id.encode('utf8') for asset_id in aids)
+        param['out_of_region'] += len(rows) - ok.sum()
+        tagidxs = numpy.array(
+            [self.tagcol.add_array(tagname, tvalues) for tagname, tvalues
+             in zip(self.tagcol.tagnames, tagvalues)]).T.tolist()
+        names = list(values)
+        columns = [(idx + numpy.where(ok)[0]).tolist(), tagidxs] + [
+            arr[ok].tolist() for arr in [number, lons, lats, area] + [
+                values[name] for name in names]]
+        for i, tidxs, num, lon, lat, ar, *vals in zip(*columns):
+            self.assets.append(
+                Asset(i, tidxs, num, (lon, lat), dict(zip(names, vals)), ar,
+                      {}, {}, None, self.cost_calculator))
+
+    def _populate_from(self, asset_nodes, param, check_dupl, start=0,
+                       asset_refs=None):
+        if asset_refs is None:
+            asset_refs = set()
+        for idx, asset_node in enumerate(asset_nodes, start):
             asset_id = asset_node['id']
             # check_dupl is False only in oq prepare_site_model since
             # in that case we are only interested in the asset locations
@@ -33,6 +33,7 @@ class ValidationError(Exception):
 
 
 U32 = numpy.uint32
+U64 = numpy.uint64
 F32 = numpy.float32
 by_taxonomy = operator.attrgetter('taxonomy')
 
@@ -137,6 +138,8 @@ class CompositeRiskModel(collections.Mapping):
                 raise ValidationError(
                     'Missing vulnerability function for taxonomy %s and loss'
                     ' type %s' % (taxonomy, ', '.join(missing)))
+            # precompute the LREMs and the fragility PoEs once
+            riskmodel.precompute()
         self.taxonomies = sorted(taxonomies)
         iml = collections.defaultdict(list)
         for taxo, rm in self._riskmodels.items():
@@ -239,7 +242,12 @@ class CompositeRiskModel(collections.Mapping):
         # group the assets by taxonomy
         dic = collections.defaultdict(list)
         for sid, assets in zip(sids, riskinput.assets_by_site):
-            group = groupby(assets, by_taxonomy)
+            if isinstance(assets, numpy.ndarray):  # array of assets
+                taxonomies = assets['taxonomy']
+                group = {taxo: assets[taxonomies == taxo]
+                         for taxo in numpy.unique(taxonomies)}
+            else:  # list of Asset objects
+                group = groupby(assets, by_taxonomy)
             for taxonomy in group:
                 dic[taxonomy].append(
                     (sid, group[taxonomy], riskinput.epsilon_getter))
@@ -259,6 +267,11 @@ class CompositeRiskModel(collections.Mapping):
                 imt_lt = [imt for imt in imts if imt in imti]
                 if not imt_lt:  # a warning is printed in riskmodel.check_imts
                     continue
+                if hazard_getter.eids is None:  # classical
+                    yield from self._gen_classical_outputs(
+                        riskmodel, hazard, dic[taxonomy],
+                        [imti[imt] for imt in imt_lt])
+                    continue
                 for sid, assets, epsgetter in dic[taxonomy]:
                     for rlzi, haz in sorted(hazard[sid].items()):
                         if isinstance(haz, numpy.ndarray):
@@ -275,19 +288,35 @@ class CompositeRiskModel(collections.Mapping):
                             eids = haz['eid']
                             data = [(haz['gmv'][:, imti[imt]], eids)
                                     for imt in imt_lt]
-                        elif not haz:  # no hazard for this site
+                        else:  # no hazard for this site
                             eids = []
                             data = [(numpy.zeros(len(hazard_getter.eids)),
                                      hazard_getter.eids) for imt in imt_lt]
-                        else:  # classical
-                            eids = hazard_getter.eids
-                            data = [haz[imti[imt]] for imt in imt_lt]
                         out = riskmodel.get_output(assets, data, epsgetter)
                         out.sid = sid
                         out.rlzi = rlzi
                         out.eids = eids
                         yield out
 
+    def _gen_classical_outputs(self, riskmodel, hazard, triples, imtis):
+        # the hazard curves of all the sites and realizations are passed
+        # together to the riskmodel, so that the loss curves can be
+        # computed with a single matrix product for each loss type
+        items = [(sid, assets, rlzi, haz)
+                 for sid, assets, epsgetter in triples
+                 for rlzi, haz in sorted(hazard[sid].items())]
+        if not items:
+            return
+        curves_by_lt = [numpy.array([haz[i] for _, _, _, haz in items])
+                        for i in imtis]  # arrays of shape (K, L)
+        outs = riskmodel.get_outputs(
+            [assets for _, assets, _, _ in items], curves_by_lt)
+        for (sid, assets, rlzi, haz), out in zip(items, outs):
+            out.sid = sid
+            out.rlzi = rlzi
+            out.eids = None
+            yield out
+
     def reduce(self, taxonomies):
         """
         :param taxonomies: a set of taxonomies
@@ -323,7 +352,8 @@ class RiskInput(object):
     :param hazard_getter:
         a callable returning the hazard data for a given realization
     :param assets_by_site:
-        array of assets, one per site
+        list of assets, one per site; the assets can be lists of Asset
+        objects or structured arrays built by AssetCollection.get_risk_array
     :param eps_dict:
         dictionary of epsilons (can be None)
     """
@@ -335,6 +365,10 @@ class RiskInput(object):
         taxonomies_set = set()
         aids = []
         for assets in self.assets_by_site:
+            if isinstance(assets, numpy.ndarray):
+                taxonomies_set.update(assets['taxonomy'])
+                aids.extend(assets['ordinal'])
+                continue
             for asset in assets:
                 taxonomies_set.add(asset.taxonomy)
                 aids.append(asset.ordinal)
@@ -368,33 +402,71 @@ class RiskInput(object):
             ' '.join(map(str, self.taxonomies)), len(self.aids))
 
 
+def _mix64(x):
+    # splitmix64 finalizer: a bijection on uint64 with good avalanche
+    x = x ^ (x >> U64(30))
+    x = x * U64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> U64(27))
+    x = x * U64(0x94D049BB133111EB)
+    return x ^ (x >> U64(31))
+
+
+def counter_normal(seed, aids, idxs):
+    """
+    Counter-based generator of standard normal numbers: the number
+    associated to the pair (aid, idx) depends only on the seed and on the
+    pair, so any block of the matrix can be generated independently.
+
+    :param seed: a non-negative integer
+    :param aids: an array of A asset ordinals
+    :param idxs: an array of E event indices
+    :returns: an array of shape (A, E) and dtype float32
+    """
+    aids = numpy.asarray(aids, U64).reshape(-1, 1)
+    idxs = numpy.asarray(idxs, U64).reshape(1, -1)
+    key = _mix64(numpy.array([seed], U64) + U64(0x9E3779B97F4A7C15))
+    x1 = _mix64(((aids << U64(32)) | idxs) ^ key)
+    x2 = _mix64(x1 ^ key)
+    # uniform numbers in (0, 1] and [0, 1) from the highest 53 bits
+    u1 = ((x1 >> U64(11)) + U64(1)) * 2. ** -53
+    u2 = (x2 >> U64(11)) * 2. ** -53
+    # Box-Muller transform
+    return (numpy.sqrt(-2. * numpy.log(u1)) *
+            numpy.cos(2. * numpy.pi * u2)).astype(F32)
+
+
 class EpsilonMatrix0(object):
     """
     Mock-up for a matrix of epsilons of size N x E,
-    used when asset_correlation=0.
+    used when asset_correlation=0. The epsilons are generated on demand
+    with a counter-based generator, so that the full matrix is never built.
 
     :param num_assets: N assets
-    :param seeds: E seeds, set before calling numpy.random.normal
+    :param num_events: E events
+    :param seed: seed used to generate the epsilons
+    :param offset: index of the first event
     """
-    def __init__(self, num_assets, seeds):
+    def __init__(self, num_assets, num_events, seed, offset=0):
         self.num_assets = num_assets
-        self.seeds = seeds
-        self.eps = None
+        self.num_events = num_events
+        self.seed = seed
+        self.offset = offset
 
-    def make_eps(self):
+    def get(self, aids, idxs):
         """
-        Builds a matrix of A x E epsilons
+        :param aids: A asset ordinals
+        :param idxs: E event indices
+        :returns: a block of epsilons of shape (A, E)
         """
-        eps = numpy.zeros((self.num_assets, len(self.seeds)), F32)
-        for i, seed in enumerate(self.seeds):
-            numpy.random.seed(seed)
-            eps[:, i] = numpy.random.normal(size=self.num_assets)
-        return eps
+        return counter_normal(
+            self.seed, aids, numpy.asarray(idxs, U64) + U64(self.offset))
 
-    def __getitem__(self, aid):
-        if self.eps is None:
-            self.eps = self.make_eps()
-        return self.eps[aid]
+    def __getitem__(self, item):
+        if isinstance(item, tuple):  # (asset index, event indices)
+            aid, idxs = item
+            return self.get([aid], idxs)[0]
+        # item is an asset index
+        return self.get([item], numpy.arange(self.num_events))[0]
 
     def __len__(self):
         return self.num_assets
@@ -439,7 +511,6 @@ def make_epsilon_getter(n_assets, n_events, correlation, master_seed, no_eps):
     assert correlation in (0, 1), correlation
     assert master_seed >= 0, master_seed
     assert no_eps in (True, False), no_eps
-    seeds = master_seed + numpy.arange(n_events)
 
     def get_eps(start=0, stop=n_events):
         if no_eps:
@@ -447,7 +518,7 @@ def make_epsilon_getter(n_assets, n_events, correlation, master_seed, no_eps):
         elif correlation:
             eps = EpsilonMatrix1(n_assets, stop - start, master_seed)
         else:
-            eps = EpsilonMatrix0(n_assets, seeds[start:stop])
+            eps = EpsilonMatrix0(n_assets, stop - start, master_seed, start)
         return eps
 
     return get_eps
@@ -462,17 +533,15 @@ def make_eps(assetcol, num_samples, seed, correlation):
     :param float correlation: the correlation coefficient
     :returns: epsilons matrix of shape (num_assets, num_samples)
     """
-    assets_by_taxo = groupby(assetcol, by_taxonomy)
+    taxonomies = assetcol.array['taxonomy']
     eps = numpy.zeros((len(assetcol), num_samples), numpy.float32)
-    for taxonomy, assets in assets_by_taxo.items():
+    for taxonomy in numpy.unique(taxonomies):
         # the association with the epsilons is done in order
-        assets.sort(key=operator.attrgetter('ordinal'))
-        shape = (len(assets), num_samples)
+        aids, = (taxonomies == taxonomy).nonzero()
+        shape = (len(aids), num_samples)
         logging.info('Building %s epsilons for taxonomy %s', shape, taxonomy)
         zeros = numpy.zeros(shape)
-        epsilons = scientific.make_epsilons(zeros, seed, correlation)
-        for asset, epsrow in zip(assets, epsilons):
-            eps[asset.ordinal] = epsrow
+        eps[aids] = scientific.make_epsilons(zeros, seed, correlation)
     return eps
 
 
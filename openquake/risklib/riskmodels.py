@@ -17,7 +17,6 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import re
 import inspect
-import functools
 import numpy
 
 from openquake.baselib.node import Node
@@ -154,15 +153,63 @@ def get_risk_models(oqparam, kind=None):
     return rdict
 
 
+# NB: the functions below accept both a structured array of assets, as
+# returned by AssetCollection.get_risk_array, and a list of Asset objects
+
+
 def get_values(loss_type, assets, time_event=None):
     """
     :returns:
         a numpy array with the values for the given assets, depending on the
         loss_type.
     """
+    if isinstance(assets, numpy.ndarray):
+        if loss_type == 'occupants':
+            return assets['occupants_' + str(time_event)]
+        return assets['value-' + loss_type]
     return numpy.array([a.value(loss_type, time_event) for a in assets])
 
 
+def get_ordinals(assets):
+    """
+    :returns: a numpy array with the ordinals of the given assets
+    """
+    if isinstance(assets, numpy.ndarray):
+        return assets['ordinal']
+    return numpy.array([a.ordinal for a in assets])
+
+
+def get_numbers(assets):
+    """
+    :returns: a numpy array with the number of units of the given assets
+    """
+    if isinstance(assets, numpy.ndarray):
+        return assets['number']
+    return numpy.array([a.number for a in assets])
+
+
+def get_retrofitted(assets):
+    """
+    :returns: a numpy array with the retrofitted values of the given assets
+    """
+    if isinstance(assets, numpy.ndarray):
+        return assets['retrofitted']
+    return numpy.array([a.retrofitted() for a in assets])
+
+
+def get_insurance(loss_type, assets):
+    """
+    :returns:
+        two numpy arrays with the deductible and insurance limit fractions
+        of the given assets
+    """
+    if isinstance(assets, numpy.ndarray):
+        return (assets['deductible-' + loss_type],
+                assets['insurance_limit-' + loss_type])
+    return (numpy.array([a.deductible(loss_type) for a in assets]),
+            numpy.array([a.insurance_limit(loss_type) for a in assets]))
+
+
 class RiskModel(object):
     """
     Base class. Can be used in the tests as a mock.
@@ -192,6 +239,13 @@ class RiskModel(object):
         return [lt for lt in self.loss_types
                 if self.risk_functions[lt].imt == imt]
 
+    def precompute(self):
+        """
+        Precompute the data depending only on the risk functions, which is
+        shared by all the assets of the taxonomy and sent to the workers
+        together with the riskmodel. Nothing to do by default.
+        """
+
     def get_output(self, assets, data_by_lt, epsgetter):
         """
         :param assets: a list of assets with the same taxonomy
@@ -203,6 +257,19 @@ class RiskModel(object):
                for lt, data in zip(self.loss_types, data_by_lt)]
         return ArrayWrapper(numpy.array(out), dict(assets=assets))
 
+    def get_outputs(self, assets_list, curves_by_lt):
+        """
+        Used in classical calculations; riskmodels can override it to
+        manage all the hazard curves of the taxonomy at once.
+
+        :param assets_list: K arrays of assets with the same taxonomy
+        :param curves_by_lt: arrays of K hazard curves, one per loss type
+        :returns: K ArrayWrappers of shape (L, ...)
+        """
+        return [self.get_output(assets, [curves[k] for curves in curves_by_lt],
+                                None)
+                for k, assets in enumerate(assets_list)]
+
     def __toh5__(self):
         risk_functions = {lt: func for lt, func in self.risk_functions.items()}
         if hasattr(self, 'retro_functions'):
@@ -271,6 +338,17 @@ class Classical(RiskModel):
         self.loss_ratios = {
             lt: vf.mean_loss_ratios_with_steps(self.lrem_steps_per_interval)
             for lt, vf in self.risk_functions.items()}
+        self.lrems = {}
+
+    def precompute(self):
+        """
+        Build the loss ratio exceedance matrices for each loss type
+        """
+        self.lrems = {
+            lt: scientific.build_lrem(vf, self.hazard_imtls[vf.imt],
+                                      self.lrem_steps_per_interval)
+            for lt, vf in self.risk_functions.items()
+            if vf.imt in self.hazard_imtls}
 
     def __call__(self, loss_type, assets, hazard_curve, _eps=None):
         """
@@ -286,13 +364,36 @@ class Classical(RiskModel):
         :returns:
             an array of shape (C, N, 2)
         """
-        n = len(assets)
+        return self._loss_curves(
+            loss_type, assets, self._loss_ratio_curves(loss_type, hazard_curve))
+
+    def get_outputs(self, assets_list, curves_by_lt):
+        """
+        Compute the loss ratio curves of all the K hazard curves with a
+        single call to :func:`openquake.risklib.scientific.classical`
+        for each loss type.
+
+        :param assets_list: K arrays of assets with the same taxonomy
+        :param curves_by_lt: arrays of shape (K, L), one per loss type
+        :returns: K ArrayWrappers of shape (L, C, N, 2)
+        """
+        lrcurves = [self._loss_ratio_curves(lt, curves)  # shape (K, 2, C)
+                    for lt, curves in zip(self.loss_types, curves_by_lt)]
+        return [ArrayWrapper(numpy.array(
+            [self._loss_curves(lt, assets, lrcs[k])
+             for lt, lrcs in zip(self.loss_types, lrcurves)]),
+            dict(assets=assets)) for k, assets in enumerate(assets_list)]
+
+    def _loss_ratio_curves(self, loss_type, hazard_curves):
         vf = self.risk_functions[loss_type]
-        imls = self.hazard_imtls[vf.imt]
+        return scientific.classical(
+            vf, self.hazard_imtls[vf.imt], hazard_curves,
+            self.lrem_steps_per_interval, self.lrems.get(loss_type))
+
+    def _loss_curves(self, loss_type, assets, lrcurve):
+        # the loss ratio curve is the same for all the assets
         values = get_values(loss_type, assets)
-        lrcurves = numpy.array(
-            [scientific.classical(
-                vf, imls, hazard_curve, self.lrem_steps_per_interval)] * n)
+        lrcurves = numpy.array([lrcurve] * len(assets))
 
         # if in the future we wanted to implement insured_losses the
         # following lines could be useful
@@ -349,14 +450,19 @@ class ProbabilisticEventBased(RiskModel):
         loss_ratios = numpy.zeros((A, E, I), F32)
         vf = self.risk_functions[loss_type]
         means, covs, idxs = vf.interpolate(gmvs)
-        for i, asset in enumerate(assets):
-            epsilons = epsgetter(asset.ordinal, eids)
-            ratios = vf.sample(means, covs, idxs, epsilons)
-            loss_ratios[i, idxs, 0] = ratios
-            if self.insured_losses and loss_type != 'occupants':
-                loss_ratios[i, idxs, 1] = scientific.insured_losses(
-                    ratios,  asset.deductible(loss_type),
-                    asset.insurance_limit(loss_type))
+        epsilons = [epsgetter(aid, eids) for aid in get_ordinals(assets)]
+        if epsilons and epsilons[0] is not None:
+            epsilons = numpy.array(epsilons)  # shape (A, E)
+        else:
+            epsilons = None
+        # sample all the assets at once; ratios has shape (A, E') or (E',)
+        ratios = vf.sample(means, covs, idxs, epsilons)
+        loss_ratios[:, idxs, 0] = ratios
+        if self.insured_losses and loss_type != 'occupants':
+            deductibles, limits = get_insurance(loss_type, assets)
+            loss_ratios[:, idxs, 1] = scientific.insured_losses(
+                numpy.broadcast_to(ratios, (A, idxs.sum())),
+                deductibles[:, None], limits[:, None])
         return loss_ratios
 
 
@@ -380,6 +486,21 @@ class ClassicalBCR(RiskModel):
         self.asset_life_expectancy = asset_life_expectancy
         self.hazard_imtls = hazard_imtls
         self.lrem_steps_per_interval = lrem_steps_per_interval
+        self.lrems = {}
+        self.retro_lrems = {}
+
+    def precompute(self):
+        """
+        Build the loss ratio exceedance matrices for each loss type,
+        for the original and retrofitted vulnerability functions
+        """
+        for lrems, vfs in [(self.lrems, self.risk_functions),
+                           (self.retro_lrems, self.retro_functions)]:
+            for lt, vf in vfs.items():
+                if vf.imt in self.hazard_imtls:
+                    lrems[lt] = scientific.build_lrem(
+                        vf, self.hazard_imtls[vf.imt],
+                        self.lrem_steps_per_interval)
 
     def __call__(self, loss_type, assets, hazard, _eps=None, _eids=None):
         """
@@ -390,19 +511,46 @@ class ClassicalBCR(RiskModel):
         :param _eids: dummy parameter, unused
         :returns: a list of triples (eal_orig, eal_retro, bcr_result)
         """
+        curve_orig, curve_retro = self._loss_ratio_curves(loss_type, hazard)
+        return self._bcr(loss_type, assets, curve_orig, curve_retro)
+
+    def get_outputs(self, assets_list, curves_by_lt):
+        """
+        Compute the original and retrofitted loss ratio curves of all the
+        K hazard curves with a single call to
+        :func:`openquake.risklib.scientific.classical` for each loss type.
+
+        :param assets_list: K arrays of assets with the same taxonomy
+        :param curves_by_lt: arrays of shape (K, L), one per loss type
+        :returns: K ArrayWrappers of shape (L, N, 3)
+        """
+        lrcurves = [self._loss_ratio_curves(lt, curves)
+                    for lt, curves in zip(self.loss_types, curves_by_lt)]
+        return [ArrayWrapper(numpy.array(
+            [self._bcr(lt, assets, origs[k], retros[k])
+             for lt, (origs, retros) in zip(self.loss_types, lrcurves)]),
+            dict(assets=assets)) for k, assets in enumerate(assets_list)]
+
+    def _loss_ratio_curves(self, loss_type, hazard_curves):
         if loss_type != 'structural':
             raise NotImplemented('retrofitted is not defined for ' + loss_type)
-        n = len(assets)
-        self.assets = assets
         vf = self.risk_functions[loss_type]
         imls = self.hazard_imtls[vf.imt]
         vf_retro = self.retro_functions[loss_type]
-        curves_orig = functools.partial(scientific.classical, vf, imls,
-                                        steps=self.lrem_steps_per_interval)
-        curves_retro = functools.partial(scientific.classical, vf_retro, imls,
-                                         steps=self.lrem_steps_per_interval)
-        original_loss_curves = utils.numpy_map(curves_orig, [hazard] * n)
-        retrofitted_loss_curves = utils.numpy_map(curves_retro, [hazard] * n)
+        curves_orig = scientific.classical(
+            vf, imls, hazard_curves, self.lrem_steps_per_interval,
+            self.lrems.get(loss_type))
+        curves_retro = scientific.classical(
+            vf_retro, imls, hazard_curves, self.lrem_steps_per_interval,
+            self.retro_lrems.get(loss_type))
+        return curves_orig, curves_retro
+
+    def _bcr(self, loss_type, assets, curve_orig, curve_retro):
+        # the curves are the same for all the assets
+        n = len(assets)
+        self.assets = assets
+        original_loss_curves = numpy.array([curve_orig] * n)
+        retrofitted_loss_curves = numpy.array([curve_retro] * n)
 
         eal_original = utils.numpy_map(
             scientific.average_loss, original_loss_curves)
@@ -410,12 +558,14 @@ class ClassicalBCR(RiskModel):
         eal_retrofitted = utils.numpy_map(
             scientific.average_loss, retrofitted_loss_curves)
 
+        values = get_values(loss_type, assets)
+        retrofitted = get_retrofitted(assets)
         bcr_results = [
             scientific.bcr(
                 eal_original[i], eal_retrofitted[i],
                 self.interest_rate, self.asset_life_expectancy,
-                asset.value(loss_type), asset.retrofitted())
-            for i, asset in enumerate(assets)]
+                values[i], retrofitted[i])
+            for i in range(n)]
         return list(zip(eal_original, eal_retrofitted, bcr_results))
 
 
@@ -435,7 +585,8 @@ class Scenario(RiskModel):
 
     def __call__(self, loss_type, assets, gmvs_eids, epsgetter):
         gmvs, eids = gmvs_eids
-        epsilons = [epsgetter(asset.ordinal, eids) for asset in assets]
+        epsilons = numpy.array(
+            [epsgetter(aid, eids) for aid in get_ordinals(assets)])
         values = get_values(loss_type, assets, self.time_event)
         ok = ~numpy.isnan(values)
         if not ok.any():
@@ -457,16 +608,13 @@ class Scenario(RiskModel):
         vf = self.risk_functions[loss_type]
         means, covs, idxs = vf.interpolate(gmvs)
         loss_ratio_matrix = numpy.zeros((len(assets), E))
-        for i, eps in enumerate(epsilons):
-            loss_ratio_matrix[i, idxs] = vf.sample(means, covs, idxs, eps)
+        loss_ratio_matrix[:, idxs] = vf.sample(means, covs, idxs, epsilons)
         loss_matrix[:, :, 0] = (loss_ratio_matrix.T * values).T
 
         if self.insured_losses and loss_type != "occupants":
-            deductibles = [a.deductible(loss_type) for a in assets]
-            limits = [a.insurance_limit(loss_type) for a in assets]
-            insured_loss_ratio_matrix = utils.numpy_map(
-                scientific.insured_losses, loss_ratio_matrix,
-                deductibles, limits)
+            deductibles, limits = get_insurance(loss_type, assets)
+            insured_loss_ratio_matrix = scientific.insured_losses(
+                loss_ratio_matrix, deductibles[:, None], limits[:, None])
             loss_matrix[:, :, 1] = (insured_loss_ratio_matrix.T * values).T
 
         return loss_matrix
@@ -490,15 +638,16 @@ class Damage(RiskModel):
         :param assets: a list of N assets of the same taxonomy
         :param gmvs_eids: pairs (gmvs, eids), each one with E elements
         :param _eps: dummy parameter, unused
-        :returns: N arrays of E x D elements
+        :returns: an array of E x D damage fractions, common to all assets
 
-        where N is the number of points, E the number of events
-        and D the number of damage states.
+        where E is the number of events and D the number of damage states.
+        NB: the assets are on the same site and have the same taxonomy,
+        so the fractions are computed only once and not per asset.
         """
         ffs = self.risk_functions[loss_type]
         damages = scientific.scenario_damage(ffs, gmvs_eids[0])  # shape (D, E)
         damages[damages < 1E-7] = 0  # sanity check
-        return [damages.T] * len(assets)
+        return damages.T
 
 
 @registry.add('classical_damage')
@@ -518,6 +667,17 @@ class ClassicalDamage(Damage):
         self.investigation_time = investigation_time
         self.risk_investigation_time = risk_investigation_time
         assert risk_investigation_time, risk_investigation_time
+        self.fragility_poes = {}
+
+    def precompute(self):
+        """
+        Build the PoEs of the fragility functions for each loss type
+        """
+        self.fragility_poes = {
+            lt: scientific.build_fragility_poes(
+                ffl, self.hazard_imtls[ffl.imt])
+            for lt, ffl in self.risk_functions.items()
+            if ffl.imt in self.hazard_imtls}
 
     def __call__(self, loss_type, assets, hazard_curve, _eps=None):
         """
@@ -533,8 +693,9 @@ class ClassicalDamage(Damage):
         damage = scientific.classical_damage(
             ffl, hazard_imls, hazard_curve,
             investigation_time=self.investigation_time,
-            risk_investigation_time=self.risk_investigation_time)
-        return [a.number * damage for a in assets]
+            risk_investigation_time=self.risk_investigation_time,
+            fragility_poes=self.fragility_poes.get(loss_type))
+        return [number * damage for number in get_numbers(assets)]
 
 
 # NB: the approach used here relies on the convention of having the
@@ -27,7 +27,7 @@ import collections
 
 import numpy
 from numpy.testing import assert_equal
-from scipy import interpolate, stats, random
+from scipy import interpolate, stats
 
 from openquake.baselib.general import CallableDict, group_array
 from openquake.hazardlib.stats import compute_stats2
@@ -117,14 +117,16 @@ class VulnerabilityFunction(object):
         self.distribution_name = distribution
 
         # to be set in .init(), called also by __setstate__
-        (self.stddevs, self._mlr_i1d, self._covs_i1d,
-         self.distribution) = None, None, None, None
+        (self.stddevs, self._mlr_i1d, self._covs_i1d, self._i1d,
+         self.distribution) = None, None, None, None, None
         self.init()
 
     def init(self):
         self.stddevs = self.covs * self.mean_loss_ratios
         self._mlr_i1d = interpolate.interp1d(self.imls, self.mean_loss_ratios)
         self._covs_i1d = interpolate.interp1d(self.imls, self.covs)
+        self._i1d = interpolate.interp1d(
+            self.imls, [self.mean_loss_ratios, self.covs])
         self.set_distribution(None)
 
     def set_distribution(self, epsilons=None):
@@ -138,16 +140,18 @@ class VulnerabilityFunction(object):
     def interpolate(self, gmvs):
         """
         :param gmvs:
-           array of intensity measure levels
+           array of intensity measure levels, of any shape, for instance
+           a block (N, E) of GMVs for N sites and E events
         :returns:
            (interpolated loss ratios, interpolated covs, indices > min)
         """
         # gmvs are clipped to max(iml)
-        gmvs_curve = numpy.piecewise(
-            gmvs, [gmvs > self.imls[-1]], [self.imls[-1], lambda x: x])
+        gmvs_curve = numpy.minimum(gmvs, self.imls[-1])
         idxs = gmvs_curve >= self.imls[0]  # indices over the minimum
         gmvs_curve = gmvs_curve[idxs]
-        return self._mlr_i1d(gmvs_curve), self._cov_for(gmvs_curve), idxs
+        # the interpolation of the means and covs is done in a single pass
+        means, covs = self._i1d(gmvs_curve)
+        return means, covs, idxs
 
     def sample(self, means, covs, idxs, epsilons):
         """
@@ -161,9 +165,9 @@ class VulnerabilityFunction(object):
         :param idxs:
            array of E booleans with E >= E'
         :param epsilons:
-           array of E floats
+           array of E floats or array of shape (A, E) for A assets
         :returns:
-           array of E' loss ratios
+           array of E' loss ratios or array of shape (A, E')
         """
         if epsilons is None:
             return means
@@ -173,12 +177,19 @@ class VulnerabilityFunction(object):
     # this is used in the tests, not in the engine code base
     def __call__(self, gmvs, epsilons):
         """
-        A small wrapper around .interpolate and .apply_to
+        A small wrapper around .interpolate and .sample
+
+        :param gmvs: an array of GMVs of shape (E,) or (N, E)
+        :param epsilons: None or an array of epsilons of the same shape
+        :returns: an array of loss ratios of the same shape
         """
+        gmvs = numpy.asarray(gmvs, float)
         means, covs, idxs = self.interpolate(gmvs)
         # for gmvs < min(iml) we return a loss of 0 (default)
-        ratios = numpy.zeros(len(gmvs))
-        ratios[idxs] = self.sample(means, covs, idxs, epsilons)
+        ratios = numpy.zeros(gmvs.shape)
+        ratios[idxs] = self.sample(
+            means, covs, idxs,
+            None if epsilons is None else numpy.asarray(epsilons))
         return ratios
 
     def strictly_increasing(self):
@@ -282,11 +293,11 @@ class VulnerabilityFunction(object):
         # and number of columns equal to the number of imls
         lrem = numpy.empty((loss_ratios.size, self.imls.size), float)
 
-        for row, loss_ratio in enumerate(loss_ratios):
-            for col, (mean_loss_ratio, stddev) in enumerate(
-                    zip(self.mean_loss_ratios, self.stddevs)):
-                lrem[row][col] = self.distribution.survival(
-                    loss_ratio, mean_loss_ratio, stddev)
+        # the survival functions are vectorized on the loss ratios
+        for col, (mean_loss_ratio, stddev) in enumerate(
+                zip(self.mean_loss_ratios, self.stddevs)):
+            lrem[:, col] = self.distribution.survival(
+                loss_ratios, mean_loss_ratio, stddev)
         return loss_ratios, lrem
 
     @utils.memoized
@@ -388,13 +399,12 @@ class VulnerabilityFunctionWithPMF(VulnerabilityFunction):
     def interpolate(self, gmvs):
         """
         :param gmvs:
-           array of intensity measure levels
+           array of intensity measure levels, of any shape
         :returns:
            (interpolated probabilities, None, indices > min)
         """
         # gmvs are clipped to max(iml)
-        gmvs_curve = numpy.piecewise(
-            gmvs, [gmvs > self.imls[-1]], [self.imls[-1], lambda x: x])
+        gmvs_curve = numpy.minimum(gmvs, self.imls[-1])
         idxs = gmvs_curve >= self.imls[0]  # indices over the minimum
         gmvs_curve = gmvs_curve[idxs]
         return self._probs_i1d(gmvs_curve), None, idxs
@@ -404,7 +414,7 @@ class VulnerabilityFunctionWithPMF(VulnerabilityFunction):
         Sample the .loss_ratios with the given probabilities.
 
         :param probs:
-           array of E' floats
+           array of shape (M, E')
         :param _covs:
            ignored, it is there only for API consistency
         :param idxs:
@@ -412,10 +422,10 @@ class VulnerabilityFunctionWithPMF(VulnerabilityFunction):
         :param epsilons:
            array of E floats
         :returns:
-           array of E' probabilities
+           array of E' loss ratios
         """
         self.set_distribution(epsilons)
-        return self.distribution.sample(self.loss_ratios, probs)
+        return self.distribution.sample(self.loss_ratios, probs, idxs)
 
     @utils.memoized
     def loss_ratio_exceedance_matrix(self, steps):
@@ -761,8 +771,7 @@ class DegenerateDistribution(Distribution):
         return means
 
     def survival(self, loss_ratio, mean, _stddev):
-        return numpy.piecewise(
-            loss_ratio, [loss_ratio > mean or not mean], [0, 1])
+        return numpy.where((loss_ratio > mean) | (not mean), 0., 1.)
 
 
 def make_epsilons(matrix, seed, correlation):
@@ -802,7 +811,8 @@ class LogNormalDistribution(Distribution):
         if self.epsilons is None:
             raise ValueError("A LogNormalDistribution must be initialized "
                              "before you can use it")
-        eps = self.epsilons[idxs]
+        # epsilons of shape (E,) or (A, E), means of shape (E',)
+        eps = self.epsilons[..., idxs]
         sigma = numpy.sqrt(numpy.log(covs ** 2.0 + 1.0))
         probs = means / numpy.sqrt(1 + covs ** 2) * numpy.exp(eps * sigma)
         return probs
@@ -813,8 +823,7 @@ class LogNormalDistribution(Distribution):
         # approaches to a step function, otherwise (`mean` == 0) we
         # returns 0
         if stddev == 0:
-            return numpy.piecewise(
-                loss_ratio, [loss_ratio > mean or not mean], [0, 1])
+            return numpy.where((loss_ratio > mean) | (not mean), 0., 1.)
 
         variance = stddev ** 2.0
 
@@ -825,10 +834,15 @@ class LogNormalDistribution(Distribution):
 
 @DISTRIBUTIONS.add('BT')
 class BetaDistribution(Distribution):
-    def sample(self, means, _covs, stddevs, _idxs=None):
+    def sample(self, means, _covs, stddevs, idxs=None):
         alpha = self._alpha(means, stddevs)
         beta = self._beta(means, stddevs)
-        return numpy.random.beta(alpha, beta, size=None)
+        epsilons = getattr(self, 'epsilons', None)
+        if epsilons is None or idxs is None:
+            size = None
+        else:  # one sample per asset and event
+            size = epsilons[..., idxs].shape
+        return numpy.random.beta(alpha, beta, size=size)
 
     def survival(self, loss_ratio, mean, stddev):
         return stats.beta.sf(loss_ratio,
@@ -848,15 +862,23 @@ class BetaDistribution(Distribution):
 class DiscreteDistribution(Distribution):
     seed = None  # to be set
 
-    def sample(self, loss_ratios, probs):
-        ret = []
-        r = numpy.arange(len(loss_ratios))
-        for i in range(probs.shape[1]):
-            random.seed(self.seed + i)
-            # the seed is set inside the loop to avoid block-size dependency
-            pmf = stats.rv_discrete(name='pmf', values=(r, probs[:, i])).rvs()
-            ret.append(loss_ratios[pmf])
-        return ret
+    def sample(self, loss_ratios, probs, idxs=None):
+        """
+        :param loss_ratios: an array of M loss ratios
+        :param probs: an array of probabilities of shape (M, E')
+        :param idxs: an array of E booleans with E >= E', or None
+        :returns: an array of E' loss ratios
+        """
+        # a uniform number for each event, independent from the filtering
+        E = probs.shape[1] if idxs is None else idxs.shape[-1]
+        uniform = numpy.random.RandomState(self.seed).random_sample(E)
+        if idxs is not None:
+            uniform = numpy.broadcast_to(uniform, idxs.shape)[idxs]
+        # lookup in the cumulative distribution, as in scipy.rv_discrete
+        cumprobs = probs.cumsum(axis=0)
+        idx = (uniform * cumprobs[-1] > cumprobs).sum(axis=0)
+        idx = numpy.minimum(idx, len(cumprobs) - 1)
+        return numpy.asarray(loss_ratios)[idx]
 
     def survival(self, loss_ratios, probs):
         """
@@ -887,15 +909,18 @@ CurveParams = collections.namedtuple(
 def scenario_damage(fragility_functions, gmvs):
     """
     :param fragility_functions: a list of D - 1 fragility functions
-    :param gmvs: an array of E ground motion values
-    :returns: an array of (D, E) damage fractions
+    :param gmvs: an array of ground motion values of any shape, for
+        instance (E,) for a single site or (N, E) for N sites
+    :returns: an array of damage fractions of shape (D,) + gmvs.shape
     """
-    lst = [numpy.ones_like(gmvs)]
-    for f, ff in enumerate(fragility_functions):  # D - 1 functions
-        lst.append(ff(gmvs))
-    lst.append(numpy.zeros_like(gmvs))
-    # convert a (D + 1, E) array into a (D, E) array
-    return pairwise_diff(numpy.array(lst))
+    gmvs = numpy.asarray(gmvs)
+    poes = numpy.empty((len(fragility_functions) + 2,) + gmvs.shape)
+    poes[0] = 1
+    for f, ff in enumerate(fragility_functions, 1):  # D - 1 functions
+        poes[f] = ff(gmvs)
+    poes[-1] = 0
+    # convert a (D + 1, ...) array into a (D, ...) array
+    return poes[:-1] - poes[1:]
 
 #
 # Classical Damage
@@ -914,9 +939,38 @@ def annual_frequency_of_exceedence(poe, t_haz):
         return - numpy.log(1. - poe) / t_haz
 
 
+def build_fragility_poes(fragility_functions, hazard_imls):
+    """
+    :param fragility_functions:
+        a list of fragility functions for each damage state
+    :param hazard_imls:
+        Intensity Measure Levels
+    :returns:
+        a pair (imls, poes) with the IMLs where the hazard curves must be
+        interpolated (None if no interpolation is needed) and an array of
+        shape (M, D) with the PoEs of the D fragility functions at the M
+        levels; it does not depend on the hazard curve and can be reused
+    """
+    spi = fragility_functions.steps_per_interval
+    if spi and spi > 1:  # interpolate
+        imls = numpy.array(fragility_functions.interp_imls)
+        min_val, max_val = hazard_imls[0], hazard_imls[-1]
+        assert min_val > 0, hazard_imls  # sanity check
+        numpy.putmask(imls, imls < min_val, min_val)
+        numpy.putmask(imls, imls > max_val, max_val)
+        levels = imls
+    else:
+        imls = None
+        levels = (hazard_imls if fragility_functions.format == 'continuous'
+                  else fragility_functions.imls)
+    poes = numpy.array([list(map(ff, levels))
+                        for ff in fragility_functions]).T
+    return imls, poes
+
+
 def classical_damage(
         fragility_functions, hazard_imls, hazard_poes,
-        investigation_time, risk_investigation_time):
+        investigation_time, risk_investigation_time, fragility_poes=None):
     """
     :param fragility_functions:
         a list of fragility functions for each damage state
@@ -928,33 +982,25 @@ def classical_damage(
         hazard investigation time
     :param risk_investigation_time:
         risk investigation time
+    :param fragility_poes:
+        the output of :func:`build_fragility_poes`, if precomputed
     :returns:
         an array of M probabilities of occurrence where M is the numbers
         of damage states.
     """
-    spi = fragility_functions.steps_per_interval
-    if spi and spi > 1:  # interpolate
-        imls = numpy.array(fragility_functions.interp_imls)
-        min_val, max_val = hazard_imls[0], hazard_imls[-1]
-        assert min_val > 0, hazard_imls  # sanity check
-        numpy.putmask(imls, imls < min_val, min_val)
-        numpy.putmask(imls, imls > max_val, max_val)
+    imls, ff_poes = fragility_poes or build_fragility_poes(
+        fragility_functions, hazard_imls)
+    if imls is not None:  # interpolate
         poes = interpolate.interp1d(hazard_imls, hazard_poes)(imls)
     else:
-        imls = (hazard_imls if fragility_functions.format == 'continuous'
-                else fragility_functions.imls)
         poes = numpy.array(hazard_poes)
     afe = annual_frequency_of_exceedence(poes, investigation_time)
     annual_frequency_of_occurrence = pairwise_diff(
         pairwise_mean([afe[0]] + list(afe) + [afe[-1]]))
-    poes_per_damage_state = []
-    for ff in fragility_functions:
-        frequency_of_exceedence_per_damage_state = numpy.dot(
-            annual_frequency_of_occurrence, list(map(ff, imls)))
-        poe_per_damage_state = 1. - numpy.exp(
-            - frequency_of_exceedence_per_damage_state *
-            risk_investigation_time)
-        poes_per_damage_state.append(poe_per_damage_state)
+    # frequencies of exceedence for each damage state
+    freqs = numpy.dot(annual_frequency_of_occurrence, ff_poes)
+    poes_per_damage_state = list(
+        1. - numpy.exp(- freqs * risk_investigation_time))
     poos = pairwise_diff([1] + poes_per_damage_state + [0])
     return poos
 
@@ -963,39 +1009,59 @@ def classical_damage(
 #
 
 
-def classical(vulnerability_function, hazard_imls, hazard_poes, steps=10):
+def build_lrem(vulnerability_function, hazard_imls, steps=10):
     """
     :param vulnerability_function:
         an instance of
         :py:class:`openquake.risklib.scientific.VulnerabilityFunction`
-        representing the vulnerability function used to compute the curve.
     :param hazard_imls:
-        the hazard intensity measure type and levels
-    :type hazard_poes:
-        the hazard curve
+        the hazard intensity measure levels
     :param int steps:
         Number of steps between loss ratios.
+    :returns:
+        a triple (loss_ratios, lrem, imls) with the C loss ratios, the
+        loss ratio exceedance matrix of shape (C, M) and the M + 1 mean
+        IMLs of the function saturated to the hazard IMLs
     """
-    assert len(hazard_imls) == len(hazard_poes), (
-        len(hazard_imls), len(hazard_poes))
     vf = vulnerability_function
-    imls = vf.mean_imls()
     loss_ratios, lrem = vf.loss_ratio_exceedance_matrix(steps)
+    imls = numpy.clip(vf.mean_imls(), hazard_imls[0], hazard_imls[-1])
+    return loss_ratios, lrem, imls
+
 
-    # saturate imls to hazard imls
-    min_val, max_val = hazard_imls[0], hazard_imls[-1]
-    numpy.putmask(imls, imls < min_val, min_val)
-    numpy.putmask(imls, imls > max_val, max_val)
+def classical(vulnerability_function, hazard_imls, hazard_poes, steps=10,
+              lrem=None):
+    """
+    :param vulnerability_function:
+        an instance of
+        :py:class:`openquake.risklib.scientific.VulnerabilityFunction`
+        representing the vulnerability function used to compute the curve.
+    :param hazard_imls:
+        the hazard intensity measure type and levels
+    :type hazard_poes:
+        the hazard curve, or an array of shape (N, L) with N hazard curves
+    :param int steps:
+        Number of steps between loss ratios.
+    :param lrem:
+        the output of :func:`build_lrem`, if precomputed
+    :returns:
+        an array of shape (2, C), or (N, 2, C) for N hazard curves
+    """
+    hazard_poes = numpy.asarray(hazard_poes)
+    assert len(hazard_imls) == hazard_poes.shape[-1], (
+        len(hazard_imls), hazard_poes.shape[-1])
+    loss_ratios, lrem, imls = lrem or build_lrem(
+        vulnerability_function, hazard_imls, steps)
 
-    # interpolate the hazard curve
+    # interpolate the hazard curves
     poes = interpolate.interp1d(hazard_imls, hazard_poes)(imls)
 
-    # compute the poos
-    pos = pairwise_diff(poes)
-    lrem_po = numpy.empty(lrem.shape)
-    for idx, po in enumerate(pos):
-        lrem_po[:, idx] = lrem[:, idx] * po  # column * po
-    return numpy.array([loss_ratios, lrem_po.sum(axis=1)])
+    # compute the poos and multiply them by the LREM
+    pos = poes[..., :-1] - poes[..., 1:]
+    curves = numpy.empty(pos.shape[:-1] + (2, len(loss_ratios)))
+    curves[..., 0, :] = loss_ratios
+    curves[..., 1, :] = pos.dot(lrem.T)
+    return curves
 
 
 def conditional_loss_ratio(loss_ratios, poes, probability):
@@ -1068,10 +1134,9 @@ def insured_losses(losses, deductible, insured_limit):
     - if the loss is 20 the company pays 20 - 5 = 15
     - if the loss is 101 the company pays 100 - 5 = 95
     """
-    return numpy.piecewise(
-        losses,
-        [losses < deductible, losses > insured_limit],
-        [0, insured_limit - deductible, lambda x: x - deductible])
+    # NB: deductible and insured_limit can also be arrays broadcastable
+    # to the losses, for instance of shape (A, 1) for A assets
+    return numpy.clip(losses, deductible, insured_limit) - deductible
 
 
 def insured_loss_curve(curve, deductible, insured_limit):
@@ -1296,21 +1361,49 @@ def losses_by_period(losses, return_periods, num_events, eff_time):
     >>> losses = [3, 2, 3.5, 4, 3, 23, 11, 2, 1, 4, 5, 7, 8, 9, 13]
     >>> losses_by_period(losses, [1, 2, 5, 10, 20, 50, 100], 20, 100)
     array([ nan,  nan,  0. ,  3.5,  8. , 13. , 23. ])
+
+    The losses can also be a 2D array of shape (A, E); then the curves
+    are computed for each row with a single sort, and the result has
+    shape (A, P).
     """
-    if num_events < len(losses):
+    losses = numpy.asarray(losses)
+    num_losses = losses.shape[-1]
+    if num_events < num_losses:
         raise ValueError(
             'There are not enough events to compute the loss curves: %d'
             % num_events)
-    losses = numpy.sort(losses)
-    num_zeros = num_events - len(losses)
+    losses = numpy.sort(losses, axis=-1)
+    num_zeros = num_events - num_losses
     if num_zeros:
         losses = numpy.concatenate(
-            [numpy.zeros(num_zeros, losses.dtype), losses])
+            [numpy.zeros(losses.shape[:-1] + (num_zeros,), losses.dtype),
+             losses], axis=-1)
     periods = eff_time / numpy.arange(num_events, 0., -1)
     rperiods = [rp if periods[0] <= rp <= periods[-1] else numpy.nan
                 for rp in return_periods]
-    curve = numpy.interp(numpy.log(rperiods), numpy.log(periods), losses)
-    return curve
+    if losses.ndim == 1:
+        return numpy.interp(numpy.log(rperiods), numpy.log(periods), losses)
+    return _interp(numpy.log(rperiods), numpy.log(periods), losses)
+
+
+def _interp(x, xp, fps):
+    # equivalent to numpy.interp(x, xp, fp) for each row fp of the 2D array
+    # fps, for x inside the range of xp or NaN
+    fps = numpy.asarray(fps, numpy.float64)
+    curves = numpy.empty((len(fps), len(x)))
+    if len(xp) == 1:  # numpy.interp returns always the only value
+        curves[:] = fps[:, [0]]
+        return curves
+    curves.fill(numpy.nan)
+    ok = ~numpy.isnan(x)
+    xs = x[ok]
+    j = numpy.clip(numpy.searchsorted(xp, xs, 'right') - 1, 0, len(xp) - 2)
+    slope = (fps[:, j + 1] - fps[:, j]) / (xp[j + 1] - xp[j])
+    res = slope * (xs - xp[j]) + fps[:, j]
+    last = xs == xp[-1]  # numpy.interp returns exactly the last value
+    res[:, last] = fps[:, [-1]]
+    curves[:, ok] = res
+    return curves
 
 
 class LossesByPeriodBuilder(object):
@@ -1357,22 +1450,41 @@ class LossesByPeriodBuilder(object):
         array = numpy.zeros((P, R), self.loss_dt)
         dic = group_array(losses_by_event, 'rlzi')
         for r in dic:
-            num_events = self.num_events[r]
             losses = dic[r]['loss']
             for lti, lt in enumerate(self.loss_dt.names):
-                ls = losses[:, lti].flatten()  # flatten only in ucerf
-                # NB: do not use squeeze or the gmf_ebrisk tests will break
-                lbp = losses_by_period(
-                    ls, self.return_periods, num_events, self.eff_time)
-                array[:, r][lt] = lbp
+                array[:, r][lt] = self.build_losses(losses[:, lti], r)
         return self.pair(array, stats)
 
+    # used in postproc
+    def build_losses(self, losses, rlzi):
+        """
+        :param losses: the aggregate losses of a realization for a loss type
+        :param rlzi: the realization index
+        :returns: an array of P losses by period
+        """
+        ls = losses.flatten()  # flatten only in ucerf
+        # NB: do not use squeeze or the gmf_ebrisk tests will break
+        return losses_by_period(
+            ls, self.return_periods, self.num_events[rlzi], self.eff_time)
+
     # used in event_based_risk
     def build_curve(self, asset_value, loss_ratios, rlzi):
         return asset_value * losses_by_period(
             loss_ratios, self.return_periods,
             self.num_events[rlzi], self.eff_time)
 
+    # used in event_based_risk
+    def build_curves(self, asset_values, loss_ratios, rlzi):
+        """
+        :param asset_values: an array of A asset values
+        :param loss_ratios: an array of loss ratios of shape (A, E)
+        :param rlzi: the realization index
+        :returns: an array of losses of shape (A, P)
+        """
+        return asset_values[:, None] * losses_by_period(
+            loss_ratios, self.return_periods,
+            self.num_events[rlzi], self.eff_time)
+
     # used in event_based_risk
     def build_maps(self, losses, clp, stats=()):
         """
@@ -192,3 +192,19 @@ class ClassicalTestCase(unittest.TestCase):
         for loss, poe in expected_curve:
             numpy.testing.assert_allclose(
                 poe, actual_poes_interp(loss), atol=0.005)
+
+    def test_compute_loss_ratio_curves_many_sites(self):
+        # a single matrix product for N hazard curves, with a precomputed LREM
+        hazard_imls = [0.01, 0.08, 0.17, 0.26, 0.36, 0.55, 0.7]
+        hazard_curves = numpy.array([
+            [0.99, 0.96, 0.89, 0.82, 0.7, 0.4, 0.01],
+            [0.9, 0.8, 0.6, 0.4, 0.2, 0.1, 0.0]])
+        vf = scientific.VulnerabilityFunction(
+            'VF', 'PGA', [0.1, 0.2, 0.4, 0.6], [0.05, 0.08, 0.2, 0.4],
+            [0.5, 0.3, 0.2, 0.1], "LN")
+        lrem = scientific.build_lrem(vf, hazard_imls, 2)
+        curves = scientific.classical(vf, hazard_imls, hazard_curves, 2, lrem)
+        self.assertEqual(curves.shape, (2, 2, 11))
+        for curve, hazard_curve in zip(curves, hazard_curves):
+            numpy.testing.assert_allclose(
+                curve, scientific.classical(vf, hazard_imls, hazard_curve, 2))
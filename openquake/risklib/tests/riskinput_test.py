@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2018 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import numpy
+from openquake.risklib import riskinput
+
+
+class EpsilonMatrixTestCase(unittest.TestCase):
+
+    def test_independent_of_blocking(self):
+        full = riskinput.counter_normal(42, numpy.arange(100),
+                                        numpy.arange(200))
+        self.assertEqual(full.shape, (100, 200))
+        self.assertEqual(full.dtype, numpy.float32)
+        self.assertAlmostEqual(full.mean(), 0, delta=.02)
+        self.assertAlmostEqual(full.std(), 1, delta=.02)
+
+        # the second half of the events, generated on demand
+        eps = riskinput.make_epsilon_getter(100, 200, 0, 42, False)(100, 200)
+        numpy.testing.assert_equal(eps[7], full[7, 100:])
+        numpy.testing.assert_equal(eps[7, [3, 5]], full[7, [103, 105]])
+        numpy.testing.assert_equal(
+            eps.get([9, 2], [0, 99]), full[[9, 2]][:, [100, 199]])
+
+    def test_seed(self):
+        eps1 = riskinput.counter_normal(1, [0], numpy.arange(10))
+        eps2 = riskinput.counter_normal(2, [0], numpy.arange(10))
+        self.assertFalse((eps1 == eps2).any())
@@ -299,6 +299,52 @@ class VulnerabilityFunctionBlockSizeTestCase(unittest.TestCase):
         self.assertEqual(singleblock, multiblock)
 
 
+class VulnerabilityBlockTestCase(unittest.TestCase):
+    # a block (N, E) of GMVs is equivalent to N separate calls
+    def test_block(self):
+        vf = scientific.VulnerabilityFunction(
+            'RM', 'PGA', [0.02, 0.3, 0.5, 0.9, 1.2],
+            [0.05, 0.1, 0.2, 0.4, 0.8], [0.1, 0.2, 0.3, 0.3, 0.3])
+        numpy.random.seed(42)
+        gmvs = numpy.random.uniform(0, 1.5, size=(3, 10))
+        eps = numpy.random.normal(size=(3, 10))
+        block = vf(gmvs, eps)
+        for row in range(3):
+            aaae(block[row], vf(gmvs[row], eps[row]))
+
+    def test_sample_assets(self):
+        # the means are broadcast to the epsilons of shape (A, E)
+        vf = scientific.VulnerabilityFunction(
+            'RM', 'PGA', [0.1, 0.5], [0.1, 0.5], [0.2, 0.2])
+        gmvs = numpy.array([0.05, 0.2, 0.4])
+        eps = numpy.array([[0.1, 0.2, 0.3], [-0.1, -0.2, -0.3]])
+        means, covs, idxs = vf.interpolate(gmvs)
+        ratios = vf.sample(means, covs, idxs, eps)
+        self.assertEqual(ratios.shape, (2, 2))
+        aaae(ratios[1], vf(gmvs, eps[1])[idxs])
+
+
+class DiscreteDistributionTestCase(unittest.TestCase):
+    def test_frequencies(self):
+        dist = scientific.DiscreteDistribution()
+        dist.seed = 42
+        probs = numpy.array([[.2] * 10000, [.5] * 10000, [.3] * 10000])
+        samples = dist.sample(numpy.array([0., .5, 1.]), probs)
+        aaae([(samples == lr).mean() for lr in (0, .5, 1)],
+             [.2, .5, .3], decimal=1)
+
+    def test_independent_of_filtering(self):
+        # the sample for an event does not depend on the other events
+        dist = scientific.DiscreteDistribution()
+        dist.seed = 42
+        loss_ratios = numpy.array([0., .5, 1.])
+        probs = numpy.array([[.2] * 4, [.5] * 4, [.3] * 4])
+        all_events = dist.sample(loss_ratios, probs)
+        idxs = numpy.array([True, False, True, True])
+        some_events = dist.sample(loss_ratios, probs[:, idxs], idxs)
+        aaae(some_events, all_events[idxs])
+
+
 class MeanLossTestCase(unittest.TestCase):
     def test_mean_loss(self):
         vf = scientific.VulnerabilityFunction(
@@ -508,6 +554,22 @@ class FragilityFunctionTestCase(unittest.TestCase):
         self._close_to([0.975, 0.025, 0],
                        scientific.scenario_damage(ffs, 0.075))
 
+    def test_many_sites(self):
+        # the damage fractions can be computed for many sites at once
+        ffs = [
+            scientific.FragilityFunctionDiscrete(
+                'LS1', [0.05, 0.1, 0.3, 0.5, 0.7],
+                [0, 0.05, 0.20, 0.50, 1.00], 0.05),
+            scientific.FragilityFunctionDiscrete(
+                'LS2', [0.05, 0.1, 0.3, 0.5, 0.7],
+                [0, 0.00, 0.05, 0.20, 0.50], 0.05)]
+        gmvs = numpy.array([[0.075, 0.2, 0.8], [0.02, 0.4, 0.6]])
+        damages = scientific.scenario_damage(ffs, gmvs)
+        self.assertEqual(damages.shape, (3, 2, 3))
+        for s in range(2):
+            numpy.testing.assert_allclose(
+                damages[:, s], scientific.scenario_damage(ffs, gmvs[s]))
+
     def _close_to(self, expected, actual):
         numpy.testing.assert_allclose(actual, expected, atol=0.0, rtol=0.05)
 
@@ -583,6 +645,18 @@ class InsuredLossCurveTestCase(unittest.TestCase):
             scientific.insured_loss_curve(curve, 0.1, 0.5))
 
 
+class LossesByPeriodTestCase(unittest.TestCase):
+    def test_many_assets(self):
+        # the curves for an array (A, E) are the same computed row by row
+        losses = numpy.random.RandomState(42).lognormal(
+            size=(5, 15)).astype(numpy.float32)
+        periods = [1, 2, 5, 10, 20, 50, 100]
+        curves = scientific.losses_by_period(losses, periods, 20, 100)
+        expected = [scientific.losses_by_period(ls, periods, 20, 100)
+                    for ls in losses]
+        numpy.testing.assert_equal(curves, expected)
+
+
 class ClassicalDamageTestCase(unittest.TestCase):
     def test_discrete(self):
         hazard_imls = [0.05, 0.2, 0.4, 0.6, 0.8, 1, 1.2, 1.4]